@@ -37,6 +37,7 @@ entry_points={
     'console_scripts': [
         'uncompyle6=uncompyle6.bin.uncompile:main_bin',
         'pydisassemble=uncompyle6.bin.pydisassemble:main',
+        'uncompyle6-server=uncompyle6.bin.server:main',
     ]}
 ftp_url            = None
 install_requires   = ['spark-parser >= 1.5.1, < 1.6.0',
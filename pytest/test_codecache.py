@@ -0,0 +1,67 @@
+import threading
+
+from uncompyle6 import PYTHON_VERSION, PYTHON3, IS_PYPY
+from uncompyle6.codecache import CodeCache, code_digest
+from uncompyle6.semantics.pysource import deparse_code
+
+if PYTHON3:
+    from io import StringIO
+else:
+    from StringIO import StringIO
+
+def outer(a, b=2):
+    def inner(x):
+        return [x, 1]
+    return inner(b)
+
+def deparse(co, cache):
+    out = StringIO()
+    deparse_code(PYTHON_VERSION, co, out, is_pypy=IS_PYPY, code_cache=cache)
+    return out.getvalue()
+
+def test_code_digest():
+    digest, names = code_digest(outer.__code__, PYTHON_VERSION)
+    assert digest == code_digest(outer.__code__, PYTHON_VERSION)[0]
+    assert digest != code_digest(outer.__code__, 2.7)[0]
+    assert digest != code_digest(deparse.__code__, PYTHON_VERSION)[0]
+
+def test_code_cache(tmpdir):
+    expect = deparse(outer.__code__, None)
+    cache = CodeCache(str(tmpdir))
+    assert deparse(outer.__code__, cache) == expect
+    assert cache.hits == 0 and cache.stores > 0
+
+    # Hits from memory, then from disk
+    assert deparse(outer.__code__, cache) == expect
+    assert cache.hits == 1
+    cache = CodeCache(str(tmpdir))
+    assert deparse(outer.__code__, cache) == expect
+    assert cache.hits == 1 and cache.misses == 0
+
+def test_code_cache_eviction(tmpdir):
+    cache = CodeCache(str(tmpdir), max_size=2000)
+    for i in range(20):
+        cache.put('%040x' % i, 'x' * 200)
+    assert cache.evictions > 0
+    assert cache.disk_size <= 2000
+    cache.memory.clear()
+    assert cache.get('%040x' % 0) is None
+    assert cache.get('%040x' % 19) == 'x' * 200
+
+def test_code_cache_threads(tmpdir):
+    # Threads sharing a cache, as the server's do, with evictions from
+    # memory and disk going on all the time
+    cache = CodeCache(str(tmpdir), max_size=4000, max_entries=8)
+    def run(n):
+        for i in range(200):
+            key = '%02d%038x' % (n, i % 20)
+            if cache.get(key) is None:
+                cache.put(key, 'x' * 100)
+    threads = [threading.Thread(target=run, args=(n,)) for n in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert cache.hits + cache.misses == 8 * 200
+    assert cache.stores == cache.misses
+    assert len(cache.memory) <= 8
@@ -1,4 +1,4 @@
-import re
+import re, threading
 from uncompyle6 import PYTHON_VERSION, PYTHON3, IS_PYPY # , PYTHON_VERSION
 from uncompyle6.parser import get_python_parser, python_parser
 from uncompyle6.scanner import get_scanner
@@ -61,3 +61,48 @@ def test_dup_rule():
                   parser_debug={
                       'dups': True, 'transition': False, 'reduce': False,
                       'rules': False, 'errorstack': None, 'context': True})
+
+def test_grammar_cache(tmpdir):
+    from uncompyle6 import parser
+    p1 = get_python_parser(3.4)
+    p1.add_unique_rule('expr ::= LOAD_CONST BUILD_TUPLE_42', 'BUILD_TUPLE_42',
+                       42, {})
+    p2 = get_python_parser(3.4)
+    assert p1 is not p2
+    assert sorted(p2.rule2name) != sorted(p1.rule2name)
+    assert 'expr ::= LOAD_CONST BUILD_TUPLE_42' not in p2.new_rules
+
+    # Round trip through the on-disk form
+    old_dir = parser.GRAMMAR_CACHE_DIR
+    try:
+        parser.set_grammar_cache_dir(str(tmpdir))
+        parser.clear_grammar_cache()
+        p3 = get_python_parser(2.7)
+        assert len(tmpdir.listdir()) == 1
+        parser.clear_grammar_cache()
+        p4 = get_python_parser(2.7)
+        assert p3.__class__ is p4.__class__
+        assert p3.rules == p4.rules
+        assert sorted(p3.rule2func) == sorted(p4.rule2func)
+
+        # A grammar that can't be pickled, here raising TypeError, is
+        # only kept in memory
+        p4.lock = threading.Lock()
+        parser._save_grammar(p4, str(tmpdir.join('bad')))
+        assert len(tmpdir.listdir()) == 1
+    finally:
+        parser.set_grammar_cache_dir(old_dir)
+        parser.clear_grammar_cache()
+
+def test_custom_rules_overlay():
+    from uncompyle6.parser import parse
+    def f(a, b):
+        return [a, b, (a, b, a)], g(a, b, c=1)
+    p = get_python_parser(PYTHON_VERSION, is_pypy=IS_PYPY)
+    rules = dict((lhs, list(r)) for lhs, r in p.rules.items())
+    rule2name = dict(p.rule2name)
+    s = get_scanner(PYTHON_VERSION, IS_PYPY)
+    tokens, customize = s.ingest(f.__code__)
+    parse(p, tokens, customize)
+    assert p.rules == rules
+    assert p.rule2name == rule2name
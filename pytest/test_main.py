@@ -0,0 +1,67 @@
+import os
+
+import uncompyle6.main
+from uncompyle6.main import decompile_file, decompile_many
+
+srcdir = os.path.join(os.path.dirname(__file__), '..', 'test', 'bytecode_2.7')
+
+def pyc_files(n):
+    files = sorted(f for f in os.listdir(srcdir) if f.endswith('.pyc'))[:n]
+    return [os.path.join(srcdir, f) for f in files]
+
+def test_decompile_file(tmpdir):
+    path = pyc_files(1)[0]
+    result = decompile_file(path)
+    assert result['name'] == path
+    assert result['error'] is None
+    assert result['version'] == 2.7 and result['magic_int'] == 62211
+    assert 'Python bytecode 2.7' in result['source']
+    assert result['failures'] == []
+    assert set(result['timings']) >= set(['total', 'load', 'parse'])
+
+    bad = tmpdir.join('bad.pyc')
+    bad.write('garbage')
+    result = decompile_file(str(bad))
+    assert result['error'] and result['version'] is None
+
+def test_decompile_many():
+    paths = pyc_files(6)
+    with open(paths[0], 'rb') as fp:
+        data = fp.read()
+
+    # Items are taken as they are needed
+    taken = []
+    def items():
+        for path in paths:
+            taken.append(path)
+            yield path
+    results = decompile_many(items())
+    first = next(results)
+    assert taken == paths[:1] and first['name'] == paths[0]
+    assert [r['name'] for r in results] == paths[1:]
+
+    results = list(decompile_many([('one.pyc', data)] + paths, numproc=2,
+                                  max_in_flight=2))
+    assert sorted(r['name'] for r in results) == sorted(['one.pyc'] + paths)
+    assert all(r['error'] is None for r in results)
+    by_name = dict((r['name'], r['source']) for r in results)
+    assert by_name['one.pyc'] == by_name[paths[0]]
+
+def test_decompile_many_worker_dies(monkeypatch):
+    paths = pyc_files(3)
+    decompile_item = uncompyle6.main._decompile_item
+    def dying_decompile_item(item, code_cache=None):
+        if item == paths[0]:
+            os._exit(1)
+        elif item == paths[1]:
+            raise RuntimeError('worker bug')
+        return decompile_item(item, code_cache)
+    # The pool workers are forked with this in place
+    monkeypatch.setattr(uncompyle6.main, '_decompile_item',
+                        dying_decompile_item)
+    results = dict((r['name'], r) for r in
+                   decompile_many(paths, numproc=2))
+    assert sorted(results) == sorted(paths)
+    assert 'died' in results[paths[0]]['error']
+    assert 'worker bug' in results[paths[1]]['error']
+    assert results[paths[2]]['error'] is None
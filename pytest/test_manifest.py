@@ -0,0 +1,34 @@
+import os, shutil
+
+from uncompyle6.main import main, output_path
+from uncompyle6.manifest import Manifest
+
+srcdir = os.path.join(os.path.dirname(__file__), '..', 'test', 'bytecode_2.7')
+
+def test_incremental(tmpdir):
+    src = tmpdir.mkdir('src')
+    out = str(tmpdir.join('out'))
+    files = ['00_assign.pyc', '00_pass.pyc', '05_if.pyc']
+    for f in files:
+        shutil.copy(os.path.join(srcdir, f), str(src))
+
+    def run():
+        manifest = Manifest(out)
+        result = main(str(src), out, files, [], manifest=manifest)
+        manifest.save()
+        return result[0], manifest.counts
+
+    assert run() == (3, {'new': 3, 'changed': 0, 'unchanged': 0})
+    for f in files:
+        assert os.path.exists(output_path(out, f))
+    assert run() == (0, {'new': 0, 'changed': 0, 'unchanged': 3})
+
+    # Touching a file doesn't make it changed; new contents or a
+    # missing output do
+    mtime = os.path.getmtime(str(src.join('00_pass.pyc')))
+    os.utime(str(src.join('00_pass.pyc')), (mtime + 10, mtime + 10))
+    shutil.copy(os.path.join(srcdir, '05_ifelse.pyc'),
+                str(src.join('05_if.pyc')))
+    os.remove(output_path(out, '00_assign.pyc'))
+    assert run() == (2, {'new': 0, 'changed': 2, 'unchanged': 1})
+    assert Manifest(out).files['05_if.pyc']['status'] == 'okay'
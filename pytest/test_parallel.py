@@ -0,0 +1,60 @@
+import os
+import uncompyle6.bin.uncompile as uncompile
+from uncompyle6.bin.uncompile import decompile_one, main_parallel
+
+srcdir = os.path.join(os.path.dirname(__file__), '..', 'test', 'bytecode_2.7')
+
+def test_decompile_one(tmpdir):
+    record = decompile_one((srcdir, str(tmpdir), '00_assign.pyc',
+                            [], None, {}))
+    assert record['status'] == 'okay'
+    assert record['filename'] == '00_assign.pyc'
+    assert record['error'] is None
+    assert record['time'] >= 0
+
+def test_decompile_one_crashed(tmpdir):
+    bad = tmpdir.join('bad.pyc')
+    bad.write('garbage')
+    record = decompile_one((str(tmpdir), str(tmpdir), 'bad.pyc',
+                            [], None, {}))
+    assert record['status'] == 'crashed'
+    assert 'Traceback' in record['error']
+
+def test_main_parallel(tmpdir):
+    files = sorted(f for f in os.listdir(srcdir) if f.endswith('.pyc'))[:6]
+    records = main_parallel(srcdir, str(tmpdir), files, [], None, 2)
+    assert sorted(r['filename'] for r in records) == files
+    assert all(r['status'] == 'okay' for r in records)
+
+def dying_decompile_one(args):
+    if args[2] == '00_assign.pyc':
+        os._exit(1)
+    return decompile_one(args)
+
+def test_main_parallel_worker_dies(tmpdir, monkeypatch):
+    # The pool workers are forked with this in place
+    monkeypatch.setattr(uncompile, 'decompile_one', dying_decompile_one)
+    files = ['00_assign.pyc', '00_pass.pyc', '01_class.pyc']
+    records = main_parallel(srcdir, str(tmpdir), files, [], None, 2)
+    by_name = dict((r['filename'], r) for r in records)
+    assert sorted(by_name) == files
+    assert by_name['00_assign.pyc']['status'] == 'crashed'
+    assert 'died' in by_name['00_assign.pyc']['error']
+    assert by_name['00_pass.pyc']['status'] == 'okay'
+    assert by_name['01_class.pyc']['status'] == 'okay'
+
+def unpicklable_decompile_one(args):
+    record = decompile_one(args)
+    if args[2] == '00_assign.pyc':
+        record['error'] = lambda: None
+    return record
+
+def test_main_parallel_job_fails(tmpdir, monkeypatch):
+    monkeypatch.setattr(uncompile, 'decompile_one', unpicklable_decompile_one)
+    files = ['00_assign.pyc', '00_pass.pyc']
+    records = main_parallel(srcdir, str(tmpdir), files, [], None, 2)
+    by_name = dict((r['filename'], r) for r in records)
+    assert sorted(by_name) == files
+    assert by_name['00_assign.pyc']['status'] == 'crashed'
+    assert 'Error' in by_name['00_assign.pyc']['error']
+    assert by_name['00_pass.pyc']['status'] == 'okay'
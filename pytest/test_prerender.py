@@ -0,0 +1,27 @@
+import os
+
+from uncompyle6.main import uncompyle_file
+from uncompyle6.semantics.prerender import Prerenderer
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+srcdir = os.path.join(os.path.dirname(__file__), '..', 'test', 'bytecode_2.7')
+
+def decompile(filename, prerender=None):
+    out = StringIO()
+    uncompyle_file(os.path.join(srcdir, filename), out, prerender=prerender)
+    # Skip the header, which gives the running Python
+    return out.getvalue().split('\n', 4)[-1]
+
+def test_prerender():
+    prerender = Prerenderer(2)
+    try:
+        for filename in ('def0.pyc', '10_class.pyc', '05_abc_class.pyc'):
+            assert decompile(filename, prerender) == decompile(filename)
+        assert prerender.used > 0
+        assert prerender.filename is None and not prerender.jobs
+    finally:
+        prerender.close()
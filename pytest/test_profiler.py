@@ -0,0 +1,110 @@
+import json, os
+
+from xdis.code import iscode
+
+from uncompyle6 import PYTHON_VERSION, PYTHON3, IS_PYPY
+from uncompyle6.parser import ParserError, get_python_parser, parse
+from uncompyle6.profiler import Profiler, peak_rss, reset_peak_rss, rss
+from uncompyle6.ruleprofile import RuleProfiler
+from uncompyle6.scanner import get_scanner
+from uncompyle6.semantics.pysource import deparse_code
+
+if PYTHON3:
+    from io import StringIO
+else:
+    from StringIO import StringIO
+
+def outer(a, b=2):
+    def inner(x):
+        return [x, 1]
+    return inner(b)
+
+def test_profiler():
+    profiler = Profiler()
+    deparse_code(PYTHON_VERSION, outer.__code__, StringIO(),
+                 is_pypy=IS_PYPY, profiler=profiler)
+    phases = {}
+    for record in profiler.records:
+        phases.setdefault(record['code'], []).append(record['phase'])
+    for code in ('outer', 'inner'):
+        assert phases[code] == ['ingest', 'customize', 'parse', 'checker',
+                                'walk'], code
+
+    # inner is walked within outer's walk
+    walks = dict((r['code'], r) for r in profiler.records
+                 if r['phase'] == 'walk')
+    assert walks['outer']['time'] >= walks['inner']['time']
+    assert walks['outer']['self_time'] <= walks['outer']['time']
+
+    out = StringIO()
+    profiler.out = out
+    profiler.flush()
+    assert profiler.records == []
+    lines = out.getvalue().splitlines()
+    assert len(lines) == 10
+    assert json.loads(lines[0])['phase'] == 'ingest'
+
+def test_peak_rss():
+    peak = peak_rss()
+    if peak is None:
+        return
+    assert peak > 0
+    if reset_peak_rss() and rss() is not None:
+        # Nothing much can have been allocated since the reset
+        assert peak_rss() < rss() + 10 * 1024
+
+def test_rule_profiler():
+    expect = StringIO()
+    deparse_code(PYTHON_VERSION, outer.__code__, expect, is_pypy=IS_PYPY)
+    rule_profiler = RuleProfiler()
+    out = StringIO()
+    deparse_code(PYTHON_VERSION, outer.__code__, out, is_pypy=IS_PYPY,
+                 rule_profiler=rule_profiler)
+    # Counting doesn't change the parse
+    assert out.getvalue() == expect.getvalue()
+
+    counts = rule_profiler.counts[PYTHON_VERSION]
+    assert counts[('stmts', ('stmts', 'sstmt'))][1] > 0
+    for rule, (predicted, completed, rejected, reduced,
+               seconds) in counts.items():
+        assert rejected + reduced == completed, rule
+    rows = rule_profiler.rows(PYTHON_VERSION, 'completed')
+    assert rows[0][1][1] >= rows[-1][1][1]
+    assert rule_profiler.unused(PYTHON_VERSION)
+
+    twice = RuleProfiler()
+    twice.merge(rule_profiler)
+    twice.merge(rule_profiler)
+    assert (twice.counts[PYTHON_VERSION][rows[0][0]][1] ==
+            2 * rows[0][1][1])
+
+    report = StringIO()
+    rule_profiler.report(report)
+    assert 'stmts ::= stmts sstmt' in report.getvalue()
+    assert 'never completed' in report.getvalue()
+
+def test_rule_profiler_same_trees():
+    # Counting must not change the parse of any code object of a module
+    # of some size
+    import uncompyle6.chartstats as module
+    path = os.path.splitext(module.__file__)[0] + '.py'
+    with open(path) as fp:
+        codes = [compile(fp.read(), path, 'exec')]
+    scanner = get_scanner(PYTHON_VERSION, IS_PYPY)
+    rule_profiler = RuleProfiler()
+    while codes:
+        co = codes.pop()
+        codes += [c for c in co.co_consts if iscode(c)]
+        trees = []
+        for profile in (False, True):
+            tokens, customize = scanner.ingest(co)
+            p = get_python_parser(PYTHON_VERSION, is_pypy=IS_PYPY)
+            if profile:
+                rule_profiler.instrument_parser(p)
+            try:
+                trees.append(str(parse(p, tokens, customize)))
+            except ParserError as e:
+                trees.append(str(e))
+        assert trees[0] == trees[1], co.co_name
+    counts = rule_profiler.counts[PYTHON_VERSION]
+    assert sum(c[1] for c in counts.values()) > 100
@@ -0,0 +1,193 @@
+import os, threading
+
+from uncompyle6 import PYTHON3
+from uncompyle6.chartstats import ChartMonitor
+from uncompyle6.main import uncompyle_file
+from uncompyle6.parser import ParseBudget
+import uncompyle6.parser as python_parser
+from uncompyle6.semantics.pysource import (
+    TABLE_DIRECT, TABLE_R, compile_format, escape, format_failure)
+
+if PYTHON3:
+    from io import StringIO
+else:
+    from StringIO import StringIO
+
+def test_compile_format():
+    ops, tail = compile_format('%|%[1]{pattr} = %c(%P)\n')
+    assert [op[:3] for op in ops] == [
+        ('', '|', None), ('', '{', 1), (' = ', 'c', None), ('(', 'P', None)]
+    assert ops[1][3][0] == 'pattr'
+    assert tail == ')\n'
+    assert compile_format('%|%[1]{pattr} = %c(%P)\n') is compile_format(
+        '%|%[1]{pattr} = %c(%P)\n')
+
+def test_compile_table_formats():
+    # Every template should compile to the same pieces the escape
+    # regex finds.
+    for table in (TABLE_DIRECT, TABLE_R):
+        for entry in table.values():
+            fmt = entry[0]
+            ops, tail = compile_format(fmt)
+            pieces = [m.group('prefix') for m in escape.finditer(fmt)]
+            assert [op[0] for op in ops] == pieces
+            assert fmt.endswith(tail)
+
+def test_output_buffer():
+    from uncompyle6.semantics.output import OutputBuffer
+    inner = OutputBuffer()
+    inner.write('\n\ndef f():\n')
+    inner.write('    pass\n\n')
+    outer = OutputBuffer()
+    outer.write('x = 1\n')
+    outer.write(inner)
+    assert outer.chunks[1] is inner.chunks[0]
+    assert outer.getvalue() == 'x = 1\n\n\ndef f():\n    pass\n\n'
+    assert len(outer) == len(outer.getvalue())
+
+    lead, body, trail = inner.strip_newlines()
+    assert (lead, body.getvalue(), trail) == (2, 'def f():\n    pass', 2)
+    assert inner.getvalue() == '\n\ndef f():\n    pass\n\n'
+    lead, body, trail = OutputBuffer().strip_newlines()
+    assert (lead, body.chunks, trail) == (0, [], 0)
+
+def test_walkers_in_threads():
+    # Walkers for different bytecode versions each customize their own
+    # tables; running them interleaved must give what each gives alone.
+    test_dir = os.path.join(os.path.dirname(__file__), '..', 'test')
+    paths = [os.path.join(test_dir, 'bytecode_%s' % name) for name in
+             ('2.3/05_try_finally_pass.pyc', '2.4/05_try_finally_pass.pyc',
+              '2.4/10_class.pyc', '2.6/10_class.pyc', '3.4/10_class.pyc')]
+
+    def decompile(path):
+        out = StringIO()
+        uncompyle_file(path, out)
+        return out.getvalue()
+
+    base = dict(TABLE_DIRECT)
+    expect = dict((path, decompile(path)) for path in paths)
+    assert '__module__' not in expect[paths[3]]
+    assert TABLE_DIRECT == base
+
+    results = []
+    def run(path):
+        results.append((path, decompile(path)))
+    threads = [threading.Thread(target=run, args=(path,))
+               for path in paths * 3]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(results) == len(threads)
+    for path, text in results:
+        assert text == expect[path], path
+
+def test_parse_budget():
+    path = os.path.join(os.path.dirname(__file__), '..', 'test',
+                        'bytecode_2.7', '10_class.pyc')
+    failures = []
+    def decompile(budget):
+        out = StringIO()
+        failures[:] = uncompyle_file(path, out, parse_budget=budget)
+        return out.getvalue()
+
+    expect = decompile(None)
+    assert decompile(ParseBudget(max_items=10**7, max_seconds=600)) == expect
+
+    # Running out of budget isn't an error: the instructions are
+    # written out as comments instead.
+    text = decompile(ParseBudget(max_items=5))
+    assert '# decompilation budget exceeded' in text
+    assert 'LOAD_' in text.split('# decompilation budget exceeded')[1]
+    assert failures and failures[0]['reason'] == 'decompilation budget exceeded'
+    assert 'line' in format_failure(failures[0])
+
+def test_parse_budget_genexpr():
+    # Only the generator expression is over budget
+    class GenexprBudget(ParseBudget):
+        def check(self, tokens, sets, i):
+            if tokens and 'YIELD_VALUE' in [t.type for t in tokens]:
+                ParseBudget.check(self, tokens, sets, i)
+
+    path = os.path.join(os.path.dirname(__file__), '..', 'test',
+                        'bytecode_2.7', '11_multi_genexpr.pyc')
+    out = StringIO()
+    failures = uncompyle_file(path, out, parse_budget=GenexprBudget(max_items=5))
+    text = out.getvalue()
+    assert 'def multi_genexpr(blog_posts):' in text
+    assert 'return (__decompilation_failed__)' in text
+    assert [f['code'] for f in failures] == ['<genexpr>']
+    assert failures[0]['reason'] == 'decompilation budget exceeded'
+    listing = text.split('<genexpr>, line')[-1]
+    assert 'decompilation budget exceeded' in listing
+    assert 'YIELD_VALUE' in listing
+
+def test_unparsed_genexpr(monkeypatch):
+    # A generator expression that doesn't parse only loses itself, not
+    # the function it is in.
+    path = os.path.join(os.path.dirname(__file__), '..', 'test',
+                        'bytecode_2.7', '11_multi_genexpr.pyc')
+    parse = python_parser.parse
+    def broken_parse(p, tokens, *args):
+        if 'YIELD_VALUE' in [t.type for t in tokens]:
+            tokens = [t for t in tokens if t.type != 'YIELD_VALUE']
+        return parse(p, tokens, *args)
+    monkeypatch.setattr(python_parser, 'parse', broken_parse)
+
+    out = StringIO()
+    failures = uncompyle_file(path, out)
+    text = out.getvalue()
+    assert 'def multi_genexpr(blog_posts):' in text
+    assert 'return (__decompilation_failed__)' in text
+    assert [f['code'] for f in failures] == ['<genexpr>']
+    assert failures[0]['reason'] == 'decompilation failed'
+    assert failures[0]['listing']
+    assert '#   ' + failures[0]['listing'][0] in text
+
+def test_bounded_memory(tmpdir):
+    path = os.path.join(os.path.dirname(__file__), '..', 'test',
+                        'bytecode_2.7', '10_class.pyc')
+    expect = StringIO()
+    uncompyle_file(path, expect)
+    # The statements are written straight to a file as they are done
+    out = tmpdir.join('10_class.py')
+    with open(str(out), 'w') as fp:
+        uncompyle_file(path, fp, bounded_memory=True)
+    assert out.read() == expect.getvalue()
+
+def test_chart_monitor():
+    path = os.path.join(os.path.dirname(__file__), '..', 'test',
+                        'bytecode_2.7', '10_class.pyc')
+    stats = []
+    warnings = StringIO()
+    monitor = ChartMonitor(stats.append, warnings)
+    uncompyle_file(path, StringIO(), chart_monitor=monitor)
+    assert stats and not warnings.getvalue()
+    assert '<module>' in [s['code'] for s in stats]
+    for s in stats:
+        assert s['sets'] <= s['tokens'] + 1
+        assert s['max_set_items'] <= s['items']
+        assert not s['superlinear']
+
+    # Anything counts as blowing up here
+    stats = []
+    monitor = ChartMonitor(stats.append, warnings, growth=0, min_tokens=1)
+    monitor.filename = '10_class.pyc'
+    uncompyle_file(path, StringIO(), chart_monitor=monitor)
+    assert all(s['superlinear'] for s in stats)
+    first = warnings.getvalue().splitlines()[0]
+    assert 'in 10_class.pyc' in first
+    assert stats[0]['families'][0][0] in first
+
+def test_chunk_size():
+    path = os.path.join(os.path.dirname(__file__), '..', 'test',
+                        'bytecode_2.7', '05_long_list.pyc')
+    expect = StringIO()
+    uncompyle_file(path, expect)
+    stats = []
+    out = StringIO()
+    uncompyle_file(path, out, chunk_size=1,
+                   chart_monitor=ChartMonitor(stats.append))
+    assert out.getvalue() == expect.getvalue()
+    # One parse for each of the two statements
+    assert [s['code'] for s in stats].count('<module>') == 2
@@ -0,0 +1,157 @@
+import threading
+
+from xdis.code import iscode
+
+from uncompyle6 import PYTHON_VERSION, IS_PYPY
+from uncompyle6.scanner import get_scanner
+
+def nested(a, b):
+    def inner(x):
+        while x:
+            try:
+                x -= 1
+            except ValueError:
+                break
+        return x
+    for i in range(a):
+        if i > b:
+            return inner(i)
+    return b
+
+def token_list(tokens):
+    return [(t.type, t.pattr, t.offset) for t in tokens]
+
+def test_scan_context():
+    scanner = get_scanner(PYTHON_VERSION, IS_PYPY)
+    co = nested.__code__
+    tokens, customize = scanner.ingest(co)
+
+    # Per-code-object state is kept on a scan context, not the scanner
+    assert not hasattr(scanner, 'code')
+    assert not hasattr(scanner, 'structs')
+
+    ctx = scanner.scan(co)
+    assert ctx is not scanner and ctx.is_context
+    assert token_list(ctx.tokens) == token_list(tokens)
+    assert ctx.customize == customize
+    assert ctx.structs and ctx.structs[0]['type'] == 'root'
+
+def test_scan_in_threads():
+    scanner = get_scanner(PYTHON_VERSION, IS_PYPY)
+    inner = [c for c in nested.__code__.co_consts if iscode(c)][0]
+    codes = [nested.__code__, inner, test_scan_context.__code__]
+    expect = [token_list(scanner.ingest(co)[0]) for co in codes]
+    errors = []
+
+    def run():
+        try:
+            for _ in range(20):
+                for co, tokens in zip(codes, expect):
+                    assert token_list(scanner.ingest(co)[0]) == tokens
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+
+MODULE = '''\
+a = 1
+b = [a,
+     2]
+if a:
+    c = 3
+d = 4
+for i in b:
+    a += i
+e = 5
+f = 6
+'''
+
+def test_statement_boundaries():
+    scanner = get_scanner(PYTHON_VERSION, IS_PYPY)
+    co = compile(MODULE, '<test>', 'exec')
+    lines = dict(scanner.opc.findlinestarts(co))
+    starts = set(lines[offset]
+                 for offset in scanner.statement_boundaries(co))
+    # Not inside the list display or a block, nor where one ends
+    assert starts == set([2, 4, 7, 10])
+
+def test_op_index():
+    scanner = get_scanner(PYTHON_VERSION, IS_PYPY)
+    ctx = scanner.scan(nested.__code__)
+    code = ctx.code
+    offsets = list(ctx.op_range(0, len(code)))
+    jumps = ctx.opc.hasjrel + ctx.opc.hasjabs
+    for op in set(code[offset] for offset in offsets):
+        expect = [offset for offset in offsets if code[offset] == op]
+        assert ctx.all_instr(0, len(code), op) == expect
+        if expect:
+            assert ctx.first_instr(0, len(code), op) == expect[0]
+            assert ctx.last_instr(0, len(code), op) == expect[-1]
+            # Halfway through the code
+            start = offsets[len(offsets) // 2]
+            assert ctx.all_instr(start, len(code), op) == [
+                offset for offset in expect if offset >= start]
+    for offset in offsets:
+        if code[offset] in jumps:
+            target = ctx.get_target(offset)
+            assert offset in ctx.jumps_to(target)
+            assert ctx.first_instr(0, len(code), code[offset],
+                                   target) <= offset
+
+def test_instructions():
+    scanner = get_scanner(PYTHON_VERSION, IS_PYPY)
+    ctx = scanner.scan(nested.__code__)
+    index = ctx.op_index()
+    assert index.code is ctx.code
+    assert list(index.nexts[:-1]) == list(index.offsets[1:])
+    assert index.nexts[-1] == len(ctx.code)
+    assert [ctx.code[offset] for offset in index.offsets] == list(index.ops)
+    assert list(ctx.op_range(0, len(ctx.code))) == list(index.offsets)
+
+    n = index.offsets[len(index.offsets) // 2]
+    prefix = index.prefix(ctx.code[:n])
+    assert list(prefix.offsets) == [o for o in index.offsets if o < n]
+    for offsets in prefix.by_op.values():
+        assert offsets[-1] < n
+
+def test_decode_from_insts():
+    # Scanner3.ingest() indexes the xdis instructions it has already
+    # decoded; that must give what decode() does on its own.
+    from array import array
+    import os.path as osp
+    from xdis.bytecode import Bytecode
+    from xdis.load import load_module
+    path = osp.join(osp.dirname(__file__), '..', 'test', 'bytecode_3.5',
+                    '10_for.pyc')
+    version, timestamp, magic_int, co = load_module(path)[:4]
+    scanner = get_scanner(version)
+    code = scanner.code = array('B', co.co_code)
+    expect = scanner.decode(code)
+    index = scanner.decode(code, list(Bytecode(co, scanner.opc)))
+    for name in ('offsets', 'ops', 'args', 'nexts'):
+        assert list(getattr(index, name)) == list(getattr(expect, name))
+    assert index.by_op == expect.by_op
+    assert index.by_target == expect.by_target
+
+def test_line_and_prev_tables():
+    scanner = get_scanner(PYTHON_VERSION, IS_PYPY)
+    ctx = scanner.scan(nested.__code__)
+    index = ctx.op_index()
+    for offset, next_offset in zip(index.offsets, index.nexts):
+        if next_offset < len(ctx.prev):
+            assert ctx.prev[next_offset] == offset
+    assert ctx.prev[0] == 0
+    assert ctx.prev[-1] == index.offsets[-1]
+
+    lines = ctx.lines
+    assert lines[-1] == lines[len(lines) - 1]
+    for offset in range(len(lines)):
+        line = lines[offset]
+        assert offset < line.next
+        # The same up to the next line
+        assert lines[min(line.next, len(lines)) - 1] == line
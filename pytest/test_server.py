@@ -0,0 +1,109 @@
+import base64, json, os, subprocess, sys
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+import uncompyle6.server
+from uncompyle6.server import (Server, decompile_request, INTERNAL_ERROR,
+                               INVALID_PARAMS, METHOD_NOT_FOUND)
+
+srcdir = os.path.join(os.path.dirname(__file__), '..', 'test', 'bytecode_2.7')
+
+def rpc(method, params=None, req_id=1):
+    request = {'jsonrpc': '2.0', 'id': req_id, 'method': method}
+    if params is not None:
+        request['params'] = params
+    return json.dumps(request) + '\n'
+
+def test_decompile():
+    server = Server(versions=[2.7])
+    path = os.path.join(srcdir, '00_assign.pyc')
+    result = server.handle(json.loads(rpc('decompile', {'path': path})))
+    result = result['result']
+    assert result['error'] is None
+    assert (result['version'], result['is_pypy']) == (2.7, False)
+    assert 'Python bytecode 2.7' in result['source']
+    assert result['timings']['parse'] >= 0
+
+    with open(path, 'rb') as fp:
+        data = base64.b64encode(fp.read()).decode('ascii')
+    response = server.handle({'id': 2, 'method': 'decompile',
+                              'params': {'data': data, 'name': 'x.pyc'}})
+    assert response['result']['name'] == 'x.pyc'
+    assert response['result']['source'] == result['source']
+
+    # Files that can't be decompiled give an error in the result
+    response = server.handle({'id': 3, 'method': 'decompile',
+                              'params': {'path': path + '-missing.pyc'}})
+    assert response['result']['error']
+
+    response = server.handle({'id': 4, 'method': 'decompile', 'params': {}})
+    assert response['error']['code'] == INVALID_PARAMS
+    assert server.stats(None) == {'requests': 4, 'decompiled': 2,
+                                  'failed': 1}
+
+def dying_decompile_request(params, code_cache=None):
+    if params.get('path', '').endswith('00_assign.pyc'):
+        os._exit(1)
+    return decompile_request(params, code_cache)
+
+def test_pooled_worker_dies(monkeypatch):
+    # The pool workers are forked with this in place
+    monkeypatch.setattr(uncompyle6.server, 'decompile_request',
+                        dying_decompile_request)
+    server = Server(workers=1)
+    try:
+        path = os.path.join(srcdir, '00_assign.pyc')
+        response = server.handle(json.loads(rpc('decompile', {'path': path})))
+        assert response['error']['code'] == INTERNAL_ERROR
+        assert 'died' in response['error']['message']
+
+        # The pool has a new worker for the next request
+        path = os.path.join(srcdir, '00_pass.pyc')
+        response = server.handle(json.loads(rpc('decompile', {'path': path})))
+        assert response['result']['error'] is None
+    finally:
+        server.close()
+
+def test_serve_stdio():
+    server = Server()
+    path = os.path.join(srcdir, '00_assign.pyc')
+    requests = (rpc('decompile', {'path': path}, 1) + 'not json\n' +
+                rpc('frobnicate', req_id=2) + rpc('shutdown', req_id=3) +
+                rpc('stats', req_id=4))
+    out = StringIO()
+    server.serve_stdio(StringIO(requests), out)
+    responses = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert [r['id'] for r in responses] == [1, None, 2, 3]
+    assert responses[0]['result']['error'] is None
+    assert responses[1]['error']['code'] == -32700
+    assert responses[2]['error']['code'] == METHOD_NOT_FOUND
+
+def test_pooled_stdio_parse_error():
+    # The workers' parse error messages must not end up among the
+    # responses.
+    path = os.path.join(srcdir, '00_assign.pyc')
+    with open(path, 'rb') as fp:
+        data = fp.read()
+    # Replace the module's instructions by POP_TOPs and a RETURN_VALUE,
+    # which don't parse.
+    size = 22
+    assert data[25:30] == b's\x16\x00\x00\x00'
+    bad = data[:30] + b'\x01' * (size - 1) + b'S' + data[30 + size:]
+    requests = (rpc('decompile', {'data': base64.b64encode(bad).decode('ascii'),
+                                  'name': 'bad.pyc'}, 1) +
+                rpc('decompile', {'path': path}, 2) +
+                rpc('shutdown', req_id=3))
+    topdir = os.path.join(os.path.dirname(__file__), '..')
+    proc = subprocess.Popen([sys.executable, '-m', 'uncompyle6.bin.server',
+                             '-p', '1'], cwd=topdir,
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE)
+    out, err = proc.communicate(requests.encode('utf-8'))
+    responses = [json.loads(line) for line in out.decode('utf-8').splitlines()]
+    by_id = dict((r['id'], r) for r in responses)
+    assert sorted(by_id) == [1, 2, 3]
+    assert by_id[1]['result']['error']
+    assert by_id[2]['result']['error'] is None
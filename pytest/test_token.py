@@ -0,0 +1,31 @@
+from uncompyle6.scanners.tok import Token
+
+def test_token():
+    t = Token('LOAD_CONST', 1, '1', offset=3, has_arg=True)
+    assert not hasattr(t, '__dict__')
+
+    # Tokens compare equal on type and pattr, and to their type name
+    assert t == Token('LOAD_CONST', 1, '1', offset=10, linestart=5)
+    assert t != Token('LOAD_CONST', 2, '2', offset=3)
+    assert t == 'LOAD_CONST'
+    assert hash(t) == hash('LOAD_CONST')
+    assert t in {'LOAD_CONST': 1}
+
+    # has_arg=False drops the argument
+    t = Token('POP_TOP', 1, '1', has_arg=False)
+    assert t.attr is None and t.pattr is None
+
+    # Position information is only present once it has been set
+    assert not hasattr(t, 'parent')
+    t.start, t.finish = 0, 5
+    assert (t.start, t.finish) == (0, 5)
+
+def test_token_attrs():
+    from uncompyle6.semantics.pysource import eval_format_expr, node_attrs
+    t = Token('LOAD_CONST', 1, '1', offset=3, has_arg=True)
+    attrs = node_attrs(t)
+    assert (attrs['type'], attrs['pattr'], attrs['offset']) == (
+        'LOAD_CONST', '1', 3)
+    assert 'parent' not in attrs
+    # %{...} expressions that aren't plain names work on tokens too
+    assert eval_format_expr(t, (None, compile('pattr * 2', '', 'eval'))) == '11'
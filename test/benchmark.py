@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+# emacs-mode: -*-python-*-
+
+"""
+benchmark.py -- measure decompilation speed over the bytecode corpora
+
+For each test/bytecode_* directory, all files are decompiled and the
+files/sec, tokens/sec, time per phase and peak resident set size are
+reported. Each corpus is run in a separate process so that the peak
+RSS belongs to that corpus alone.
+
+The scaling stress test decompiles growing prefixes of the assignments
+in decompyle/test_extendedarg.py, compiled by the running Python. Its
+constant and name tables grow past the point where EXTENDED_ARG is
+needed.
+
+Usage-Examples:
+
+  # benchmark all corpora and the stress test
+  benchmark.py
+
+  # benchmark two corpora and save the results as a baseline
+  benchmark.py --bytecode-2.7 --bytecode-3.4 --save baseline.json
+
+  # compare against that baseline; exit status 1 on a regression
+  benchmark.py --bytecode-2.7 --bytecode-3.4 --baseline baseline.json
+
+Options:
+  --bytecode-<version>  benchmark test/bytecode_<version>
+  --extendedarg         run the scaling stress test
+  --sizes <n,n,...>     statement counts for the stress test
+  --save <file>         write the results to <file>
+  --baseline <file>     flag regressions against results saved before
+  --threshold <pct>     slowdown or RSS growth flagged as a regression,
+                        by default 10 percent
+"""
+
+from __future__ import print_function
+
+import getopt, json, os, subprocess, sys, time
+
+from uncompyle6 import PYTHON_VERSION, IS_PYPY
+from uncompyle6.main import uncompyle_file
+from uncompyle6.profiler import Profiler
+from uncompyle6.scanner import PYTHON_VERSIONS
+from uncompyle6.semantics.pysource import deparse_code
+from uncompyle6.version import VERSION
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+src_dir = os.path.realpath(os.path.normcase(os.path.dirname(__file__)))
+
+CORPORA = ('1.5',
+           '2.1', '2.2', '2.3', '2.4', '2.5', '2.6', '2.7',
+           '3.0', '3.1', '3.2', '3.3', '3.4', '3.5', '3.6',
+           'pypy2.7', 'pypy3.2')
+
+EXTENDEDARG_SIZES = (64, 256, 1024, 4096, 16384)
+
+def peak_rss_kb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        # bytes rather than kilobytes
+        rss //= 1024
+    return rss
+
+def phase_totals(records):
+    totals = {}
+    for record in records:
+        totals[record['phase']] = (totals.get(record['phase'], 0.0) +
+                                   record['self_time'])
+    return dict((k, round(v, 4)) for k, v in totals.items())
+
+def run_corpus(version):
+    """Decompile every file in the bytecode_<version> corpus and
+    return the measurements."""
+    corpus = os.path.join(src_dir, 'bytecode_%s' % version)
+    files = sorted(f for f in os.listdir(corpus) if f.endswith('.pyc'))
+    profiler = Profiler()
+    failed = 0
+    start = time.time()
+    for f in files:
+        profiler.filename = f
+        try:
+            uncompyle_file(os.path.join(corpus, f), StringIO(),
+                           profiler=profiler)
+        except Exception:
+            failed += 1
+        profiler.flush()
+    elapsed = time.time() - start
+    tokens = sum(r.get('tokens', 0) for r in profiler.records)
+    return {
+        'files': len(files),
+        'failed': failed,
+        'time': round(elapsed, 4),
+        'files_per_sec': round(len(files) / elapsed, 2),
+        'tokens': tokens,
+        'tokens_per_sec': round(tokens / elapsed, 2),
+        'phases': phase_totals(profiler.records),
+        'peak_rss_kb': peak_rss_kb(),
+    }
+
+def run_extendedarg(sizes):
+    """Decompile the first n assignments of test_extendedarg.py for
+    each n in *sizes*. Statements per second should stay roughly flat
+    as n grows."""
+    path = os.path.join(src_dir, 'decompyle', 'test_extendedarg.py')
+    # The rest of the file is Python 2 only
+    stmts = [line for line in open(path) if line.startswith('a')]
+    results = {}
+    for n in sizes:
+        co = compile(''.join(stmts[:n]), path, 'exec')
+        profiler = Profiler()
+        status = 'okay'
+        start = time.time()
+        try:
+            deparse_code(PYTHON_VERSION, co, StringIO(), is_pypy=IS_PYPY,
+                         profiler=profiler)
+        except Exception as e:
+            status = 'failed: %s' % e.__class__.__name__
+        elapsed = time.time() - start
+        results[str(n)] = {
+            'status': status,
+            'time': round(elapsed, 4),
+            'stmts_per_sec': round(n / elapsed, 2),
+            'phases': phase_totals(profiler.records),
+            'peak_rss_kb': peak_rss_kb(),
+        }
+    return results
+
+def run_child(args):
+    """Run "benchmark.py --child args..." in a new process and return
+    the JSON result it prints."""
+    cmd = [sys.executable, os.path.abspath(__file__), '--child'] + args
+    out = subprocess.check_output(cmd)
+    return json.loads(out.decode('utf-8').strip().split('\n')[-1])
+
+def compare(name, new, old, threshold):
+    """Returns a list of regression messages for *new* measured
+    against baseline *old*."""
+    mess = []
+    limit = 1 + threshold / 100.0
+    for key in ('files_per_sec', 'tokens_per_sec', 'stmts_per_sec'):
+        if old.get(key) and new.get(key) and new[key] * limit < old[key]:
+            mess.append('%s: %s fell from %s to %s' %
+                        (name, key, old[key], new[key]))
+    if (old.get('peak_rss_kb') and new.get('peak_rss_kb') and
+        new['peak_rss_kb'] > old['peak_rss_kb'] * limit):
+        mess.append('%s: peak RSS grew from %skB to %skB' %
+                    (name, old['peak_rss_kb'], new['peak_rss_kb']))
+    if old.get('failed', 0) < new.get('failed', 0):
+        mess.append('%s: %d files failed, was %d' %
+                    (name, new['failed'], old['failed']))
+    if old.get('status') == 'okay' and new.get('status', 'okay') != 'okay':
+        mess.append('%s: %s' % (name, new['status']))
+    return mess
+
+def report(results):
+    print('%-16s %6s %7s %9s %11s %10s  %s' %
+          ('corpus', 'files', 'failed', 'files/s', 'tokens/s',
+           'peak kB', 'slowest phases'))
+    for name in sorted(results):
+        if name == 'extendedarg':
+            continue
+        r = results[name]
+        phases = sorted(r['phases'].items(), key=lambda kv: -kv[1])[:3]
+        print('%-16s %6d %7d %9.1f %11.1f %10s  %s' %
+              (name, r['files'], r['failed'], r['files_per_sec'],
+               r['tokens_per_sec'], r['peak_rss_kb'],
+               ', '.join('%s %.2fs' % kv for kv in phases)))
+    if 'extendedarg' in results:
+        print('\nextendedarg scaling (Python %s bytecode)' % PYTHON_VERSION)
+        print('%8s %9s %10s %10s  %s' %
+              ('stmts', 'seconds', 'stmts/s', 'peak kB', 'status'))
+        ea = results['extendedarg']
+        for n in sorted(ea, key=int):
+            r = ea[n]
+            print('%8s %9.3f %10.1f %10s  %s' %
+                  (n, r['time'], r['stmts_per_sec'], r['peak_rss_kb'],
+                   r['status']))
+
+def help():
+    print(__doc__)
+    sys.exit(1)
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--child']:
+        if sys.argv[2] == 'extendedarg':
+            result = run_extendedarg([int(n) for n in sys.argv[3:]])
+        else:
+            result = run_corpus(sys.argv[2])
+        print(json.dumps(result))
+        sys.exit(0)
+
+    corpus_opts = ['bytecode-%s' % v for v in CORPORA]
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'h',
+                                   ['help', 'extendedarg', 'sizes=', 'save=',
+                                    'baseline=', 'threshold='] + corpus_opts)
+    except getopt.GetoptError as e:
+        print(e, file=sys.stderr)
+        help()
+
+    corpora = []
+    do_extendedarg = False
+    sizes = EXTENDEDARG_SIZES
+    save_file = baseline_file = None
+    threshold = 10.0
+    for opt, val in opts:
+        if opt in ('-h', '--help'):
+            help()
+        elif opt == '--extendedarg':
+            do_extendedarg = True
+        elif opt == '--sizes':
+            sizes = [int(n) for n in val.split(',')]
+        elif opt == '--save':
+            save_file = val
+        elif opt == '--baseline':
+            baseline_file = val
+        elif opt == '--threshold':
+            threshold = float(val)
+        elif opt[2:] in corpus_opts:
+            corpora.append(opt[len('--bytecode-'):])
+
+    if not (corpora or do_extendedarg):
+        corpora = list(CORPORA)
+        do_extendedarg = True
+
+    results = {}
+    for version in corpora:
+        if not os.path.isdir(os.path.join(src_dir, 'bytecode_%s' % version)):
+            print("Can't find bytecode_%s. Skipping" % version,
+                  file=sys.stderr)
+            continue
+        results['bytecode_%s' % version] = run_child([version])
+
+    if do_extendedarg:
+        if PYTHON_VERSION in PYTHON_VERSIONS:
+            results['extendedarg'] = run_child(['extendedarg'] +
+                                               [str(n) for n in sizes])
+        else:
+            print("Python %s bytecode isn't supported; no extendedarg test" %
+                  PYTHON_VERSION, file=sys.stderr)
+
+    report(results)
+
+    if save_file:
+        with open(save_file, 'w') as fp:
+            json.dump({'uncompyle6': VERSION, 'python': sys.version,
+                       'results': results}, fp, indent=2, sort_keys=True)
+
+    if baseline_file:
+        with open(baseline_file) as fp:
+            baseline = json.load(fp)['results']
+        regressions = []
+        for name, result in sorted(results.items()):
+            if name == 'extendedarg':
+                for n, r in sorted(result.items()):
+                    old = baseline.get(name, {}).get(n)
+                    if old:
+                        regressions += compare('extendedarg %s' % n,
+                                               r, old, threshold)
+            elif name in baseline:
+                regressions += compare(name, result, baseline[name],
+                                       threshold)
+        if regressions:
+            print('\nRegressions against %s:' % baseline_file)
+            for mess in regressions:
+                print('  ' + mess)
+            sys.exit(1)
+        print('\nNo regressions against %s' % baseline_file)
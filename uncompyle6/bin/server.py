@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# Mode: -*- python -*-
+#
+# Copyright (c) 2017 by Rocky Bernstein
+#
+from __future__ import print_function
+import sys, os, getopt
+
+program = 'uncompyle6-server'
+
+__doc__ = """
+Usage:
+  %s [OPTIONS]
+  %s [--help | -h | --V | --version]
+
+Decompile bytecode files on request, keeping the grammars built for
+each bytecode version from one request to the next. Requests are
+JSON-RPC 2.0 objects, one per line, for example:
+
+  {"jsonrpc": "2.0", "id": 1, "method": "decompile",
+   "params": {"path": "foo.pyc"}}
+
+See uncompyle6/server.py for the methods and their results.
+
+Examples:
+  %s                         # serve on stdin and stdout
+  %s --socket /tmp/u6.sock -p 4 --warm 2.7,3.6
+
+Options:
+  --socket <path>   serve on Unix socket <path> instead of stdin and
+                    stdout
+  -p <integer>      decompile in <integer> worker processes; by default
+                    requests are decompiled in the server process one at
+                    a time
+  --warm <versions> build the grammars for these comma-separated
+                    bytecode versions at start-up
+  --pypy            the --warm versions are PyPy bytecode
+  --cache <dir>     reuse the source of code objects decompiled before,
+                    keeping it in <dir>
+  --help            show this message
+""" % ((program,) * 4)
+
+from uncompyle6.codecache import CodeCache
+from uncompyle6.server import Server
+from uncompyle6.version import VERSION
+
+def usage():
+    print("""usage:
+   %s [--socket <path>] [-p <integer>] [--warm <versions>] [--cache <dir>]
+   %s [--help | -h | --version | -V]
+"""  % (program, program))
+    sys.exit(1)
+
+def main():
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'hVp:',
+                                   'help version socket= warm= pypy '
+                                   'cache='.split(' '))
+    except getopt.GetoptError as e:
+        print('%s: %s' % (program, e), file=sys.stderr)
+        sys.exit(-1)
+
+    socket_path = None
+    options = {}
+    for opt, val in opts:
+        if opt in ('-h', '--help'):
+            print(__doc__)
+            sys.exit(0)
+        elif opt in ('-V', '--version'):
+            print("%s %s" % (program, VERSION))
+            sys.exit(0)
+        elif opt == '--socket':
+            socket_path = val
+        elif opt == '-p':
+            options['workers'] = int(val)
+        elif opt == '--warm':
+            options['versions'] = [float(v) for v in val.split(',')]
+        elif opt == '--pypy':
+            options['is_pypy'] = True
+        elif opt == '--cache':
+            options['code_cache'] = CodeCache(val)
+        else:
+            usage()
+    if args:
+        usage()
+
+    # Keep stray prints away from the responses, also those of the
+    # worker processes Server() starts.
+    out = sys.stdout
+    if not socket_path:
+        sys.stdout = sys.stderr
+    server = Server(**options)
+    try:
+        if socket_path:
+            server.serve_socket(socket_path)
+        else:
+            server.serve_stdio(sys.stdin, out)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+if __name__ == '__main__':
+    main()
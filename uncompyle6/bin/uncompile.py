@@ -5,7 +5,8 @@
 # Copyright (c) 2000-2002 by hartmut Goebel <h.goebel@crazy-compilers.com>
 #
 from __future__ import print_function
-import sys, os, getopt, time
+import sys, os, getopt, signal, time, traceback
+from multiprocessing import Pool, active_children
 
 program, ext = os.path.splitext(os.path.basename(__file__))
 
@@ -32,8 +33,47 @@ Options:
                     -> /tmp/smtplib.pyc_dis ... /tmp/lib-tk/FixTk.pyc_dis
   -c <file>     attempts a disassembly after compiling <file>
   -d            print timestamps
-  -p <integer>  use <integer> number of processes
+  -p <integer>  use <integer> number of processes; files are scheduled
+                largest first
+  --parse-budget <integer>
+                parse each function, class or module with at most
+                <integer> Earley items; what takes more is written as
+                commented disassembly marked
+                "# decompilation budget exceeded"
+  --parse-timeout <seconds>
+                likewise, but limit the time each parse takes
+  --bounded-memory
+                drop syntax trees and text as soon as they have been
+                written out, and report the peak memory use of each
+                file on stderr
+  --chunk-size <integer>
+                parse the statements of a module in runs of at least
+                <integer> tokens, cut where no block is open, rather
+                than all at once. Speeds up very large modules
+  --nested <integer>
+                decompile the functions and methods of each file in
+                <integer> processes; for single large modules. Can't be
+                combined with -p
   -r            recurse directories looking for .pyc and .pyo files
+  --cache <dir> reuse the source of code objects decompiled before,
+                keeping it in <dir>
+  --incremental skip files that haven't changed since they were last
+                decompiled to the -o directory, going by the manifest
+                kept there
+  --profile <file>
+                write the time spent and memory blocks allocated in each
+                decompilation phase, per code object, to <file> as JSON
+                lines. Use '-' for stderr.
+  --profile-rules <file>
+                count how often each grammar rule is predicted,
+                completed and reduced, and the parse time it takes, and
+                write a report sorted by time to <file>. Use '-' for
+                stderr. Turns off --cache and --nested
+  --chart-stats <file>
+                write the size of the Earley chart of each code object
+                parsed to <file> as JSON lines. Use '-' for stderr.
+                Charts that grow faster than the code are warned about
+                on stderr in any case
   --verify      compare generated source with input byte-code
   --linemaps    generated line number correspondencies between byte-code
                 and generated source output
@@ -52,10 +92,32 @@ Extensions of generated files:
 
 program = 'uncompyle6'
 
-from uncompyle6 import verify
-from uncompyle6.main import main, status_msg
+from uncompyle6 import verify, PYTHON3
+from uncompyle6.codecache import CodeCache
+from uncompyle6.main import main, output_path, status_msg
+from uncompyle6.manifest import Manifest
+from uncompyle6.parser import ParseBudget
+from uncompyle6.profiler import Profiler
+from uncompyle6.ruleprofile import RuleProfiler
+from uncompyle6.chartstats import ChartMonitor, json_lines
+from uncompyle6.semantics.prerender import Prerenderer
 from uncompyle6.version import VERSION
 
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+try:
+    from Queue import Queue, Empty
+except ImportError:
+    from queue import Queue, Empty
+
+try:
+    from multiprocessing import SimpleQueue
+except ImportError:
+    from multiprocessing.queues import SimpleQueue
+
 def usage():
     print("""usage:
    %s [--verify] [--asm] [--tree] [--grammar] [-o <path>] FILE|DIR...
@@ -64,6 +126,238 @@ def usage():
     sys.exit(1)
 
 
+# Where a pool worker reports which file it starts on
+_started = None
+
+def _init_worker(started=None):
+    global _started
+    # Let the parent process field Ctrl-C; it terminates the pool.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _started = started
+
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def decompile_one(args):
+    """Decompile a single file inside a pool worker.
+
+    Returns a result record: a dictionary with keys
+      filename  the file name relative to src_base
+      status    one of 'okay', 'failed', 'verify_failed', 'skipped',
+                or 'crashed' when an unexpected exception escaped main()
+      counts    the (tot, okay, failed, verify_failed) tuple from main()
+      time      wall-clock seconds spent on the file
+      error     error text, or None
+      profile   the records of a Profiler, if profiling was asked for
+      rules     the RuleProfiler counts, if rule profiling was asked for
+      charts    the ChartMonitor statistics of the code objects parsed
+    """
+    src_base, out_base, filename, codes, outfile, options = args
+    record = {'filename': filename, 'status': 'okay',
+              'counts': (0, 0, 0, 0), 'time': 0.0, 'error': None}
+    if options.get('profiler'):
+        # Profile records go back to the parent which writes them out.
+        profiler = Profiler()
+        options = dict(options, profiler=profiler)
+        record['profile'] = profiler.records
+    if options.get('rule_profiler'):
+        rule_profiler = RuleProfiler()
+        options = dict(options, rule_profiler=rule_profiler)
+        record['rules'] = rule_profiler.counts
+    if options.get('chart_monitor'):
+        # Warnings and statistics are passed on by the parent.
+        record['charts'] = []
+        chart_monitor = ChartMonitor(record['charts'].append, quiet=True)
+        options = dict(options, chart_monitor=chart_monitor)
+    start = time.time()
+    # main() reports decompilation errors on stderr; keep them
+    # so they can be returned with the record.
+    old_stderr = sys.stderr
+    sys.stderr = errout = StringIO()
+    try:
+        record['counts'] = main(src_base, out_base, [filename], codes,
+                                outfile, **options)
+    except Exception:
+        record['status'] = 'crashed'
+        record['error'] = traceback.format_exc()
+    finally:
+        sys.stderr = old_stderr
+    record['time'] = time.time() - start
+
+    if record['status'] != 'crashed':
+        tot_files, okay_files, failed_files, verify_failed_files = record['counts']
+        if failed_files:
+            record['status'] = 'failed'
+        elif verify_failed_files:
+            record['status'] = 'verify_failed'
+        elif not (tot_files or okay_files):
+            record['status'] = 'skipped'
+        error = errout.getvalue().strip()
+        if error:
+            record['error'] = error
+    return record
+
+
+def _worker_decompile_one(args):
+    if _started is not None:
+        # A SimpleQueue is written to right away, so the parent hears
+        # of the file even if this process dies on it.
+        _started.put((os.getpid(), args[2], time.time()))
+    return decompile_one(args)
+
+
+def main_parallel(src_base, out_base, files, codes, outfile, numproc,
+                  **options):
+    """Decompile *files* using a pool of *numproc* worker processes.
+
+    Files are handed out one at a time, largest first, so that a few
+    big modules are started early instead of holding up the end of the
+    run while the other workers sit idle. Returns the list of result
+    records from decompile_one() in completion order. A file whose
+    worker process dies, say from a segfault or the OOM killer, or whose
+    job fails in the pool, gets a 'crashed' record. On KeyboardInterrupt the pool is terminated and
+    the records for the files finished so far are returned.
+    """
+    files = sorted(files, reverse=True,
+                   key=lambda f: _file_size(os.path.join(src_base, f)))
+    profiler = options.get('profiler')
+    if profiler:
+        # The workers can't share an open file; send them a flag instead.
+        options = dict(options, profiler=True)
+    rule_profiler = options.get('rule_profiler')
+    if rule_profiler:
+        options = dict(options, rule_profiler=True)
+    chart_monitor = options.get('chart_monitor')
+    if chart_monitor:
+        options = dict(options, chart_monitor=True)
+    records = []
+    done = Queue()
+    started = SimpleQueue()
+    pool = Pool(numproc, _init_worker, (started,))
+    try:
+        pending = set(files)
+        # The AsyncResult of each file
+        results = {}
+        for f in files:
+            args = ((src_base, out_base, f, codes, outfile, options),)
+            if PYTHON3:
+                # A job can also fail in the pool itself, say when its
+                # record can't be pickled.
+                error_callback = lambda e, f=f: done.put(_failed_record(f, e))
+                results[f] = pool.apply_async(_worker_decompile_one, args,
+                                              callback=done.put,
+                                              error_callback=error_callback)
+            else:
+                results[f] = pool.apply_async(_worker_decompile_one, args,
+                                              callback=done.put)
+        # The process id of each worker and the file it is on, with
+        # when it started on it
+        running = {}
+        lost = False
+        while pending:
+            try:
+                record = done.get(timeout=0.5)
+            except Empty:
+                crashed = _lost_files(started, running, pending)
+                records += crashed
+                lost = lost or bool(crashed)
+                if not PYTHON3:
+                    # Python 2 has no error_callback; look for failed jobs
+                    records += _failed_files(results, pending)
+                continue
+            pending.discard(record['filename'])
+            records.append(record)
+            if profiler:
+                profiler.write_records(record.pop('profile', []))
+            if rule_profiler:
+                worker_rules = RuleProfiler()
+                worker_rules.counts = record.pop('rules', {})
+                rule_profiler.merge(worker_rules)
+            if chart_monitor:
+                for stats in record.pop('charts', []):
+                    chart_monitor.report(stats)
+            _report_record(record)
+        if lost:
+            # The pool waits for the lost files' results on close()
+            pool.terminate()
+        else:
+            pool.close()
+    except KeyboardInterrupt:
+        pool.terminate()
+        sys.stderr.write("\nInterrupted after %i of %i files\n" %
+                         (len(records), len(files)))
+    finally:
+        pool.join()
+    return records
+
+
+def _lost_files(started, running, pending):
+    """Returns 'crashed' records for the *pending* files whose worker
+    process has died, as told by the (pid, file, start time) messages
+    read from *started* into *running*. They are taken off *pending*.
+    """
+    while not started.empty():
+        pid, filename, start = started.get()
+        running[pid] = (filename, start)
+    alive = set(p.pid for p in active_children())
+    records = []
+    for pid, (filename, start) in list(running.items()):
+        if filename not in pending:
+            del running[pid]
+        elif pid not in alive:
+            del running[pid]
+            pending.discard(filename)
+            record = {'filename': filename, 'status': 'crashed',
+                      'counts': (0, 0, 0, 0),
+                      'time': time.time() - start,
+                      'error': 'worker process %d died' % pid}
+            _report_record(record)
+            records.append(record)
+    return records
+
+
+def _failed_record(filename, e):
+    """Returns the 'crashed' record for *filename*, whose job failed in
+    the pool with exception *e*."""
+    error = ''.join(traceback.format_exception(e.__class__, e,
+                                               e.__traceback__))
+    return {'filename': filename, 'status': 'crashed',
+            'counts': (0, 0, 0, 0), 'time': 0.0, 'error': error}
+
+
+def _failed_files(results, pending):
+    """Returns 'crashed' records for the *pending* files whose
+    AsyncResult in *results* is an exception. They are taken off
+    *pending*."""
+    records = []
+    for filename in sorted(pending):
+        result = results[filename]
+        if result.ready() and not result.successful():
+            pending.discard(filename)
+            try:
+                result.get()
+            except Exception:
+                record = {'filename': filename, 'status': 'crashed',
+                          'counts': (0, 0, 0, 0), 'time': 0.0,
+                          'error': traceback.format_exc()}
+            _report_record(record)
+            records.append(record)
+    return records
+
+
+def _report_record(record):
+    if record['status'] in ('failed', 'crashed', 'verify_failed'):
+        sys.stderr.write("\n# %s: %s\n" % (record['filename'],
+                                          record['status']))
+        if record['error']:
+            sys.stderr.write(record['error'] + "\n")
+
+
 def main_bin():
     if not (sys.version_info[0:2] in ((2, 6), (2, 7),
                                       (3, 1), (3, 2), (3, 3),
@@ -72,18 +366,23 @@ def main_bin():
               file=sys.stderr)
         sys.exit(-1)
 
-    do_verify = recurse_dirs = False
+    do_verify = recurse_dirs = incremental = False
     numproc = 0
     outfile = '-'
     out_base = None
     codes = []
     timestamp = False
     timestampfmt = "# %Y.%m.%d %H:%M:%S %Z"
+    chart_stats = None
 
     try:
         opts, files = getopt.getopt(sys.argv[1:], 'hagtdrVo:c:p:',
                                     'help asm grammar linemaps recurse timestamp tree '
-                                    'verify version showgrammar'.split(' '))
+                                    'verify version showgrammar cache= profile= '
+                                    'incremental nested= parse-budget= '
+                                    'parse-timeout= bounded-memory '
+                                    'profile-rules= chart-stats= '
+                                    'chunk-size='.split(' '))
     except getopt.GetoptError as e:
         print('%s: %s' % (os.path.basename(sys.argv[0]), e),  file=sys.stderr)
         sys.exit(-1)
@@ -118,10 +417,46 @@ def main_bin():
             numproc = int(val)
         elif opt in ('--recurse', '-r'):
             recurse_dirs = True
+        elif opt == '--incremental':
+            incremental = True
+        elif opt == '--parse-budget':
+            budget = options.setdefault('parse_budget', ParseBudget())
+            budget.max_items = int(val)
+        elif opt == '--parse-timeout':
+            budget = options.setdefault('parse_budget', ParseBudget())
+            budget.max_seconds = float(val)
+        elif opt == '--bounded-memory':
+            options['bounded_memory'] = True
+        elif opt == '--chunk-size':
+            options['chunk_size'] = int(val)
+        elif opt == '--nested':
+            options['prerender'] = Prerenderer(int(val))
+        elif opt == '--cache':
+            options['code_cache'] = CodeCache(val)
+        elif opt == '--profile':
+            if val == '-':
+                options['profiler'] = Profiler(sys.stderr)
+            else:
+                # Records are appended file by file
+                open(val, 'w').close()
+                options['profiler'] = Profiler(val)
+        elif opt == '--chart-stats':
+            chart_stats = val
+        elif opt == '--profile-rules':
+            options['rule_profiler'] = RuleProfiler()
+            rule_report = val
         else:
             print(opt, file=sys.stderr)
             usage()
 
+    if chart_stats == '-':
+        chart_out = sys.stderr
+    elif chart_stats:
+        chart_out = open(chart_stats, 'w')
+    else:
+        chart_out = None
+    options['chart_monitor'] = ChartMonitor(chart_out and json_lines(chart_out))
+
     # expand directory if specified
     if recurse_dirs:
         expanded_files = []
@@ -154,13 +489,26 @@ def main_bin():
     elif outfile and len(files) > 1:
         out_base = outfile; outfile = None
 
+    if numproc > 1 and 'prerender' in options:
+        # Pool workers can't have worker processes of their own
+        print("--nested can't be combined with -p", file=sys.stderr)
+        sys.exit(-1)
+
+    manifest = None
+    if incremental:
+        if not out_base:
+            print("--incremental needs an output directory; use -o",
+                  file=sys.stderr)
+            sys.exit(-1)
+        manifest = Manifest(out_base)
+
     if timestamp:
         print(time.strftime(timestampfmt))
 
     if numproc <= 1:
         try:
             result = main(src_base, out_base, files, codes, outfile,
-                          **options)
+                          manifest=manifest, **options)
             if len(files) > 1:
                 mess = status_msg(do_verify, *result)
                 print('# ' + mess)
@@ -169,60 +517,52 @@ def main_bin():
             pass
         except verify.VerifyCmpError:
             raise
+        finally:
+            if manifest:
+                manifest.save()
+            if 'prerender' in options:
+                options['prerender'].close()
     else:
-        from multiprocessing import Process, Queue
+        if manifest:
+            files = [f for f in files
+                     if manifest.check(f, os.path.join(src_base, f),
+                                       output_path(out_base, f))
+                     != 'unchanged']
+        records = main_parallel(src_base, out_base, files, codes, outfile,
+                                numproc, **options)
+        if manifest:
+            for record in records:
+                if record['status'] in ('okay', 'failed', 'verify_failed'):
+                    manifest.record(record['filename'],
+                                    os.path.join(src_base,
+                                                 record['filename']),
+                                    record['status'])
+            manifest.save()
+        (tot_files, okay_files, failed_files, verify_failed_files) = (0, 0, 0, 0)
+        for record in records:
+            t, o, f, v = record['counts']
+            tot_files += t
+            okay_files += o
+            failed_files += f
+            verify_failed_files += v
+            if record['status'] == 'crashed':
+                tot_files += 1
+                failed_files += 1
+        print('# decompiled %i files: %i okay, %i failed, %i verify failed' %
+              (tot_files, okay_files, failed_files, verify_failed_files))
 
-        try:
-            from Queue import Empty
-        except ImportError:
-            from Queue import Empty
-
-        fqueue = Queue(len(files)+numproc)
-        for f in files:
-            fqueue.put(f)
-        for i in range(numproc):
-            fqueue.put(None)
+    if manifest:
+        print('# incremental: ' + manifest.summary())
 
-        rqueue = Queue(numproc)
-
-        def process_func():
-            try:
-                (tot_files, okay_files, failed_files, verify_failed_files) = (0, 0, 0, 0)
-                while 1:
-                    f = fqueue.get()
-                    if f is None:
-                        break
-                    (t, o, f, v) = \
-                      main(src_base, out_base, [f], codes, outfile, **options)
-                    tot_files += t
-                    okay_files += o
-                    failed_files += f
-                    verify_failed_files += v
-            except (Empty, KeyboardInterrupt):
-                pass
-            rqueue.put((tot_files, okay_files, failed_files, verify_failed_files))
-            rqueue.close()
+    if 'rule_profiler' in options:
+        if rule_report == '-':
+            options['rule_profiler'].report(sys.stderr)
+        else:
+            with open(rule_report, 'w') as out:
+                options['rule_profiler'].report(out)
 
-        try:
-            procs = [Process(target=process_func) for i in range(numproc)]
-            for p in procs:
-                p.start()
-            for p in procs:
-                p.join()
-            try:
-                (tot_files, okay_files, failed_files, verify_failed_files) = (0, 0, 0, 0)
-                while True:
-                    (t, o, f, v) = rqueue.get(False)
-                    tot_files += t
-                    okay_files += o
-                    failed_files += f
-                    verify_failed_files += v
-            except Empty:
-                pass
-            print('# decompiled %i files: %i okay, %i failed, %i verify failed' %
-                  (tot_files, okay_files, failed_files, verify_failed_files))
-        except (KeyboardInterrupt, OSError):
-            pass
+    if chart_out and chart_out is not sys.stderr:
+        chart_out.close()
 
     if timestamp:
         print(time.strftime(timestampfmt))
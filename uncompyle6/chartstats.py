@@ -0,0 +1,168 @@
+#  Copyright (c) 2017 by Rocky Bernstein
+"""
+Earley chart statistics, and warnings about charts that blow up.
+
+A ChartMonitor attached to a parser gathers, for each code object
+parsed:
+
+  tokens          the number of tokens parsed
+  sets            the number of Earley sets built
+  items           the number of Earley items in all of them
+  max_set_items   the number of items in the largest set
+  max_set_offset  the offset of the instruction at the largest set
+  resolutions     how often PythonParser.resolve() had to pick between
+                  rules
+  ambiguities     those choices: the rule families, that is the p_
+                  methods of the grammar, that were chosen between,
+                  with how often
+  families        the rule families with the most items in the
+                  largest set
+
+When parsing is linear in the number of tokens, Earley sets stay about
+the same size however long the code is. When the largest set grows
+along with the number of tokens, parsing goes quadratic or worse;
+such a parse is marked 'superlinear' and a warning naming the code
+object and the rule families in the largest set is written out.
+
+Each parse's statistics are passed as a dictionary to the callback
+given, e.g. to write them out as JSON lines.
+"""
+
+import json, sys
+
+class ChartMonitor(object):
+    """Gathers chart statistics from the parsers given it; see
+    SourceWalker's *chart_monitor*.
+
+    *callback* is called with the dictionary of statistics of each
+    parse. Warnings are written to *out*, sys.stderr by default, unless
+    *quiet* is set. A parse
+    of at least *min_tokens* tokens whose largest set has at least
+    *growth* items per token counts as superlinear.
+    """
+
+    def __init__(self, callback=None, out=None, quiet=False, growth=0.5,
+                 min_tokens=200, max_families=5):
+        self.callback = callback
+        self.out = out
+        self.quiet = quiet
+        self.growth = growth
+        self.min_tokens = min_tokens
+        self.max_families = max_families
+        self.filename = None
+        # Maps the id of the customize dictionary that
+        # scanner.ingest() returned to the code object ingested
+        self.code_for = {}
+        self.stats = None
+        self.largest = None
+
+    def instrument_scanner(self, scanner):
+        """Remember which code object each customize dictionary that
+        scanner.ingest() returns belongs to, so that statistics can be
+        labelled with it."""
+        ingest = scanner.ingest
+        def labelled_ingest(co, *args, **kwargs):
+            tokens, customize = ingest(co, *args, **kwargs)
+            # Keep customize alive so its id isn't reused
+            self.code_for[id(customize)] = (customize, co)
+            return tokens, customize
+        scanner.ingest = labelled_ingest
+
+    def start(self, tokens, customize):
+        """Called when the parse of *tokens* starts."""
+        co = self.code_for.get(id(customize), (None, None))[1]
+        self.stats = {
+            'file': self.filename,
+            'code': co.co_name if co is not None else None,
+            'line': getattr(co, 'co_firstlineno', None),
+            'tokens': len(tokens),
+            'sets': 0,
+            'items': 0,
+            'max_set_items': 0,
+            'max_set_offset': None,
+            'resolutions': 0,
+            'ambiguities': {},
+        }
+        self.largest = None
+
+    def set_done(self, tokens, sets, i):
+        """Called after Earley set *i* of *sets* has been completed."""
+        stats = self.stats
+        n = len(sets[i])
+        stats['sets'] += 1
+        stats['items'] += n
+        if n > stats['max_set_items']:
+            stats['max_set_items'] = n
+            if tokens and i < len(tokens):
+                stats['max_set_offset'] = getattr(tokens[i], 'offset', None)
+            self.largest = sets[i]
+
+    def resolved(self, names):
+        """Called when the parser had to choose between the rule
+        families *names*."""
+        ambiguities = self.stats['ambiguities']
+        key = ' '.join(names)
+        ambiguities[key] = ambiguities.get(key, 0) + 1
+        self.stats['resolutions'] += 1
+
+    def families(self, p, items):
+        """Returns (rule family, count) pairs for the Earley *items*
+        of parser *p*, most frequent first."""
+        counts = {}
+        for state, parent in items:
+            for rule, pos in p.states[state].items:
+                name = p.rule2name.get(p.new2old.get(rule, rule), rule[0])
+                counts[name] = counts.get(name, 0) + 1
+        return sorted(counts.items(),
+                      key=lambda item: (-item[1], item[0]))[:self.max_families]
+
+    def is_superlinear(self, stats):
+        return (stats['tokens'] >= self.min_tokens and
+                stats['max_set_items'] >= self.growth * stats['tokens'])
+
+    def finish(self, p):
+        """Called when parser *p* is done, whether or not the parse
+        succeeded. *p*'s tables must still be those it parsed with."""
+        stats, self.stats = self.stats, None
+        if stats is None:
+            return
+        stats['families'] = self.families(p, self.largest or [])
+        self.largest = None
+        self.report(stats)
+
+    def report(self, stats):
+        """Pass on the statistics of a parse: warn if it was
+        superlinear, then hand it to the callback."""
+        stats['superlinear'] = self.is_superlinear(stats)
+        if stats['superlinear'] and not self.quiet:
+            out = self.out or sys.stderr
+            out.write(format_warning(stats) + "\n")
+        if self.callback is not None:
+            self.callback(stats)
+
+    def clear(self):
+        """Forget the code objects seen so far; call at the end of each
+        file."""
+        self.code_for = {}
+
+def json_lines(out):
+    """Returns a ChartMonitor callback that writes the statistics to
+    file-like *out* as JSON lines."""
+    def write(stats):
+        out.write(json.dumps(stats, sort_keys=True) + "\n")
+        out.flush()
+    return write
+
+def format_warning(stats):
+    """Returns the warning text for a superlinear parse *stats*."""
+    where = stats['code'] or 'code object'
+    if stats['line']:
+        where += ' (line %s)' % stats['line']
+    if stats['file']:
+        where = '%s in %s' % (where, stats['file'])
+    families = ', '.join('%s (%d)' % family for family in stats['families'])
+    return ("# warning: Earley chart for %s grows faster than its %d "
+            "tokens: %d items, %d in the largest set at offset %s; "
+            "rule families there: %s" %
+            (where, stats['tokens'], stats['items'], stats['max_set_items'],
+             stats['max_set_offset'], families or 'none'))
@@ -0,0 +1,222 @@
+#  Copyright (c) 2017 by Rocky Bernstein
+"""
+Content-addressed cache of decompiled source text.
+
+Vendored libraries and generated code mean the same function bodies
+show up in many bytecode files. A code object is identified by a hash
+of everything in it that can affect decompilation (the bytecode,
+constants, names, line-number table and so on, recursively for nested
+code objects) along with the bytecode version. The cache maps such a
+key to the source text generated for it, so that a later hit can skip
+ingest, parsing and semantic analysis.
+
+Entries live in memory and, if a directory is given, on disk. The disk
+store is bounded in size; the least-recently used entries are evicted
+first.
+"""
+
+import hashlib, os, pickle, threading
+
+from xdis.code import iscode
+
+from uncompyle6 import PYTHON3
+from uncompyle6.version import VERSION
+
+def _to_bytes(s):
+    if PYTHON3 and isinstance(s, str):
+        return s.encode('latin-1')
+    return s
+
+def _hash_const(h, const, names):
+    if iscode(const):
+        h.update(b'<code>')
+        _hash_code(h, const, names)
+    elif isinstance(const, (tuple, list)):
+        h.update(_to_bytes(type(const).__name__ + '('))
+        for c in const:
+            _hash_const(h, c, names)
+        h.update(b')')
+    elif isinstance(const, (set, frozenset)):
+        # Iteration order of sets depends on string hashing
+        h.update(_to_bytes('%s(%s)' % (type(const).__name__,
+                                       sorted(repr(c) for c in const))))
+    else:
+        h.update(repr(const).encode('utf-8'))
+        h.update(_to_bytes(' ' + type(const).__name__ + ';'))
+
+def _hash_code(h, co, names):
+    for attr in ('co_name', 'co_argcount', 'co_kwonlyargcount', 'co_nlocals',
+                 'co_flags', 'co_names', 'co_varnames', 'co_freevars',
+                 'co_cellvars'):
+        h.update(repr(getattr(co, attr, None)).encode('utf-8'))
+    h.update(_to_bytes(co.co_code))
+    h.update(_to_bytes(getattr(co, 'co_lnotab', b'')))
+    names.update(co.co_names)
+    for const in co.co_consts:
+        _hash_const(h, const, names)
+
+def code_digest(co, version, is_pypy=False):
+    """Returns a pair: a hex digest identifying code object *co* as
+    compiled by Python *version*, and the set of names that *co* and
+    the code objects nested in it refer to. The file name and first
+    line number are not part of the digest.
+    """
+    h = hashlib.sha1()
+    h.update(_to_bytes('%s %s %s\n' % (VERSION, version, is_pypy)))
+    names = set()
+    _hash_code(h, co, names)
+    return h.hexdigest(), names
+
+def cache_key(digest, *context):
+    """Combine a code digest with whatever else the generated text
+    depends on into a single cache key."""
+    h = hashlib.sha1()
+    h.update(_to_bytes(digest))
+    h.update(repr(context).encode('utf-8'))
+    return h.hexdigest()
+
+class CodeCache(object):
+    """A size-bounded cache of decompiled source keyed by cache_key().
+
+    *dirname* is the directory for the on-disk store; if it is None
+    only the in-memory layer is used. *max_size* bounds the total
+    size in bytes of the files on disk, and *max_entries* the number
+    of entries held in memory. hits, misses, stores and evictions
+    count what happened so far.
+
+    A CodeCache can be shared by threads; each call is done under a
+    lock.
+    """
+
+    def __init__(self, dirname=None, max_size=64*1024*1024,
+                 max_entries=4096):
+        self.dirname = dirname
+        self.max_size = max_size
+        self.max_entries = max_entries
+        self.hits = self.misses = self.stores = self.evictions = 0
+        self.memory = {}
+        self.tick = 0
+        self.disk_size = None
+        self.lock = threading.RLock()
+
+    def __getstate__(self):
+        # The in-memory layer isn't worth shipping to other processes
+        state = self.__dict__.copy()
+        state['memory'] = {}
+        state['disk_size'] = None
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.RLock()
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'stores': self.stores, 'evictions': self.evictions}
+
+    def _path(self, key):
+        return os.path.join(self.dirname, key[:2], key[2:])
+
+    def get(self, key):
+        """Returns the value stored for *key*, or None."""
+        with self.lock:
+            return self._get(key)
+
+    def _get(self, key):
+        self.tick += 1
+        if key in self.memory:
+            self.memory[key][0] = self.tick
+            self.hits += 1
+            return self.memory[key][1]
+        if self.dirname:
+            path = self._path(key)
+            try:
+                with open(path, 'rb') as fp:
+                    value = pickle.load(fp)
+                # Record the access for LRU eviction
+                os.utime(path, None)
+            except Exception:
+                pass
+            else:
+                self._remember(key, value)
+                self.hits += 1
+                return value
+        self.misses += 1
+        return None
+
+    def put(self, key, value):
+        """Store *value*, which must be picklable, under *key*."""
+        with self.lock:
+            self.tick += 1
+            self._remember(key, value)
+            self.stores += 1
+            if self.dirname:
+                self._write(key, value)
+
+    def _remember(self, key, value):
+        if len(self.memory) >= self.max_entries:
+            # Drop the least recently used quarter
+            by_age = sorted(self.memory.items(), key=lambda kv: kv[1][0])
+            for k, _ in by_age[:max(1, self.max_entries // 4)]:
+                del self.memory[k]
+        self.memory[key] = [self.tick, value]
+
+    def _write(self, key, value):
+        path = self._path(key)
+        tmp_path = '%s.%d' % (path, os.getpid())
+        try:
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(tmp_path, 'wb') as fp:
+                pickle.dump(value, fp, 2)
+            os.rename(tmp_path, path)
+            size = os.path.getsize(path)
+        except (IOError, OSError):
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        if self.disk_size is None:
+            self.disk_size = sum(size for _, size, _ in self._disk_entries())
+        else:
+            self.disk_size += size
+        if self.disk_size > self.max_size:
+            self.evict()
+
+    def _disk_entries(self):
+        entries = []
+        for root, _, files in os.walk(self.dirname):
+            for f in files:
+                path = os.path.join(root, f)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def evict(self, target=None):
+        """Remove least recently used files from the disk store until
+        it is below *target* bytes, by default 90% of max_size."""
+        if target is None:
+            target = self.max_size * 9 // 10
+        with self.lock:
+            entries = sorted(self._disk_entries())
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in entries:
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                self.evictions += 1
+            self.disk_size = total
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+            if self.dirname:
+                self.evict(0)
@@ -1,22 +1,67 @@
 from __future__ import print_function
-import datetime, os, subprocess, sys, tempfile
+import datetime, os, signal, subprocess, sys, tempfile, time
+from multiprocessing import Pool, active_children
 
-from uncompyle6 import verify, IS_PYPY
+try:
+    import Queue as queue
+    from StringIO import StringIO
+except ImportError:
+    import queue
+    from io import StringIO
+
+try:
+    from multiprocessing import SimpleQueue
+except ImportError:
+    from multiprocessing.queues import SimpleQueue
+
+from uncompyle6 import verify, IS_PYPY, PYTHON3
 from xdis.code import iscode
 from uncompyle6.disas import check_object_path
 from uncompyle6.semantics import pysource
 from uncompyle6.parser import ParserError
 from uncompyle6.version import VERSION
 from uncompyle6.linenumbers import line_number_mapping
+from uncompyle6.profiler import Profiler, peak_rss, phase, reset_peak_rss
 
 from xdis.load import load_module
 
 def uncompyle(
         bytecode_version, co, out=None, showasm=None, showast=False,
         timestamp=None, showgrammar=False, code_objects={},
-        source_size=None, is_pypy=False, magic_int=None):
+        source_size=None, is_pypy=False, magic_int=None, code_cache=None,
+        profiler=None, prerender=None, parse_budget=None,
+        bounded_memory=False, rule_profiler=None, chart_monitor=None,
+        chunk_size=None):
     """
     ingests and deparses a given code block 'co'
+
+    *code_cache* is an optional uncompyle6.codecache.CodeCache of
+    previously decompiled code objects.
+
+    *profiler* is an optional uncompyle6.profiler.Profiler in which to
+    record the time spent in each decompilation phase.
+
+    *prerender* is an optional uncompyle6.semantics.prerender.Prerenderer
+    to decompile the functions in 'co' with in parallel.
+
+    *parse_budget* is an optional uncompyle6.parser.ParseBudget; code
+    objects that take more to parse are written as commented
+    disassembly instead.
+
+    With *bounded_memory*, what has been written to *out* is dropped
+    rather than kept until the end.
+
+    *rule_profiler* is an optional uncompyle6.ruleprofile.RuleProfiler
+    in which to count the use of each grammar rule.
+
+    *chart_monitor* is an optional uncompyle6.chartstats.ChartMonitor
+    to pass the Earley chart statistics of each code object parsed to.
+
+    With *chunk_size*, the module's statements are parsed in runs of
+    about that many tokens.
+
+    Returns the list of code objects in 'co' that couldn't be
+    decompiled; see SourceWalker.failures.
     """
     assert iscode(co)
 
@@ -41,47 +86,294 @@ def uncompyle(
                file=real_out)
 
     try:
-        pysource.deparse_code(bytecode_version, co, out, showasm, showast,
-                              showgrammar, code_objects=code_objects,
-                              is_pypy=is_pypy)
+        deparsed = pysource.deparse_code(
+            bytecode_version, co, out, showasm, showast, showgrammar,
+            code_objects=code_objects, is_pypy=is_pypy,
+            code_cache=code_cache, profiler=profiler, prerender=prerender,
+            parse_budget=parse_budget, bounded_memory=bounded_memory,
+            rule_profiler=rule_profiler, chart_monitor=chart_monitor,
+            chunk_size=chunk_size)
     except pysource.SourceWalkerError as e:
         # deparsing failed
         raise pysource.SourceWalkerError(str(e))
+    return deparsed.failures
 
 
 def uncompyle_file(filename, outstream=None, showasm=None, showast=False,
-                   showgrammar=False):
+                   showgrammar=False, code_cache=None, profiler=None,
+                   prerender=None, parse_budget=None, bounded_memory=False,
+                   rule_profiler=None, chart_monitor=None, chunk_size=None):
     """
     decompile Python byte-code file (.pyc)
+
+    Returns the list of code objects that couldn't be decompiled; see
+    SourceWalker.failures.
     """
 
     filename = check_object_path(filename)
     code_objects = {}
-    (version, timestamp, magic_int, co, is_pypy,
-     source_size) = load_module(filename, code_objects)
+    with phase(profiler, 'load'):
+        (version, timestamp, magic_int, co, is_pypy,
+         source_size) = load_module(filename, code_objects)
 
+    failures = []
     if type(co) == list:
         for con in co:
-            uncompyle(version, con, outstream, showasm, showast,
-                      timestamp, showgrammar, code_objects=code_objects,
-                      is_pypy=is_pypy, magic_int=magic_int)
+            failures += uncompyle(version, con, outstream, showasm,
+                                  showast, timestamp, showgrammar,
+                                  code_objects=code_objects,
+                                  is_pypy=is_pypy, magic_int=magic_int,
+                                  code_cache=code_cache, profiler=profiler,
+                                  parse_budget=parse_budget,
+                                  bounded_memory=bounded_memory,
+                                  rule_profiler=rule_profiler,
+                                  chart_monitor=chart_monitor,
+                                  chunk_size=chunk_size)
     else:
-        uncompyle(version, co, outstream, showasm, showast,
-                  timestamp, showgrammar,
-                  code_objects=code_objects, source_size=source_size,
-                  is_pypy=is_pypy, magic_int=magic_int)
+        if prerender is not None:
+            # Workers load the functions from the file themselves
+            prerender.filename = filename
+        try:
+            failures = uncompyle(version, co, outstream, showasm, showast,
+                                 timestamp, showgrammar,
+                                 code_objects=code_objects,
+                                 source_size=source_size,
+                                 is_pypy=is_pypy, magic_int=magic_int,
+                                 code_cache=code_cache, profiler=profiler,
+                                 prerender=prerender,
+                                 parse_budget=parse_budget,
+                                 bounded_memory=bounded_memory,
+                                 rule_profiler=rule_profiler,
+                                 chart_monitor=chart_monitor,
+                                 chunk_size=chunk_size)
+        finally:
+            if prerender is not None:
+                prerender.filename = None
     co = None
+    return failures
+
+def decompile_file(filename, name=None, code_cache=None):
+    """Decompile bytecode file *filename* and return a result
+    dictionary with keys
+
+      name       *name*, or else *filename*
+      source     the source text; on failure, what was generated
+                 before the error
+      version    the bytecode version, or None if the file couldn't be
+                 loaded
+      magic_int  the magic number of the bytecode file, or None
+      is_pypy    whether this is PyPy bytecode, or None
+      error      the error message, or None
+      failures   the code objects that couldn't be decompiled and
+                 were written as disassembly; see SourceWalker.failures
+      timings    seconds spent in total and in each decompilation
+                 phase; see uncompyle6.profiler
+
+    Errors, including unexpected ones, are reported in the result
+    rather than raised.
+    """
+    profiler = Profiler()
+    out = StringIO()
+    result = {'name': name or filename, 'source': '', 'version': None,
+              'magic_int': None, 'is_pypy': None, 'error': None,
+              'failures': []}
+    start = time.time()
+    try:
+        code_objects = {}
+        with phase(profiler, 'load'):
+            (version, timestamp, magic_int, co, is_pypy,
+             source_size) = load_module(check_object_path(filename),
+                                        code_objects)
+        result.update(version=version, magic_int=magic_int, is_pypy=is_pypy)
+        if type(co) != list:
+            co = [co]
+        for con in co:
+            result['failures'] += uncompyle(
+                version, con, out, timestamp=timestamp,
+                code_objects=code_objects, source_size=source_size,
+                is_pypy=is_pypy, magic_int=magic_int,
+                code_cache=code_cache, profiler=profiler)
+    except (ValueError, SyntaxError, ImportError, IOError, OSError,
+            ParserError, pysource.SourceWalkerError) as e:
+        result['error'] = str(e)
+    except Exception as e:
+        # A bug in uncompyle6; report it with the file it happened on
+        result['error'] = '%s: %s' % (e.__class__.__name__, e)
+    result['source'] = out.getvalue()
+    timings = {'total': round(time.time() - start, 6)}
+    for record in profiler.records:
+        timings[record['phase']] = round(timings.get(record['phase'], 0.0) +
+                                         record['self_time'], 6)
+    result['timings'] = timings
+    return result
+
+def decompile_bytes(data, name='<data>', code_cache=None):
+    """Like decompile_file() but for *data*, the contents of a
+    bytecode file."""
+    fd, path = tempfile.mkstemp(suffix='.pyc', prefix='uncompyle6-')
+    try:
+        with os.fdopen(fd, 'wb') as fp:
+            fp.write(data)
+        return decompile_file(path, name, code_cache)
+    finally:
+        os.remove(path)
+
+def _decompile_item(item, code_cache=None):
+    if isinstance(item, tuple):
+        return decompile_bytes(item[1], item[0], code_cache)
+    return decompile_file(item, code_cache=code_cache)
+
+def _item_failed(item, error):
+    """Returns the result dictionary for an item of decompile_many()
+    whose worker process failed with *error*."""
+    return {'name': item[0] if isinstance(item, tuple) else item,
+            'source': '', 'version': None, 'magic_int': None,
+            'is_pypy': None, 'error': error, 'failures': [],
+            'timings': {}}
+
+# The code cache of a decompile_many() worker process, and where it
+# reports which item it starts on
+_worker_cache = None
+_worker_started = None
+
+def _init_worker(code_cache, started=None):
+    global _worker_cache, _worker_started
+    # Let the parent process field Ctrl-C; it terminates the pool.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _worker_cache = code_cache
+    _worker_started = started
+
+def _worker_decompile(seq, item):
+    if _worker_started is not None:
+        # A SimpleQueue is written to right away, so the parent hears
+        # of the item even if this process dies on it.
+        _worker_started.put((os.getpid(), seq))
+    return _decompile_item(item, _worker_cache)
+
+def decompile_many(items, numproc=0, max_in_flight=None, code_cache=None):
+    """Decompile each of *items* and yield the result dictionaries of
+    decompile_file() one at a time.
+
+    An item is either the path of a bytecode file or a (name, data)
+    pair, with *data* the contents of a bytecode file. *items* can be
+    any iterable and is consumed lazily.
+
+    With *numproc* greater than 1, items are decompiled in that many
+    worker processes and results are yielded in the order they finish;
+    match them up by their 'name'. No more than *max_in_flight* items,
+    by default twice *numproc*, are handed out before their results are
+    taken, so memory use doesn't grow with the number of items. An item
+    whose worker process raises an exception or dies gets a result with
+    just its 'name' and the 'error'.
+    Otherwise items are decompiled in this process, in order.
+    """
+    if numproc <= 1:
+        for item in items:
+            yield _decompile_item(item, code_cache)
+        return
+
+    if max_in_flight is None:
+        max_in_flight = 2 * numproc
+    done = queue.Queue()
+    started = SimpleQueue()
+    # The item and AsyncResult of each item handed out, by sequence
+    # number, and the sequence number each worker process is on
+    in_flight = {}
+    running = {}
+    pool = Pool(numproc, _init_worker, (code_cache, started))
+    try:
+        for seq, item in enumerate(items):
+            if len(in_flight) >= max_in_flight:
+                yield _next_result(done, in_flight, started, running)
+            callback = lambda result, seq=seq: done.put(seq)
+            if PYTHON3:
+                result = pool.apply_async(_worker_decompile, (seq, item),
+                                          callback=callback,
+                                          error_callback=callback)
+            else:
+                result = pool.apply_async(_worker_decompile, (seq, item),
+                                          callback=callback)
+            in_flight[seq] = (item, result)
+        while in_flight:
+            yield _next_result(done, in_flight, started, running)
+        pool.close()
+    finally:
+        # Also reached when the caller stops iterating early
+        pool.terminate()
+        pool.join()
+
+def _next_result(done, in_flight, started, running):
+    """Wait for an item of decompile_many() to be done, take it off
+    *in_flight* and return its result dictionary."""
+    while True:
+        try:
+            seq = done.get(timeout=0.5)
+        except queue.Empty:
+            seq = None
+            # Python 2 has no error_callback; look for failed items
+            for i, (item, result) in in_flight.items():
+                if result.ready():
+                    seq = i
+                    break
+        if seq is not None and seq in in_flight:
+            item, result = in_flight.pop(seq)
+            try:
+                return result.get()
+            except Exception as e:
+                return _item_failed(item, '%s: %s' % (e.__class__.__name__,
+                                                      e))
+        if seq is None:
+            while not started.empty():
+                pid, i = started.get()
+                running[pid] = i
+            alive = set(p.pid for p in active_children())
+            for pid, i in list(running.items()):
+                if i not in in_flight:
+                    del running[pid]
+                elif pid not in alive:
+                    del running[pid]
+                    item, result = in_flight.pop(i)
+                    return _item_failed(item,
+                                        'worker process %d died' % pid)
+
+def output_path(out_base, filename):
+    """Returns the file below *out_base* that the source for bytecode
+    file *filename* is written to."""
+    if filename.endswith('.pyc'):
+        return os.path.join(out_base, filename[0:-1])
+    return os.path.join(out_base, filename) + '_dis'
 
 # FIXME: combine into an options parameter
 def main(in_base, out_base, files, codes, outfile=None,
          showasm=None, showast=False, do_verify=False,
          showgrammar=False, raise_on_error=False,
-         do_linemaps=False):
+         do_linemaps=False, code_cache=None, profiler=None,
+         manifest=None, prerender=None, parse_budget=None,
+         bounded_memory=False, rule_profiler=None, chart_monitor=None,
+         chunk_size=None):
     """
     in_base	base directory for input files
     out_base	base directory for output files (ignored when
     files	list of filenames to be uncompyled (relative to src_base)
     outfile	write output to this filename (overwrites out_base)
+    code_cache	uncompyle6.codecache.CodeCache to reuse the source of
+    		code objects seen before, or None
+    profiler	uncompyle6.profiler.Profiler to record per-phase timings
+    		in, or None
+    manifest	uncompyle6.manifest.Manifest of out_base; files that
+    		haven't changed since it was written are skipped
+    prerender	uncompyle6.semantics.prerender.Prerenderer to decompile
+    		the functions of each file in parallel, or None
+    parse_budget	uncompyle6.parser.ParseBudget limiting the parse of each
+    		code object, or None
+    bounded_memory	drop syntax trees and text once written out, and
+    		report the peak resident set size of each file
+    rule_profiler	uncompyle6.ruleprofile.RuleProfiler to count the use
+    		of grammar rules in, or None
+    chart_monitor	uncompyle6.chartstats.ChartMonitor to pass Earley chart
+    		statistics to and warn about charts that blow up, or None
+    chunk_size	parse the statements of modules in runs of about this
+    		many tokens, or None to parse them all at once
 
     For redirecting output to
     - <filename>		outfile=<filename> (out_base is ignored)
@@ -107,7 +399,10 @@ def main(in_base, out_base, files, codes, outfile=None,
     #        co = compile(f.read(), "", "exec")
     #    uncompyle(sys.version[:3], co, sys.stdout, showasm=showasm, showast=showast)
 
+    given_outfile = outfile
     for filename in files:
+        # The outfile of the previous file mustn't be written over
+        outfile = given_outfile
         infile = os.path.join(in_base, filename)
         if not os.path.exists(infile):
             sys.stderr.write("File '%s' doesn't exist. Skipped\n"
@@ -132,21 +427,44 @@ def main(in_base, out_base, files, codes, outfile=None,
                 os.dup2(tee.stdin.fileno(), sys.stdout.fileno())
                 os.dup2(tee.stdin.fileno(), sys.stderr.fileno())
         else:
-            if filename.endswith('.pyc'):
-                outfile = os.path.join(out_base, filename[0:-1])
-            else:
-                outfile = os.path.join(out_base, filename) + '_dis'
+            outfile = output_path(out_base, filename)
+            if (manifest is not None and
+                manifest.check(filename, infile, outfile) == 'unchanged'):
+                continue
             outstream = _get_outstream(outfile)
         # print(outfile, file=sys.stderr)
 
+        if profiler:
+            profiler.filename = filename
+        if chart_monitor:
+            chart_monitor.filename = filename
+        if bounded_memory:
+            peak_is_per_file = reset_peak_rss()
+
         # Try to uncompile the input file
+        status = 'okay'
         try:
-            uncompyle_file(infile, outstream, showasm, showast, showgrammar)
+            failures = uncompyle_file(infile, outstream, showasm, showast,
+                                      showgrammar, code_cache=code_cache,
+                                      profiler=profiler, prerender=prerender,
+                                      parse_budget=parse_budget,
+                                      bounded_memory=bounded_memory,
+                                      rule_profiler=rule_profiler,
+                                      chart_monitor=chart_monitor,
+                                      chunk_size=chunk_size)
             tot_files += 1
+            if failures:
+                sys.stderr.write("\n# file %s\n# %d code object(s) could "
+                                 "not be decompiled:\n" %
+                                 (infile, len(failures)))
+                for failure in failures:
+                    sys.stderr.write("#   %s\n" %
+                                     pysource.format_failure(failure))
         except (ValueError, SyntaxError, ParserError, pysource.SourceWalkerError) as e:
             sys.stdout.write("\n")
             sys.stderr.write("\n# file %s\n# %s\n" % (infile, e))
             failed_files += 1
+            status = 'failed'
         except KeyboardInterrupt:
             if outfile:
                 outstream.close()
@@ -165,7 +483,8 @@ def main(in_base, out_base, files, codes, outfile=None,
         else: # uncompile successful
             if outfile:
                 if do_linemaps:
-                    mapping = line_number_mapping(infile, outfile)
+                    with phase(profiler, 'linemaps'):
+                        mapping = line_number_mapping(infile, outfile)
                     outstream.write("\n\n## Line number correspondences\n")
                     import pprint
                     s = pprint.pformat(mapping, indent=2, width=80)
@@ -176,7 +495,8 @@ def main(in_base, out_base, files, codes, outfile=None,
                 if do_verify:
                     weak_verify = do_verify == 'weak'
                     try:
-                        msg = verify.compare_code_with_srcfile(infile, outfile, weak_verify=weak_verify)
+                        with phase(profiler, 'verify'):
+                            msg = verify.compare_code_with_srcfile(infile, outfile, weak_verify=weak_verify)
                         if not outfile:
                             if not msg:
                                 print('\n# okay decompiling %s' % infile)
@@ -186,6 +506,7 @@ def main(in_base, out_base, files, codes, outfile=None,
                     except verify.VerifyCmpError as e:
                         print(e)
                         verify_failed_files += 1
+                        status = 'verify_failed'
                         os.rename(outfile, outfile + '_unverified')
                         sys.stderr.write("### Error Verifying %s\n" % filename)
                         sys.stderr.write(str(e) + "\n")
@@ -202,8 +523,20 @@ def main(in_base, out_base, files, codes, outfile=None,
                 okay_files += 1
                 if not outfile:
                     mess = '\n# okay decompiling'
-                    # mem_usage = __memUsage()
                     print(mess, infile)
+        if bounded_memory:
+            peak = peak_rss()
+            if peak is not None:
+                sys.stderr.write("# %s: peak RSS %.1f MB%s\n" %
+                                 (infile, peak / 1024.0,
+                                  '' if peak_is_per_file else
+                                  ' (for the whole run so far)'))
+        if profiler:
+            profiler.flush()
+        if chart_monitor:
+            chart_monitor.clear()
+        if manifest is not None:
+            manifest.record(filename, infile, status)
         if outfile:
             sys.stdout.write("%s\r" %
                              status_msg(do_verify, tot_files, okay_files, failed_files, verify_failed_files))
@@ -214,18 +547,6 @@ def main(in_base, out_base, files, codes, outfile=None,
     return (tot_files, okay_files, failed_files, verify_failed_files)
 
 
-# ---- main ----
-
-if sys.platform.startswith('linux') and os.uname()[2][:2] in ['2.', '3.', '4.']:
-    def __memUsage():
-        mi = open('/proc/self/stat', 'r')
-        mu = mi.readline().split()[22]
-        mi.close()
-        return int(mu) / 1000000
-else:
-    def __memUsage():
-        return ''
-
 def status_msg(do_verify, tot_files, okay_files, failed_files,
                verify_failed_files):
     if tot_files == 1:
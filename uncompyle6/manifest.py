@@ -0,0 +1,97 @@
+#  Copyright (c) 2017 by Rocky Bernstein
+"""
+Manifest of an output directory, for incremental decompilation.
+
+The manifest lives in the output directory and records, for each
+input file decompiled there, its size, modification time and SHA-1
+hash, the uncompyle6 version used and the outcome. On the next run
+over the same tree, a file is skipped if it hasn't changed, was
+decompiled by this version of uncompyle6, and its output is still
+there.
+
+Size and modification time are checked first; the hash is only
+computed when they differ, so a file that was merely touched still
+counts as unchanged.
+"""
+
+import hashlib, json, os
+
+from uncompyle6.version import VERSION
+
+MANIFEST_NAME = '.uncompyle6-manifest.json'
+
+def file_sha1(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as fp:
+        for block in iter(lambda: fp.read(1 << 16), b''):
+            h.update(block)
+    return h.hexdigest()
+
+class Manifest(object):
+    """The manifest kept in output directory *out_base*.
+
+    check() says whether an input file needs decompiling, record()
+    notes the outcome, and save() writes the manifest back. counts
+    gives the number of 'new', 'changed' and 'unchanged' files seen
+    by check().
+    """
+
+    def __init__(self, out_base):
+        self.path = os.path.join(out_base, MANIFEST_NAME)
+        self.files = {}
+        self.counts = {'new': 0, 'changed': 0, 'unchanged': 0}
+        try:
+            with open(self.path) as fp:
+                self.files = json.load(fp)['files']
+        except (IOError, OSError, ValueError, KeyError):
+            pass
+
+    def check(self, filename, infile, outfile):
+        """Returns 'new', 'changed' or 'unchanged' for input file
+        *infile*, recorded as *filename*, whose output goes to
+        *outfile*. Only unchanged files can be skipped."""
+        entry = self.files.get(filename)
+        if entry is None:
+            change = 'new'
+        elif (entry.get('uncompyle6') != VERSION or
+              not os.path.exists(outfile)):
+            change = 'changed'
+        else:
+            st = os.stat(infile)
+            if (st.st_size, st.st_mtime) == (entry['size'], entry['mtime']):
+                change = 'unchanged'
+            elif st.st_size != entry['size']:
+                change = 'changed'
+            elif file_sha1(infile) == entry['sha1']:
+                # Only the modification time moved; remember the new one
+                entry['mtime'] = st.st_mtime
+                change = 'unchanged'
+            else:
+                change = 'changed'
+        self.counts[change] += 1
+        return change
+
+    def record(self, filename, infile, status):
+        """Note that *infile*, recorded as *filename*, was decompiled
+        with result *status*: 'okay', 'failed' or 'verify_failed'."""
+        st = os.stat(infile)
+        self.files[filename] = {
+            'size': st.st_size,
+            'mtime': st.st_mtime,
+            'sha1': file_sha1(infile),
+            'uncompyle6': VERSION,
+            'status': status,
+        }
+
+    def save(self):
+        if not os.path.isdir(os.path.dirname(self.path)):
+            os.makedirs(os.path.dirname(self.path))
+        tmp_path = '%s.%d' % (self.path, os.getpid())
+        with open(tmp_path, 'w') as fp:
+            json.dump({'uncompyle6': VERSION, 'files': self.files}, fp,
+                      indent=1, sort_keys=True)
+        os.rename(tmp_path, self.path)
+
+    def summary(self):
+        return ('%(new)i new, %(changed)i changed, '
+                '%(unchanged)i unchanged files skipped' % self.counts)
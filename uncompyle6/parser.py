@@ -8,11 +8,14 @@ Common uncompyle parser routines.
 
 from __future__ import print_function
 
-import sys
+import sys, os, copy, hashlib, pickle, time
 
+import spark_parser
 from xdis.code import iscode
 from spark_parser import GenericASTBuilder, DEFAULT_DEBUG as PARSER_DEFAULT_DEBUG
+from uncompyle6.version import VERSION
 from uncompyle6.show import maybe_show_asm
+from uncompyle6.profiler import phase
 
 
 class ParserError(Exception):
@@ -24,10 +27,60 @@ class ParserError(Exception):
         return "Parse error at or near `%r' instruction at offset %s\n" % \
                (self.token, self.offset)
 
+class ParseBudgetExceeded(ParserError):
+    """Parsing a code object used up the ParseBudget set for it."""
+    def __init__(self, token, offset, limit):
+        ParserError.__init__(self, token, offset)
+        self.limit = limit
+
+    def __str__(self):
+        return ("Parse budget of %s exceeded at or near `%r' instruction "
+                "at offset %s\n" % (self.limit, self.token, self.offset))
+
+class ParseBudget(object):
+    """Limits how much work parsing a single code object may take:
+    at most *max_items* Earley items and at most *max_seconds* seconds.
+    Either limit can be None. When a parse goes over a limit,
+    ParseBudgetExceeded is raised.
+    """
+
+    def __init__(self, max_items=None, max_seconds=None):
+        self.max_items = max_items
+        self.max_seconds = max_seconds
+        self.items = 0
+        self.started = None
+
+    def start(self):
+        self.items = 0
+        self.started = time.time()
+
+    def check(self, tokens, sets, i):
+        """Called after Earley set *i* of *sets* has been completed."""
+        self.items += len(sets[i])
+        if self.max_items is not None and self.items > self.max_items:
+            limit = '%d items' % self.max_items
+        elif (self.max_seconds is not None and
+              time.time() - self.started > self.max_seconds):
+            limit = '%g seconds' % self.max_seconds
+        else:
+            return
+        token = tokens[i] if tokens and i < len(tokens) else None
+        raise ParseBudgetExceeded(token, getattr(token, 'offset', None),
+                                  limit)
+
 nop_func = lambda self, args: None
 
 class PythonParser(GenericASTBuilder):
 
+    # A ParseBudget for each parse, or None
+    budget = None
+
+    # Where to count rule use; see uncompyle6.ruleprofile
+    rule_profile = None
+
+    # A uncompyle6.chartstats.ChartMonitor, or None
+    chart = None
+
     def add_unique_rule(self, rule, opname, count, customize):
         """Add rule to grammar, but only if it hasn't been added previously
            opname and count are used in the customize() semantic the actions
@@ -58,6 +111,62 @@ class PythonParser(GenericASTBuilder):
         self.add_unique_rules(rules, customize)
         return
 
+    def snapshot_grammar(self):
+        """Returns a snapshot of the current grammar which can later be
+        passed to restore_grammar() to drop any rules added since.
+        """
+        return (dict((lhs, len(rules)) for lhs, rules in self.rules.items()),
+                set(self.new_rules))
+
+    def overlay_rules(self, snapshot):
+        """Returns the rules added since *snapshot* was taken as a
+        hashable key, grouped by nonterminal in the order they were added.
+        """
+        counts = snapshot[0]
+        added = []
+        for lhs in sorted(self.rules.keys()):
+            n = counts.get(lhs, 0)
+            if len(self.rules[lhs]) > n:
+                added.append(tuple(self.rules[lhs][n:]))
+        return tuple(added)
+
+    def restore_grammar(self, snapshot):
+        """Remove the rules added since *snapshot* was taken."""
+        counts, new_rules = snapshot
+        for lhs in list(self.rules.keys()):
+            n = counts.get(lhs, 0)
+            rules = self.rules[lhs]
+            if len(rules) > n:
+                for rule in rules[n:]:
+                    del self.rule2func[rule]
+                    del self.rule2name[rule]
+                if n:
+                    del rules[n:]
+                else:
+                    del self.rules[lhs]
+                self.ruleschanged = True
+        self.new_rules = new_rules
+
+    def get_tables(self):
+        """Returns the Earley state tables SPARK derives from the grammar."""
+        return (self.nullable, self.newrules, self.new2old,
+                self.states, self.edges, self.cores)
+
+    def set_tables(self, tables):
+        """Install state tables previously returned by get_tables()
+        for an identical grammar, avoiding a rebuild in parse().
+        """
+        (self.nullable, self.newrules, self.new2old,
+         self.states, self.edges, self.cores) = tables
+        self.ruleschanged = False
+
+    def release_chart(self):
+        """Drop the Earley chart of the last parse. SPARK keeps the
+        back-pointers it builds the tree from in self.links until the
+        next parse, and for a big code object they take far more
+        memory than the tree."""
+        self.links = {}
+
     def cleanup(self):
         """
         Remove recursive references to allow garbage
@@ -114,6 +223,86 @@ class PythonParser(GenericASTBuilder):
     def typestring(self, token):
         return token.type
 
+    def makeSet(self, tokens, sets, i):
+        if self.rule_profile is not None:
+            self.makeSet_profiled(tokens, sets, i)
+        else:
+            GenericASTBuilder.makeSet(self, tokens, sets, i)
+        if self.chart is not None:
+            self.chart.set_done(tokens, sets, i)
+        if self.budget is not None:
+            self.budget.check(tokens, sets, i)
+
+    def rule_counts(self, rule):
+        """Returns the counts in self.rule_profile for the grammar rule
+        that SPARK's internal *rule* was derived from."""
+        rule = self.new2old.get(rule, rule)
+        counts = self.rule_profile.get(rule, None)
+        if counts is None:
+            # A custom rule
+            counts = self.rule_profile[rule] = [0, 0, 0, 0, 0.0]
+        return counts
+
+    def makeSet_profiled(self, tokens, sets, i):
+        """GenericParser.makeSet(), counting in self.rule_profile how
+        often each rule is predicted, completed, rejected by
+        reduce_is_invalid() and reduced, and the time spent completing
+        it. See uncompyle6.ruleprofile.
+
+        SPARK's own makeSet() does the work; for its duration add(),
+        reduce_ast() and reduce_is_invalid() are replaced by counting
+        versions. The time of a rule is what went into those for it.
+        """
+        states, rule_counts = self.states, self.rule_counts
+        add, reduce_ast = self.add, self.reduce_ast
+        reduce_is_invalid = self.reduce_is_invalid
+
+        def counting_add(set, item, i=None, predecessor=None, causal=None):
+            if causal is None:
+                if predecessor is None and item not in set:
+                    for rule, pos in states[item[0]].items:
+                        rule_counts(rule)[0] += 1
+                add(set, item, i, predecessor, causal)
+            else:
+                # A completion of rule causal[2]
+                start = time.time()
+                add(set, item, i, predecessor, causal)
+                rule_counts(causal[2])[4] += time.time() - start
+
+        def counting_reduce_ast(rule, tokens, item, k, sets):
+            start = time.time()
+            ast = reduce_ast(rule, tokens, item, k, sets)
+            rule_counts(rule)[4] += time.time() - start
+            return ast
+
+        def counting_reduce_is_invalid(rule, ast, tokens, first, last):
+            start = time.time()
+            invalid = reduce_is_invalid(rule, ast, tokens, first, last)
+            counts = rule_counts(rule)
+            counts[4] += time.time() - start
+            if invalid:
+                counts[2] += 1
+                counts[3] -= 1
+            return invalid
+
+        self.add = counting_add
+        self.reduce_ast = counting_reduce_ast
+        self.reduce_is_invalid = counting_reduce_is_invalid
+        try:
+            GenericASTBuilder.makeSet(self, tokens, sets, i)
+        finally:
+            del self.add, self.reduce_ast, self.reduce_is_invalid
+
+        # makeSet() completes the rules of every item of the set that
+        # didn't start at it; those reduce_is_invalid() didn't turn
+        # down were reduced.
+        for state, parent in sets[i]:
+            if parent != i:
+                for rule in states[state].complete:
+                    counts = rule_counts(rule)
+                    counts[1] += 1
+                    counts[3] += 1
+
     def nonterminal(self, nt, args):
         collect = ('stmts', 'exprlist', 'kvlist', '_stmts', 'print_items', 'kwargs',
                    # PYPY:
@@ -137,6 +326,8 @@ class PythonParser(GenericASTBuilder):
         return GenericASTBuilder.ambiguity(self, children)
 
     def resolve(self, list):
+        if self.chart is not None:
+            self.chart.resolved(list)
         if len(list) == 2 and 'funcdef' in list and 'assign' in list:
             return 'funcdef'
         if 'grammar' in list and 'expr' in list:
@@ -573,13 +764,156 @@ class PythonParser(GenericASTBuilder):
         '''
 
 
-def parse(p, tokens, customize):
-    p.add_custom_rules(tokens, customize)
-    ast = p.parse(tokens)
-    #  p.cleanup()
+# Earley state tables built for a base grammar plus a set of custom
+# rules, keyed by (parser class, base grammar size, custom rules).
+# States are filled in lazily as parsing proceeds, so a table set
+# keeps getting more complete as it is reused. A parser takes a table
+# set out of here for the duration of a parse and then hands it back,
+# so parsers in different threads never fill in the same tables.
+_grammar_tables = {}
+MAX_GRAMMAR_TABLES = 64
+
+def parse(p, tokens, customize, profiler=None):
+    """Parse *tokens* with *p* after adding the custom rules that
+    *customize* and *tokens* call for. The custom rules are an overlay
+    on the parser's base grammar: they are removed again afterwards so
+    that later code objects are not parsed against an ever-growing
+    grammar.
+
+    *profiler* is an optional uncompyle6.profiler.Profiler to time
+    adding the custom rules and parsing with.
+    """
+    base = p.snapshot_grammar()
+    key = None
+    try:
+        with phase(profiler, 'customize', customize=customize):
+            p.add_custom_rules(tokens, customize)
+        key = (p.__class__, sum(base[0].values()), p.overlay_rules(base))
+        tables = _grammar_tables.pop(key, None)
+        if tables is not None:
+            p.set_tables(tables)
+        if p.budget is not None:
+            p.budget.start()
+        if p.chart is not None:
+            p.chart.start(tokens, customize)
+        with phase(profiler, 'parse', customize=customize):
+            ast = p.parse(tokens)
+    finally:
+        if p.chart is not None:
+            p.chart.finish(p)
+        if key is not None and not p.ruleschanged:
+            if len(_grammar_tables) >= MAX_GRAMMAR_TABLES:
+                _grammar_tables.clear()
+            _grammar_tables[key] = p.get_tables()
+            # The tables are no longer ours to use
+            p.ruleschanged = True
+        p.restore_grammar(base)
+        p.release_chart()
     return ast
 
 
+# Built grammars, keyed by (version, compile_mode, is_pypy).  The
+# parsers stored here are templates: they are never used to parse
+# and get_python_parser() hands out copies of them instead.
+_grammar_cache = {}
+
+# Directory where built grammars are saved between runs; None disables
+# the on-disk cache. See set_grammar_cache_dir().
+GRAMMAR_CACHE_DIR = os.environ.get('UNCOMPYLE6_GRAMMAR_CACHE', None)
+
+def set_grammar_cache_dir(dirname):
+    """Save built grammars in directory *dirname* so that later runs can
+    load them instead of parsing the grammar docstrings again. Passing
+    None turns the on-disk cache off.
+    """
+    global GRAMMAR_CACHE_DIR
+    GRAMMAR_CACHE_DIR = dirname
+
+def clear_grammar_cache():
+    """Forget all grammars built so far in this process."""
+    _grammar_cache.clear()
+
+def grammar_fingerprint(parser_class):
+    """Returns a hash of the grammar rules of *parser_class*, along with
+    the versions of the code that interprets them. It is used to detect
+    stale on-disk grammars.
+    """
+    h = hashlib.md5()
+    h.update(("%s %s %s" % (parser_class.__name__, VERSION,
+                            spark_parser.VERSION)).encode('utf-8'))
+    for name in sorted(dir(parser_class)):
+        if name.startswith('p_'):
+            doc = getattr(parser_class, name).__doc__ or ''
+            h.update(("%s\n%s" % (name, doc)).encode('utf-8'))
+    return h.hexdigest()
+
+def _grammar_cache_path(version, compile_mode, is_pypy):
+    return os.path.join(GRAMMAR_CACHE_DIR, 'grammar-%s-%s-%s-py%d.pickle' %
+                        (version, compile_mode, 'pypy' if is_pypy else 'cpython',
+                         sys.version_info[0]))
+
+def _bind_rule_funcs(p):
+    """Recreate p.rule2func for the rules in p.rules. Except for
+    the augmented start rule, SPARK binds every rule function to the
+    parser object via preprocess(), so these can't be shared between
+    parsers or pickled.
+    """
+    p.rule2func = {}
+    for lhs, rules in p.rules.items():
+        for rule in rules:
+            if lhs == p._START:
+                p.rule2func[rule] = lambda args: args[1]
+            else:
+                p.rule2func[rule] = p.preprocess(rule, None)[1]
+
+def _copy_parser(template, debug_parser):
+    """Returns a new parser object with the grammar of *template*.
+    Containers are copied so that custom rules added to the copy
+    don't leak back into the template.
+    """
+    p = template.__class__.__new__(template.__class__)
+    for key, value in template.__dict__.items():
+        if isinstance(value, (dict, set, list)):
+            value = copy.copy(value)
+        p.__dict__[key] = value
+    p.rules = dict((lhs, list(rules)) for lhs, rules in template.rules.items())
+    _bind_rule_funcs(p)
+    p.debug = debug_parser
+    return p
+
+def _load_grammar(path):
+    try:
+        with open(path, 'rb') as fp:
+            parser_class, fingerprint, state = pickle.load(fp)
+        if fingerprint != grammar_fingerprint(parser_class):
+            return None
+        p = parser_class.__new__(parser_class)
+        p.__dict__.update(state)
+        _bind_rule_funcs(p)
+        return p
+    except Exception:
+        return None
+
+def _save_grammar(p, path):
+    state = dict(p.__dict__)
+    del state['rule2func']
+    tmp_path = '%s.%d' % (path, os.getpid())
+    try:
+        if not os.path.isdir(GRAMMAR_CACHE_DIR):
+            os.makedirs(GRAMMAR_CACHE_DIR)
+        with open(tmp_path, 'wb') as fp:
+            pickle.dump((p.__class__, grammar_fingerprint(p.__class__), state),
+                        fp, 2)
+        os.rename(tmp_path, path)
+    except Exception:
+        # Pickling can also fail with TypeError or AttributeError, say
+        # on a rule function; the grammar is just not kept on disk.
+        try:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        except OSError:
+            pass
+
 def get_python_parser(
         version, debug_parser=PARSER_DEFAULT_DEBUG, compile_mode='exec',
         is_pypy = False):
@@ -588,6 +922,34 @@ def get_python_parser(
     'exec', 'eval', or 'single'. See
     https://docs.python.org/3.6/library/functions.html#compile for an
     explanation of the different modes.
+
+    Built grammars are cached per (version, compile_mode, is_pypy),
+    in memory and, if GRAMMAR_CACHE_DIR is set, on disk; each call
+    returns a fresh parser object.
+    """
+    if debug_parser.get('dups', False):
+        # Duplicate rules are reported while the grammar is built
+        return build_python_parser(version, debug_parser, compile_mode)
+
+    key = (version, compile_mode, is_pypy)
+    template = _grammar_cache.get(key, None)
+    if template is None:
+        path = None
+        if GRAMMAR_CACHE_DIR:
+            path = _grammar_cache_path(version, compile_mode, is_pypy)
+            template = _load_grammar(path)
+        if template is None:
+            template = build_python_parser(version, PARSER_DEFAULT_DEBUG,
+                                           compile_mode)
+            if path:
+                _save_grammar(template, path)
+        _grammar_cache[key] = template
+    return _copy_parser(template, debug_parser)
+
+def build_python_parser(version, debug_parser=PARSER_DEFAULT_DEBUG,
+                        compile_mode='exec'):
+    """Builds the parser object for Python *version* from the grammar
+    docstrings, bypassing the grammar cache.
     """
 
     # FIXME: there has to be a better way...
@@ -0,0 +1,202 @@
+#  Copyright (c) 2017 by Rocky Bernstein
+"""
+Per-phase timing of the decompile pipeline.
+
+A Profiler records, for each code object, the wall-clock time spent
+and memory blocks allocated in each phase of decompilation:
+
+  load       reading and unmarshalling the bytecode file
+  ingest     scanner.ingest(): disassembly into tokens
+  customize  adding the custom grammar rules the tokens call for
+  parse      the Earley parse
+  checker    the AST sanity check
+  walk       the semantic walk producing source text
+  verify     comparing the output with the input (--verify)
+  linemaps   line-number correspondences (--linemaps)
+
+Phases nest: the walk of a module includes ingesting, parsing and
+walking the functions defined in it. So each record gives both the
+inclusive time and allocations, and the "self" part that excludes
+nested phases.
+
+Records are written as JSON lines, one per phase and code object,
+when flush() is called at the end of each file.
+
+rss() and peak_rss() give the memory use of the process as a whole.
+"""
+
+import json, sys, time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    # Not on Windows
+    resource = None
+
+if hasattr(sys, 'getallocatedblocks'):
+    allocated_blocks = sys.getallocatedblocks
+else:
+    # Python before 3.4 doesn't count memory blocks
+    def allocated_blocks():
+        return 0
+
+def _proc_status(field):
+    try:
+        with open('/proc/self/status') as fp:
+            for line in fp:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except (IOError, OSError, ValueError):
+        pass
+    return None
+
+def rss():
+    """Returns the resident set size of this process in kilobytes, or
+    None if it can't be found out."""
+    return _proc_status('VmRSS')
+
+def peak_rss():
+    """Returns the peak resident set size of this process in kilobytes,
+    since it started or since reset_peak_rss(), or None if it can't be
+    found out."""
+    peak = _proc_status('VmHWM')
+    if peak is None and resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == 'darwin':
+            # In bytes rather than kilobytes
+            peak //= 1024
+    return peak
+
+def reset_peak_rss():
+    """Make peak_rss() start again from the current resident set size.
+    Only Linux 4.0 and later allow this; returns whether it worked."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as fp:
+            fp.write('5')
+    except (IOError, OSError):
+        return False
+    return True
+
+class _NoPhase(object):
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        return False
+
+_no_phase = _NoPhase()
+
+def phase(profiler, name, co=None, customize=None):
+    """Returns profiler.phase(name, co, customize), or a context
+    manager that does nothing if *profiler* is None."""
+    if profiler is None:
+        return _no_phase
+    return profiler.phase(name, co, customize)
+
+class Profiler(object):
+    """Collects per-phase records for the code objects decompiled.
+
+    *out* is a file name or a file-like object that flush() writes the
+    records to as JSON lines; if it is None records accumulate in
+    attribute 'records' until clear() is called.
+    """
+
+    def __init__(self, out=None):
+        self.out = out
+        self.filename = None
+        self.records = []
+        self.stack = []
+        # Maps the id of the customize dictionary that
+        # scanner.ingest() returned to the code object ingested
+        self.code_for = {}
+
+    def label(self, co):
+        if co is None:
+            return None, None
+        return co.co_name, getattr(co, 'co_firstlineno', None)
+
+    def current_code(self):
+        for frame in reversed(self.stack):
+            if frame['co'] is not None:
+                return frame['co']
+        return None
+
+    @contextmanager
+    def phase(self, name, co=None, customize=None):
+        """Time phase *name* for code object *co*. Instead of the code
+        object, the customize dictionary scanner.ingest() returned for
+        it can be given. If neither is known, the phase is attributed
+        to the code object of the enclosing phase.
+
+        The context manager gives a dictionary; entries added to it are
+        included in the record for the phase."""
+        if co is None and customize is not None:
+            co = self.code_for.get(id(customize), (None, None))[1]
+        if co is None:
+            co = self.current_code()
+        frame = {'co': co, 'child_time': 0.0, 'child_allocs': 0}
+        extra = {}
+        self.stack.append(frame)
+        blocks = allocated_blocks()
+        start = time.time()
+        try:
+            yield extra
+        finally:
+            elapsed = time.time() - start
+            allocs = allocated_blocks() - blocks
+            self.stack.pop()
+            if self.stack:
+                self.stack[-1]['child_time'] += elapsed
+                self.stack[-1]['child_allocs'] += allocs
+            code_name, line = self.label(co)
+            extra.update({
+                'file': self.filename,
+                'code': code_name,
+                'line': line,
+                'phase': name,
+                'time': round(elapsed, 6),
+                'self_time': round(elapsed - frame['child_time'], 6),
+                'allocs': allocs,
+                'self_allocs': allocs - frame['child_allocs'],
+            })
+            self.records.append(extra)
+
+    def instrument_scanner(self, scanner):
+        """Time calls to scanner.ingest() and remember which code object
+        each returned customize dictionary belongs to. Ingest records
+        also give the number of tokens produced."""
+        ingest = scanner.ingest
+        def timed_ingest(co, *args, **kwargs):
+            with self.phase('ingest', co) as extra:
+                tokens, customize = ingest(co, *args, **kwargs)
+                extra['tokens'] = len(tokens)
+            # Keep customize alive so its id isn't reused
+            self.code_for[id(customize)] = (customize, co)
+            return tokens, customize
+        scanner.ingest = timed_ingest
+
+    def write_records(self, records):
+        lines = ''.join(json.dumps(r, sort_keys=True) + '\n'
+                        for r in records)
+        if not lines:
+            return
+        if hasattr(self.out, 'write'):
+            self.out.write(lines)
+            self.out.flush()
+        else:
+            with open(self.out, 'a') as fp:
+                fp.write(lines)
+
+    def flush(self):
+        """Write out the records so far, if there is somewhere to write
+        them, and forget them."""
+        if self.out is not None:
+            self.write_records(self.records)
+            self.clear()
+        else:
+            self.code_for = {}
+
+    def clear(self):
+        self.records = []
+        self.code_for = {}
@@ -0,0 +1,99 @@
+#  Copyright (c) 2017 by Rocky Bernstein
+"""
+Counts of how much each grammar rule is used by the Earley parser.
+
+A RuleProfiler keeps, per bytecode version and grammar rule:
+
+  predicted  how often the rule was predicted: added to an Earley set
+             with nothing of it recognized yet
+  completed  how often an item for the rule was completed, that is,
+             all of its right-hand side was recognized
+  rejected   how many of those completions reduce_is_invalid() turned
+             down
+  reduced    how many completions were applied to the items waiting
+             for the rule
+  time       seconds spent on completing the rule, including the
+             reduce_is_invalid() checks
+
+Rules that are predicted a lot but seldom completed are what makes
+parsing slow; rules that are never completed on a corpus are candidates
+for removal from the grammar.
+
+Parsers are counted once instrument_parser() has been called on them.
+Counting makes parsing a good deal slower.
+"""
+
+from __future__ import print_function
+
+import sys
+
+from spark_parser.spark import rule2str
+
+FIELDS = ('predicted', 'completed', 'rejected', 'reduced', 'time')
+
+class RuleProfiler(object):
+    """Collects rule counts from the parsers given to
+    instrument_parser(). Attribute 'counts' maps a bytecode version to
+    a dictionary from rule to the list of numbers in FIELDS.
+    """
+
+    def __init__(self):
+        self.counts = {}
+
+    def instrument_parser(self, p):
+        """Count the rule use of parser *p* from now on. All the rules
+        of its grammar are listed, so that unused ones show up too."""
+        counts = self.counts.setdefault(p.version, {})
+        for lhs, rules in p.rules.items():
+            if lhs == p._START:
+                continue
+            for rule in rules:
+                if rule not in counts:
+                    counts[rule] = [0, 0, 0, 0, 0.0]
+        p.rule_profile = counts
+
+    def merge(self, other):
+        """Add the counts of RuleProfiler *other*, for instance from a
+        worker process, to these."""
+        for version, other_counts in other.counts.items():
+            counts = self.counts.setdefault(version, {})
+            for rule, numbers in other_counts.items():
+                if rule in counts:
+                    counts[rule] = [a + b for a, b in
+                                    zip(counts[rule], numbers)]
+                else:
+                    counts[rule] = list(numbers)
+
+    def rows(self, version, sort='time'):
+        """Returns (rule, counts) pairs for *version*, largest value of
+        field *sort* first."""
+        i = FIELDS.index(sort)
+        return sorted(self.counts.get(version, {}).items(),
+                      key=lambda item: (-item[1][i], item[0]))
+
+    def unused(self, version):
+        """Returns the rules for *version* that were never completed."""
+        return sorted(rule for rule, counts in
+                      self.counts.get(version, {}).items()
+                      if counts[1] == 0)
+
+    def report(self, out=sys.stdout, sort='time', limit=None):
+        """Write, for each bytecode version, the rules sorted by field
+        *sort*, at most *limit* of them, followed by the rules that
+        were never completed."""
+        for version in sorted(self.counts):
+            rows = [row for row in self.rows(version, sort) if row[1][1]]
+            print("# Grammar rules for Python %s bytecode, by %s" %
+                  (version, sort), file=out)
+            print("#    time   predicted  completed   rejected    reduced  rule",
+                  file=out)
+            for rule, counts in rows[:limit]:
+                predicted, completed, rejected, reduced, seconds = counts
+                print("%9.4f %11d %10d %10d %10d  %s" %
+                      (seconds, predicted, completed, rejected, reduced,
+                       rule2str(rule)), file=out)
+            unused = self.unused(version)
+            print("# %d rules never completed" % len(unused), file=out)
+            for rule in unused:
+                print("#   %s" % rule2str(rule), file=out)
+            print(file=out)
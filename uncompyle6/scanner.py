@@ -13,6 +13,9 @@ scanners, e.g. for Python 2.7 or 3.4.
 from __future__ import print_function
 
 import sys
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
 
 from uncompyle6 import PYTHON3, IS_PYPY
 from uncompyle6.scanners.tok import Token
@@ -22,6 +25,14 @@ PYTHON_VERSIONS = (1.5,
                    2.1, 2.2, 2.3, 2.4, 2.5, 2.6, 2.7,
                    3.0, 3.1, 3.2, 3.3, 3.4, 3.5, 3.6)
 
+# Instructions that finish a simple statement at the top level of a
+# module, leaving the evaluation stack empty
+STATEMENT_END_OPS = frozenset([
+    'STORE_NAME', 'STORE_GLOBAL', 'STORE_ATTR', 'STORE_SUBSCR',
+    'STORE_SLICE+0', 'STORE_SLICE+1', 'STORE_SLICE+2', 'STORE_SLICE+3',
+    'DELETE_NAME', 'DELETE_GLOBAL', 'DELETE_ATTR', 'DELETE_SUBSCR',
+    'POP_TOP', 'IMPORT_STAR', 'PRINT_NEWLINE', 'EXEC_STMT'])
+
 # FIXME: DRY
 if PYTHON3:
     intern = sys.intern
@@ -45,8 +56,146 @@ class Code(object):
                 setattr(self, i, getattr(co, i))
         self._tokens, self._customize = scanner.ingest(co, classname)
 
+def in_scan_context(ingest):
+    """Decorator for the ingest() method of a scanner class. The
+    decorated method runs on a scan context, see Scanner.new_context(),
+    rather than on the scanner itself."""
+    def ingest_in_context(self, co, classname=None, code_objects={},
+                          show_asm=None):
+        if not self.is_context:
+            self = self.new_context()
+        return ingest(self, co, classname, code_objects, show_asm)
+    ingest_in_context.__name__ = ingest.__name__
+    ingest_in_context.__doc__ = ingest.__doc__
+    return ingest_in_context
+
+class Instructions(object):
+    """
+    The instructions of a code string, decoded once by Scanner.decode().
+
+    'offsets', 'ops', 'args' and 'nexts' are arrays that give for each
+    instruction in turn its offset, opcode, argument (0 if it has none)
+    and the offset of the instruction after it. 'by_op' maps each opcode
+    to an array of the offsets it is found at, and 'by_target' each
+    jump target to an array of the offsets of the jumps there.
+    """
+
+    def __init__(self, code):
+        self.code = code
+        self.offsets = array('i')
+        self.ops = array('B')
+        self.args = array('i')
+        self.nexts = array('i')
+        self.by_op = {}
+        self.by_target = {}
+
+    def position(self, offset):
+        """
+        Return the index of the instruction at <offset> in the arrays,
+        or None if no instruction starts there.
+        """
+        i = bisect_left(self.offsets, offset)
+        if i < len(self.offsets) and self.offsets[i] == offset:
+            return i
+        return None
+
+    def prefix(self, code):
+        """
+        Return the Instructions of <code>, which is the start of
+        self.code up to an instruction boundary.
+        """
+        n = len(code)
+        index = Instructions(code)
+        i = bisect_left(self.offsets, n)
+        index.offsets = self.offsets[:i]
+        index.ops = self.ops[:i]
+        index.args = self.args[:i]
+        index.nexts = self.nexts[:i]
+        for op, offsets in self.by_op.items():
+            offsets = offsets[:bisect_left(offsets, n)]
+            if offsets:
+                index.by_op[op] = offsets
+        for target, offsets in self.by_target.items():
+            offsets = offsets[:bisect_left(offsets, n)]
+            if offsets:
+                index.by_target[target] = offsets
+        return index
+
+LineTuple = namedtuple('LineTuple', ['l_no', 'next'])
+
+class LineTable(object):
+    """
+    The line of each byte offset of a code string, stored one entry per
+    run of offsets rather than one per offset. Indexing it with an
+    offset, also negative, gives a LineTuple of the line number and the
+    offset where the next line starts, like the list of one LineTuple
+    per offset it replaces.
+    """
+
+    def __init__(self):
+        # Offset where each run starts, and its LineTuple
+        self.starts = array('i')
+        self.runs = []
+        self.length = 0
+
+    def add(self, start, end, l_no, next):
+        """
+        Give offsets from start up to end line number <l_no> and next
+        line offset <next>. Runs must be added in order.
+        """
+        if start < end:
+            self.starts.append(start)
+            self.runs.append(LineTuple(l_no, next))
+            self.length = end
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, offset):
+        if offset < 0:
+            offset += self.length
+        if not 0 <= offset < self.length:
+            raise IndexError('line table index out of range')
+        return self.runs[bisect_right(self.starts, offset) - 1]
+
+class PrevTable(object):
+    """
+    For a byte offset i, the offset of the instruction before the one at
+    i; more precisely that of the instruction holding byte i-1, and 0
+    for offset 0. Looked up in Instructions rather than stored per
+    byte.
+    """
+
+    def __init__(self, index, n=None):
+        offsets = index.offsets
+        if n is not None:
+            offsets = offsets[:bisect_left(offsets, n)]
+        self.offsets = offsets
+        if offsets:
+            self.length = index.nexts[len(offsets) - 1] + 1
+        else:
+            self.length = 1
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, offset):
+        if offset < 0:
+            offset += self.length
+        if not 0 <= offset < self.length:
+            raise IndexError('prev table index out of range')
+        if offset == 0:
+            return 0
+        return self.offsets[bisect_right(self.offsets, offset - 1) - 1]
+
 class Scanner(object):
 
+    # True in the copies of a scanner that new_context() makes
+    is_context = False
+
+    # See op_index()
+    _op_index = None
+
     def __init__(self, version, show_asm=None, is_pypy=False):
         self.version = version
         self.show_asm = show_asm
@@ -66,6 +215,27 @@ class Scanner(object):
         # FIXME: This weird Python2 behavior is not Python3
         self.resetTokenClass()
 
+    def new_context(self):
+        """Returns a scan context: a copy of the scanner sharing its
+        opcode tables and settings. The state worked out while ingesting
+        a code object, self.code, self.lines, self.structs and so on, is
+        set on the context and not on the scanner. So a scanner can be
+        used by several threads at once, and ingesting a nested code
+        object doesn't disturb the ingest of its parent."""
+        ctx = self.__class__.__new__(self.__class__)
+        ctx.__dict__.update(self.__dict__)
+        ctx.is_context = True
+        return ctx
+
+    def scan(self, co, classname=None, code_objects={}, show_asm=None):
+        """Ingest code object *co* and return the scan context used.
+        Its attributes 'tokens' and 'customize' hold what ingest()
+        returns, and the rest of the scan state is there to inspect."""
+        ctx = self.new_context()
+        ctx.tokens, ctx.customize = self.__class__.ingest(
+            ctx, co, classname, code_objects, show_asm)
+        return ctx
+
     def is_jump_forward(self, offset):
         """
         Return True if the code at offset is some sort of jump forward.
@@ -99,6 +269,149 @@ class Scanner(object):
             else:
                 print('%i\t%s\t' % (i, self.opname[op]))
 
+    def statement_boundaries(self, co):
+        """
+        Return the set of offsets at which the instructions of <co> can
+        be cut into runs of whole statements that parse on their own:
+        a line starts there, the instruction before it ends a simple
+        statement, and no jump goes from one side of it to the other or
+        lands on it. Meant for the top level of modules, where blocks
+        are the only thing that can keep values on the stack across
+        statements.
+        """
+        ctx = self.new_context()
+        code = ctx.code = array('B', co.co_code)
+        n = len(code)
+        jumps = frozenset(self.opc.hasjrel + self.opc.hasjabs)
+        ends = frozenset(op for op, name in enumerate(self.opname)
+                         if name in STATEMENT_END_OPS)
+
+        # crossing[offset] counts the jumps that pass over offset
+        crossing = [0] * (n + 2)
+        targets = set()
+        for offset in ctx.op_range(0, n):
+            op = code[offset]
+            if op in jumps:
+                # Scanner3.get_target() takes no opcode
+                target = ctx.get_target(offset)
+                targets.add(target)
+                crossing[min(offset, target) + 1] += 1
+                crossing[max(offset, target) + 1] -= 1
+        for offset in range(1, n + 1):
+            crossing[offset] += crossing[offset-1]
+
+        linestarts = set(offset for offset, _ in self.opc.findlinestarts(co))
+        boundaries = set()
+        prev_op = None
+        for offset in ctx.op_range(0, n):
+            if (prev_op in ends and offset in linestarts
+                and not crossing[offset] and offset not in targets):
+                boundaries.add(offset)
+            prev_op = code[offset]
+        return boundaries
+
+    def op_index(self):
+        """
+        Return the Instructions of self.code, decoded on first use.
+        """
+        index = self._op_index
+        if index is None or index.code is not self.code:
+            index = self._op_index = self.decode(self.code)
+        return index
+
+    def decode(self, code, insts=None):
+        """
+        Decode the instructions of <code> into an Instructions. If <code>
+        has been decoded already into the xdis instructions <insts>, their
+        offsets and opcodes are used instead of decoding it again.
+        """
+        jumps = frozenset(self.opc.hasjrel + self.opc.hasjabs)
+        index = Instructions(code)
+        offsets, ops, args, nexts = (index.offsets, index.ops, index.args,
+                                     index.nexts)
+        by_op, by_target = index.by_op, index.by_target
+        n = len(code)
+        if insts is None:
+            starts = self.op_starts(code)
+        else:
+            starts = ((inst.offset, inst.opcode) for inst in insts)
+        for offset, op in starts:
+            size = self.op_size(op)
+            arg = 0
+            if size > 1 and offset + size <= n:
+                arg = code[offset+1]
+                if size == 3:
+                    arg += code[offset+2] * 256
+            offsets.append(offset)
+            ops.append(op)
+            args.append(arg)
+            nexts.append(offset + size)
+            if op not in by_op:
+                by_op[op] = array('i')
+            by_op[op].append(offset)
+            if op in jumps and offset + size <= n:
+                target = self.get_target(offset)
+                if target not in by_target:
+                    by_target[target] = array('i')
+                by_target[target].append(offset)
+        return index
+
+    def op_starts(self, code):
+        """
+        Generate the (offset, opcode) of each instruction in <code>.
+        """
+        n = len(code)
+        offset = 0
+        while offset < n:
+            op = code[offset]
+            yield offset, op
+            offset += self.op_size(op)
+
+    def jumps_to(self, target):
+        """
+        Return the offsets of the jump instructions whose target is
+        <target>, in increasing order.
+        """
+        return list(self.op_index().by_target.get(target, ()))
+
+    def instr_offsets(self, start, end, instr, target=None):
+        """
+        Return the offsets of the <instr> opcodes in the block from start
+        to end, in increasing order. With <target>, only the ones that
+        jump there.
+
+        The answers are those of going through op_range(start, end), but
+        looked up in op_index().
+        """
+        index = self.op_index()
+        code, by_op, by_target = index.code, index.by_op, index.by_target
+        if start < len(code) and index.position(start) is None:
+            # Not an instruction boundary: decode from there on,
+            # like op_range() does.
+            return [offset for offset in self.op_range(start, end)
+                    if code[offset] in instr and
+                    (target is None or self.get_target(offset) == target)]
+
+        def in_block(offsets):
+            return offsets[bisect_left(offsets, start):
+                           bisect_left(offsets, end)]
+
+        if target is not None:
+            jumps = self.opc.hasjrel + self.opc.hasjabs
+            if all(op in jumps for op in instr):
+                return [offset for offset in
+                        in_block(by_target.get(target, array('i')))
+                        if code[offset] in instr]
+            return [offset for offset in
+                    self.instr_offsets(start, end, instr)
+                    if self.get_target(offset) == target]
+        result = []
+        for op in set(instr):
+            if op in by_op:
+                result.extend(in_block(by_op[op]))
+        result.sort()
+        return result
+
     def first_instr(self, start, end, instr, target=None, exact=True):
         """
         Find the first <instr> in the block from start to end.
@@ -118,21 +431,20 @@ class Scanner(object):
         except:
             instr = [instr]
 
+        if exact or target is None:
+            found = self.instr_offsets(start, end, instr, target)
+            return found[0] if found else None
+
         result_offset = None
         current_distance = len(code)
-        for offset in self.op_range(start, end):
-            op = code[offset]
-            if op in instr:
-                if target is None:
-                    return offset
-                dest = self.get_target(offset)
-                if dest == target:
-                    return offset
-                elif not exact:
-                    new_distance = abs(target - dest)
-                    if new_distance < current_distance:
-                        current_distance = new_distance
-                        result_offset = offset
+        for offset in self.instr_offsets(start, end, instr):
+            dest = self.get_target(offset)
+            if dest == target:
+                return offset
+            new_distance = abs(target - dest)
+            if new_distance < current_distance:
+                current_distance = new_distance
+                result_offset = offset
         return result_offset
 
     def last_instr(self, start, end, instr, target=None, exact=True):
@@ -158,23 +470,22 @@ class Scanner(object):
         except:
             instr = [instr]
 
+        if exact or target is None:
+            found = self.instr_offsets(start, end, instr, target)
+            return found[-1] if found else None
+
         result_offset = None
         current_distance = len(code)
-        for offset in self.op_range(start, end):
-            op = code[offset]
-            if op in instr:
-                if target is None:
+        for offset in self.instr_offsets(start, end, instr):
+            dest = self.get_target(offset)
+            if dest == target:
+                current_distance = 0
+                result_offset = offset
+            else:
+                new_distance = abs(target - dest)
+                if new_distance <= current_distance:
+                    current_distance = new_distance
                     result_offset = offset
-                else:
-                    dest = self.get_target(offset)
-                    if dest == target:
-                        current_distance = 0
-                        result_offset = offset
-                    elif not exact:
-                        new_distance = abs(target - dest)
-                        if new_distance <= current_distance:
-                            current_distance = new_distance
-                            result_offset = offset
         return result_offset
 
     def all_instr(self, start, end, instr, target=None, include_beyond_target=False):
@@ -194,18 +505,36 @@ class Scanner(object):
         except:
             instr = [instr]
 
+        if not include_beyond_target:
+            return self.instr_offsets(start, end, instr, target)
+
         result = []
-        for offset in self.op_range(start, end):
-            op = code[offset]
-            if op in instr:
-                if target is None:
-                    result.append(offset)
-                else:
-                    t = self.get_target(offset)
-                    if include_beyond_target and t >= target:
-                        result.append(offset)
-                    elif t == target:
-                        result.append(offset)
+        for offset in self.instr_offsets(start, end, instr):
+            if target is None or self.get_target(offset) >= target:
+                result.append(offset)
+        return result
+
+    def outside_jumps(self, offsets, jumps):
+        """
+        Return the <offsets> that none of the <jumps> skips over, that is
+        which are not after a jump and before the instruction ahead of
+        its target. Order is kept.
+        """
+        spans = []
+        for jump in sorted(jumps):
+            end = self.get_target(jump) - 3
+            if spans and jump < spans[-1][1]:
+                spans[-1][1] = max(spans[-1][1], end)
+            elif jump < end:
+                spans.append([jump, end])
+        if not spans:
+            return list(offsets)
+        starts = [span[0] for span in spans]
+        result = []
+        for offset in offsets:
+            i = bisect_left(starts, offset) - 1
+            if i < 0 or offset >= spans[i][1]:
+                result.append(offset)
         return result
 
     def op_hasArgument(self, op):
@@ -216,10 +545,37 @@ class Scanner(object):
         Iterate through positions of opcodes, skipping
         arguments.
         """
+        index = self.op_index()
+        i = index.position(start)
+        if i is None:
+            return self.decode_range(start, end)
+        return iter(index.offsets[i:bisect_left(index.offsets, end)])
+
+    def decode_range(self, start, end):
+        """
+        op_range() from an offset where no instruction starts: decode
+        the code from there as if one did.
+        """
         while start < end:
             yield start
             start += self.op_size(self.code[start])
 
+    def find_sequence(self, start, end, sequence):
+        """
+        Find the runs of consecutive instructions with the opcodes in
+        <sequence> that begin in the block from start to end.
+
+        Return a list with the offsets of the last instruction of each.
+        """
+        index = self.op_index()
+        ops, offsets = index.ops, index.offsets
+        first = bisect_left(offsets, start)
+        last = bisect_left(offsets, end)
+        size = len(sequence)
+        sequence = tuple(sequence)
+        return [offsets[i+size-1] for i in range(first, last)
+                if tuple(ops[i:i+size]) == sequence]
+
     def op_size(self, op):
         """
         Return size of operator with its arguments
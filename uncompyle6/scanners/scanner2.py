@@ -22,7 +22,6 @@ Finally we save token information.
 
 from __future__ import print_function
 
-from collections import namedtuple
 from array import array
 
 from uncompyle6.scanner import op_has_argument
@@ -68,6 +67,7 @@ class Scanner2(scan.Scanner):
             varnames = co.co_varnames
         return free, names, varnames
 
+    @scan.in_scan_context
     def ingest(self, co, classname=None, code_objects={}, show_asm=None):
         """
         Pick out tokens from an uncompyle6 code object, and transform them,
@@ -308,36 +308,28 @@ class Scanner2(scan.Scanner):
         The size of self.code is returned
         """
         self.code = array('B', co.co_code)
+        index = self.op_index()
 
         n = -1
-        for i in self.op_range(0, len(self.code)):
-            if self.code[i] in (self.opc.RETURN_VALUE, self.opc.END_FINALLY):
-                n = i + 1
-                pass
-            pass
+        for op in (self.opc.RETURN_VALUE, self.opc.END_FINALLY):
+            if op in index.by_op:
+                n = max(n, index.by_op[op][-1] + 1)
         assert n > -1, "Didn't find RETURN_VALUE or END_FINALLY"
         self.code = array('B', co.co_code[:n])
+        # Decoded already
+        self._op_index = index.prefix(self.code)
 
         return n
 
     def build_prev_op(self, n):
-        self.prev = [0]
         # mapping addresses of instruction & argument
-        for i in self.op_range(0, n):
-            op = self.code[i]
-            self.prev.append(i)
-            if self.op_hasArgument(op):
-                self.prev.append(i)
-                self.prev.append(i)
-                pass
-            pass
+        self.prev = scan.PrevTable(self.op_index(), n)
 
     def build_lines_data(self, co, n):
         """
         Initializes self.lines and self.linesstartoffsets
         """
-        self.lines = []
-        linetuple = namedtuple('linetuple', ['l_no', 'next'])
+        self.lines = lines = scan.LineTable()
 
         # self.linestarts is a tuple of (offset, line number).
         # Turn that in a has that we can index
@@ -349,13 +341,11 @@ class Scanner2(scan.Scanner):
         j = 0
         (prev_start_byte, prev_line_no) = self.linestarts[0]
         for (start_byte, line_no) in self.linestarts[1:]:
-            while j < start_byte:
-                self.lines.append(linetuple(prev_line_no, start_byte))
-                j += 1
+            if j < start_byte:
+                lines.add(j, start_byte, prev_line_no, start_byte)
+                j = start_byte
             prev_line_no = start_byte
-        while j < n:
-            self.lines.append(linetuple(prev_line_no, n))
-            j+=1
+        lines.add(j, n, prev_line_no, n)
         return
 
     def build_statement_indices(self):
@@ -373,18 +363,9 @@ class Scanner2(scan.Scanner):
         stmts = self.stmts = set(prelim)
         pass_stmts = set()
         for seq in stmt_opcode_seqs:
-            for i in self.op_range(start, end-(len(seq)+1)):
-                match = True
-                for elem in seq:
-                    if elem != code[i]:
-                        match = False
-                        break
-                    i += self.op_size(code[i])
-
-                if match:
-                    i = self.prev[i]
-                    stmts.add(i)
-                    pass_stmts.add(i)
+            for i in self.find_sequence(start, end-(len(seq)+1), seq):
+                stmts.add(i)
+                pass_stmts.add(i)
 
         if pass_stmts:
             stmt_list = list(stmts)
@@ -970,26 +951,7 @@ class Scanner2(scan.Scanner):
         try:    None in instr
         except: instr = [instr]
 
-        instr_offsets = []
-        for i in self.op_range(start, end):
-            op = self.code[i]
-            if op in instr:
-                if target is None:
-                    instr_offsets.append(i)
-                else:
-                    t = self.get_target(i, op)
-                    if include_beyond_target and t >= target:
-                        instr_offsets.append(i)
-                    elif t == target:
-                        instr_offsets.append(i)
-
+        instr_offsets = self.all_instr(start, end, instr, target,
+                                       include_beyond_target)
         pjits = self.all_instr(start, end, self.opc.PJIT)
-        filtered = []
-        for pjit in pjits:
-            tgt = self.get_target(pjit)-3
-            for i in instr_offsets:
-                if i <= pjit or i >= tgt:
-                    filtered.append(i)
-            instr_offsets = filtered
-            filtered = []
-        return instr_offsets
+        return self.outside_jumps(instr_offsets, pjits)
@@ -24,11 +24,10 @@ class Scanner22(scan.Scanner23):
         self.opname = opcode_22.opname
         self.version = 2.2
         self.genexpr_name = '<generator expression>'
-        self.parent_ingest = self.ingest
-        self.ingest = self.ingest22
         return
 
-    def ingest22(self, co, classname=None, code_objects={}, show_asm=None):
-        tokens, customize = self.parent_ingest(co, classname, code_objects, show_asm)
+    def ingest(self, co, classname=None, code_objects={}, show_asm=None):
+        tokens, customize = scan.Scanner23.ingest(self, co, classname,
+                                                  code_objects, show_asm)
         tokens = [t for t in tokens if t.type != 'SET_LINENO']
         return tokens, customize
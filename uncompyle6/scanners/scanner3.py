@@ -22,10 +22,10 @@ Finally we save token information.
 
 from __future__ import print_function
 
-from collections import namedtuple
 from array import array
 
-from uncompyle6.scanner import Scanner, op_has_argument
+from uncompyle6.scanner import (
+    LineTable, PrevTable, Scanner, in_scan_context, op_has_argument)
 from xdis.code import iscode
 from xdis.bytecode import Bytecode
 from uncompyle6.scanner import Token, parse_fn_counts
@@ -131,6 +131,7 @@ class Scanner3(Scanner):
     def opName(self, offset):
         return self.opc.opname[self.code[offset]]
 
+    @in_scan_context
     def ingest(self, co, classname=None, code_objects={}, show_asm=None):
         """
         Pick out tokens from an uncompyle6 code object, and transform them,
@@ -148,10 +149,14 @@ class Scanner3(Scanner):
         """
 
         show_asm = self.show_asm if not show_asm else show_asm
+
+        # Decode the instructions just once. The assert scan, jump
+        # target detection and token emission below all use this list.
+        self.insts = list(Bytecode(co, self.opc))
+
         # show_asm = 'after'
         if show_asm in ('both', 'before'):
-            bytecode = Bytecode(co, self.opc)
-            for instr in bytecode.get_instructions(co):
+            for instr in self.insts:
                 print(instr._disassemble())
 
         # Container for tokens
@@ -162,17 +167,21 @@ class Scanner3(Scanner):
             customize['PyPy'] = 1
 
         self.code = array('B', co.co_code)
+        if self.version < 3.6:
+            # Index the instructions from the decode above too. 3.6
+            # wordcode isn't sized by op_size() the way xdis sizes it,
+            # so there op_index() still decodes self.code itself, to
+            # agree with op_range().
+            self._op_index = self.decode(self.code, self.insts)
         self.build_lines_data(co)
         self.build_prev_op()
 
-        bytecode = Bytecode(co, self.opc)
-
         # FIXME: put as its own method?
         # Scan for assertions. Later we will
         # turn 'LOAD_GLOBAL' to 'LOAD_ASSERT'.
         # 'LOAD_ASSERT' is used in assert statements.
         self.load_asserts = set()
-        bs = list(bytecode)
+        bs = self.insts
         n = len(bs)
         for i in range(n):
             inst = bs[i]
@@ -200,7 +209,7 @@ class Scanner3(Scanner):
         # Format: {target offset: [jump offsets]}
         jump_targets = self.find_jump_targets(show_asm)
 
-        for inst in bytecode:
+        for inst in self.insts:
 
             argval = inst.argval
             if inst.offset in jump_targets:
@@ -375,39 +384,29 @@ class Scanner3(Scanner):
         self.linestart_offsets = set(a for (a, _) in linestarts)
         # 'List-map' which shows line number of current op and offset of
         # first op on following line, given offset of op as index
-        self.lines = lines = []
-        LineTuple = namedtuple('LineTuple', ['l_no', 'next'])
-        # Iterate through available linestarts, and fill
-        # the data for all code offsets encountered until
-        # last linestart offset
+        self.lines = lines = LineTable()
+        # Go through available linestarts, and fill in the data for
+        # all code offsets encountered until last linestart offset
         _, prev_line_no = linestarts[0]
         offset = 0
         for start_offset, line_no in linestarts[1:]:
-            while offset < start_offset:
-                lines.append(LineTuple(prev_line_no, start_offset))
-                offset += 1
+            if offset < start_offset:
+                lines.add(offset, start_offset, prev_line_no, start_offset)
+                offset = start_offset
             prev_line_no = line_no
         # Fill remaining offsets with reference to last line number
         # and code length as start offset of following non-existing line
         codelen = len(self.code)
-        while offset < codelen:
-            lines.append(LineTuple(prev_line_no, codelen))
-            offset += 1
+        lines.add(offset, codelen, prev_line_no, codelen)
 
     def build_prev_op(self):
         """
         Compose 'list-map' which allows to jump to previous
         op, given offset of current op as index.
         """
-        code = self.code
-        codelen = len(code)
         # 2.x uses prev 3.x uses prev_op. Sigh
         # Until we get this sorted out.
-        self.prev = self.prev_op = [0]
-        for offset in self.op_range(0, codelen):
-            op = code[offset]
-            for _ in range(self.op_size(op)):
-                self.prev_op.append(offset)
+        self.prev = self.prev_op = PrevTable(self.op_index())
 
     def find_jump_targets(self, debug):
         """
@@ -441,7 +440,8 @@ class Scanner3(Scanner):
         self.setup_loops = {}  # setup_loop offset given target
 
         targets = {}
-        for offset in self.op_range(0, n):
+        for inst in self.insts:
+            offset = inst.offset
             op = code[offset]
 
             # Determine structures and fix jumps in Python versions
@@ -491,18 +491,10 @@ class Scanner3(Scanner):
         # Same for opcode sequences
         pass_stmts = set()
         for sequence in self.statement_opcode_sequences:
-            for i in self.op_range(start, end-(len(sequence)+1)):
-                match = True
-                for elem in sequence:
-                    if elem != code[i]:
-                        match = False
-                        break
-                    i += self.op_size(code[i])
-
-                if match is True:
-                    i = self.prev_op[i]
-                    stmts.add(i)
-                    pass_stmts.add(i)
+            for i in self.find_sequence(start, end-(len(sequence)+1),
+                                        sequence):
+                stmts.add(i)
+                pass_stmts.add(i)
 
         # Initialize statement list with the full data we've gathered so far
         if pass_stmts:
@@ -923,15 +915,7 @@ class Scanner3(Scanner):
         instr_offsets = self.all_instr(start, end, instr, target, include_beyond_target)
         # Get all POP_JUMP_IF_TRUE (or) offsets
         pjit_offsets = self.all_instr(start, end, self.opc.POP_JUMP_IF_TRUE)
-        filtered = []
-        for pjit_offset in pjit_offsets:
-            pjit_tgt = self.get_target(pjit_offset) - 3
-            for instr_offset in instr_offsets:
-                if instr_offset <= pjit_offset or instr_offset >= pjit_tgt:
-                    filtered.append(instr_offset)
-            instr_offsets = filtered
-            filtered = []
-        return instr_offsets
+        return self.outside_jumps(instr_offsets, pjit_offsets)
 
 if __name__ == "__main__":
     from uncompyle6 import PYTHON_VERSION
@@ -8,13 +8,20 @@ from uncompyle6 import PYTHON3
 if PYTHON3:
     intern = sys.intern
 
-class Token:
+class Token(object):
     """
     Class representing a byte-code instruction.
 
     A byte-code token is equivalent to Python 3's dis.instruction or
     the contents of one line as output by dis.dis().
     """
+    # Big modules produce many tokens that stay alive through parsing
+    # and the semantic walk, so they don't get a per-instance __dict__.
+    # The fragments walker sets parent, start and finish on tokens; it
+    # tests for them with hasattr(), so they are left unset here.
+    __slots__ = ('type', 'op', 'has_arg', 'attr', 'pattr', 'offset',
+                 'linestart', 'opc', 'parent', 'start', 'finish')
+
     # FIXME: match Python 3.4's terms:
     #    type_ should be opname
     #    linestart = starts_line
@@ -70,7 +70,8 @@ from uncompyle6.show import (
 )
 
 from uncompyle6.semantics.pysource import AST, INDENT_PER_LEVEL, NONE, PRECEDENCE, \
-     ParserError, TABLE_DIRECT, escape, find_globals, minint, MAP
+     ParserError, compile_format, eval_format_expr, find_globals, minint, \
+     node_attrs
 
 from uncompyle6.semantics.make_function import find_all_globals, find_none
 
@@ -138,9 +139,8 @@ class FragmentsWalker(pysource.SourceWalker, object):
         self.offsets = {}
         self.last_finish = -1
 
-        # FIXME: is there a better way?
-        global MAP_DIRECT_FRAGMENT
-        MAP_DIRECT_FRAGMENT = dict(TABLE_DIRECT, **TABLE_DIRECT_FRAGMENT),
+        self.MAP_DIRECT_FRAGMENT = (dict(self.TABLE_DIRECT,
+                                         **TABLE_DIRECT_FRAGMENT), )
 
     f = property(lambda s: s.params['f'],
                  lambda s, x: s.params.__setitem__('f', x),
@@ -1415,25 +1415,22 @@ class FragmentsWalker(pysource.SourceWalker, object):
         startnode_start = len(self.f.getvalue())
         start = startnode_start
 
-        fmt = entry[0]
         arg = 1
-        i = 0
         lastC = -1
         recurse_node = False
+        ops, tail = compile_format(entry[0])
 
-        m = escape.search(fmt)
-        while m:
-            i = m.end()
-            self.write(m.group('prefix'))
+        for prefix, typ, child, expr in ops:
+            if prefix:
+                self.write(prefix)
 
-            typ = m.group('type') or '{'
             node = startnode
             try:
-                if m.group('child'):
-                    node = node[int(m.group('child'))]
+                if child is not None:
+                    node = node[child]
                     node.parent = startnode
             except:
-                print(node.__dict__)
+                print(node_attrs(node))
                 raise
 
             if typ == '%':
@@ -1533,19 +1530,16 @@ class FragmentsWalker(pysource.SourceWalker, object):
                 arg += 1
 
             elif typ == '{':
-                d = node.__dict__
-                expr = m.group('expr')
                 try:
                     start = len(self.f.getvalue())
-                    self.write(eval(expr, d, d))
+                    self.write(eval_format_expr(node, expr))
                     self.set_pos_info(node, start, len(self.f.getvalue()))
                 except:
                     print(node)
                     raise
-            m = escape.search(fmt, i)
             pass
 
-        self.write(fmt[i:])
+        self.write(tail)
         fin = len(self.f.getvalue())
         if recurse_node:
             self.set_pos_info_recurse(startnode, startnode_start, fin)
@@ -1702,9 +1696,8 @@ class FragmentsWalker(pysource.SourceWalker, object):
                           returnNone=rn)
         code._tokens = None; code._customize = None # save memory
 
-    @classmethod
-    def _get_mapping(cls, node):
-        return MAP.get(node, MAP_DIRECT_FRAGMENT)
+    def _get_mapping(self, node):
+        return self.MAP.get(node, self.MAP_DIRECT_FRAGMENT)
 
     pass
 
@@ -1737,8 +1730,6 @@ def deparse_code(version, co, out=StringIO(), showasm=False, showast=False,
     # store final output stream for case of error
     scanner = get_scanner(version, is_pypy=is_pypy)
 
-    tokens, customize = scanner.ingest(co)
-
     tokens, customize = scanner.ingest(co)
     maybe_show_asm(showasm, tokens)
 
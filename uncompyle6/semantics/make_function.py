@@ -47,6 +47,27 @@ def find_none(node):
 
 # FIXME: DRY the below code...
 
+def make_function_body(self, code, ast, isLambda, indent):
+    """Write the doc string, global declarations and body of function
+    *code*, which has been parsed to *ast*. The doc string is written
+    at *indent*."""
+    if (len(code.co_consts) > 0 and
+        code.co_consts[0] is not None and not isLambda): # ugly
+        # docstring exists, dump it
+        print_docstring(self, indent, code.co_consts[0])
+
+    assert ast == 'stmts'
+
+    all_globals = find_all_globals(ast, set())
+    for g in ((all_globals & self.mod_globs) | find_globals(ast, set())):
+        self.println(self.indent, 'global ', g)
+    self.mod_globs -= all_globals
+    has_none = 'None' in code.co_names
+    rn = has_none and not find_none(ast)
+    self.gen_source(ast, code.co_name, code._customize, isLambda=isLambda,
+                    returnNone=rn)
+    code._tokens = code._customize = None # save memory
+
 def make_function3_annotate(self, node, isLambda, nested=1,
                             codeNode=None, annotate_last=-1):
     """
@@ -111,21 +132,31 @@ def make_function3_annotate(self, node, isLambda, nested=1,
         code = codeNode.attr
 
     assert iscode(code)
-    code = Code(code, self.scanner, self.currentclass)
+    # The doc string is indented differently from make_function3()
+    cache_key = self.code_cache_key(code, isLambda, 'annotate')
+    cached = self.cached_body(code, cache_key)
+    if cached is None:
+        code = Code(code, self.scanner, self.currentclass)
 
     # add defaults values to parameter names
     argc = code.co_argcount
     paramnames = list(code.co_varnames[:argc])
 
-    try:
-        ast = self.build_ast(code._tokens,
-                             code._customize,
-                             isLambda = isLambda,
-                             noneInNames = ('None' in code.co_names))
-    except ParserError as p:
-        self.write(str(p))
-        self.ERROR = p
-        return
+    failure = None
+    if cached is not None:
+        # The body comes from the cache; there is nothing to parse.
+        ast = None
+    else:
+        try:
+            ast = self.build_ast(code._tokens,
+                                 code._customize,
+                                 isLambda = isLambda,
+                                 noneInNames = ('None' in code.co_names))
+        except ParserError as p:
+            # Write the signature and then the instructions as the body,
+            # and go on with the rest of the code.
+            ast = None
+            failure = p
 
     kw_pairs = args_node.attr[1]
     indent = self.indent
@@ -216,23 +247,20 @@ def make_function3_annotate(self, node, isLambda, nested=1,
 
         self.println(":")
 
-    if (len(code.co_consts) > 0 and
-        code.co_consts[0] is not None and not isLambda): # ugly
-        # docstring exists, dump it
-        print_docstring(self, indent, code.co_consts[0])
-
-    code._tokens = None # save memory
-    assert ast == 'stmts'
+    if failure is not None:
+        self.print_unparsed(failure, code, isLambda)
+        code._tokens = code._customize = None # save memory
+        return
+    if cached is not None:
+        self.replay_cached(cached, code)
+        return
+    capture = None
+    if cache_key and self.code_cache is not None:
+        capture = self.begin_capture()
 
-    all_globals = find_all_globals(ast, set())
-    for g in ((all_globals & self.mod_globs) | find_globals(ast, set())):
-        self.println(self.indent, 'global ', g)
-    self.mod_globs -= all_globals
-    has_none = 'None' in code.co_names
-    rn = has_none and not find_none(ast)
-    self.gen_source(ast, code.co_name, code._customize, isLambda=isLambda,
-                    returnNone=rn)
-    code._tokens = code._customize = None # save memory
+    make_function_body(self, code, ast, isLambda, indent)
+    if capture:
+        self.end_capture(capture, cache_key, code)
 
 def make_function2(self, node, isLambda, nested=1, codeNode=None):
     """
@@ -252,7 +280,11 @@ def make_function2(self, node, isLambda, nested=1, codeNode=None):
         # starts with a dot (eg. '.1', '.2')
         if name.startswith('.'):
             # replace the name with the tuple-string
-            name = self.get_tuple_parameter(ast, name)
+            if ast is None:
+                # The body couldn't be parsed
+                name = '_' + name[1:]
+            else:
+                name = self.get_tuple_parameter(ast, name)
             pass
 
         if default:
@@ -287,7 +319,10 @@ def make_function2(self, node, isLambda, nested=1, codeNode=None):
         code = codeNode.attr
 
     assert iscode(code)
-    code = Code(code, self.scanner, self.currentclass)
+    cache_key = self.code_cache_key(code, isLambda)
+    cached = self.cached_body(code, cache_key)
+    if cached is None:
+        code = Code(code, self.scanner, self.currentclass)
 
     # add defaults values to parameter names
     argc = code.co_argcount
@@ -296,15 +331,21 @@ def make_function2(self, node, isLambda, nested=1, codeNode=None):
     # defaults are for last n parameters, thus reverse
     paramnames.reverse(); defparams.reverse()
 
-    try:
-        ast = self.build_ast(code._tokens,
-                             code._customize,
-                             isLambda = isLambda,
-                             noneInNames = ('None' in code.co_names))
-    except ParserError as p:
-        self.write(str(p))
-        self.ERROR = p
-        return
+    failure = None
+    if cached is not None:
+        # The body comes from the cache; there is nothing to parse.
+        ast = None
+    else:
+        try:
+            ast = self.build_ast(code._tokens,
+                                 code._customize,
+                                 isLambda = isLambda,
+                                 noneInNames = ('None' in code.co_names))
+        except ParserError as p:
+            # Write the signature and then the instructions as the body,
+            # and go on with the rest of the code.
+            ast = None
+            failure = p
 
     kw_pairs = args_node.attr[1] if self.version >= 3.0 else 0
     indent = self.indent
@@ -352,22 +393,20 @@ def make_function2(self, node, isLambda, nested=1, codeNode=None):
     else:
         self.println("):")
 
-    if len(code.co_consts) > 0 and code.co_consts[0] is not None and not isLambda: # ugly
-        # docstring exists, dump it
-        print_docstring(self, indent, code.co_consts[0])
-
-    code._tokens = None # save memory
-    assert ast == 'stmts'
+    if failure is not None:
+        self.print_unparsed(failure, code, isLambda)
+        code._tokens = code._customize = None # save memory
+        return
+    if cached is not None:
+        self.replay_cached(cached, code)
+        return
+    capture = None
+    if cache_key and self.code_cache is not None:
+        capture = self.begin_capture()
 
-    all_globals = find_all_globals(ast, set())
-    for g in ((all_globals & self.mod_globs) | find_globals(ast, set())):
-        self.println(self.indent, 'global ', g)
-    self.mod_globs -= all_globals
-    has_none = 'None' in code.co_names
-    rn = has_none and not find_none(ast)
-    self.gen_source(ast, code.co_name, code._customize, isLambda=isLambda,
-                    returnNone=rn)
-    code._tokens = None; code._customize = None # save memory
+    make_function_body(self, code, ast, isLambda, indent)
+    if capture:
+        self.end_capture(capture, cache_key, code)
 
 
 def make_function3(self, node, isLambda, nested=1, codeNode=None):
@@ -422,7 +461,10 @@ def make_function3(self, node, isLambda, nested=1, codeNode=None):
         code = codeNode.attr
 
     assert iscode(code)
-    code = Code(code, self.scanner, self.currentclass)
+    cache_key = self.code_cache_key(code, isLambda)
+    cached = self.cached_body(code, cache_key)
+    if cached is None:
+        code = Code(code, self.scanner, self.currentclass)
 
     # add defaults values to parameter names
     argc = code.co_argcount
@@ -432,15 +474,21 @@ def make_function3(self, node, isLambda, nested=1, codeNode=None):
     if not 3.0 <= self.version <= 3.2:
         paramnames.reverse(); defparams.reverse()
 
-    try:
-        ast = self.build_ast(code._tokens,
-                             code._customize,
-                             isLambda = isLambda,
-                             noneInNames = ('None' in code.co_names))
-    except ParserError as p:
-        self.write(str(p))
-        self.ERROR = p
-        return
+    failure = None
+    if cached is not None:
+        # The body comes from the cache; there is nothing to parse.
+        ast = None
+    else:
+        try:
+            ast = self.build_ast(code._tokens,
+                                 code._customize,
+                                 isLambda = isLambda,
+                                 noneInNames = ('None' in code.co_names))
+        except ParserError as p:
+            # Write the signature and then the instructions as the body,
+            # and go on with the rest of the code.
+            ast = None
+            failure = p
 
     kw_pairs = args_node.attr[1] if self.version >= 3.0 else 0
     indent = self.indent
@@ -541,19 +589,17 @@ def make_function3(self, node, isLambda, nested=1, codeNode=None):
     else:
         self.println("):")
 
-    if len(code.co_consts) > 0 and code.co_consts[0] is not None and not isLambda: # ugly
-        # docstring exists, dump it
-        print_docstring(self, self.indent, code.co_consts[0])
-
-    code._tokens = None # save memory
-    assert ast == 'stmts'
+    if failure is not None:
+        self.print_unparsed(failure, code, isLambda)
+        code._tokens = code._customize = None # save memory
+        return
+    if cached is not None:
+        self.replay_cached(cached, code)
+        return
+    capture = None
+    if cache_key and self.code_cache is not None:
+        capture = self.begin_capture()
 
-    all_globals = find_all_globals(ast, set())
-    for g in ((all_globals & self.mod_globs) | find_globals(ast, set())):
-        self.println(self.indent, 'global ', g)
-    self.mod_globs -= all_globals
-    has_none = 'None' in code.co_names
-    rn = has_none and not find_none(ast)
-    self.gen_source(ast, code.co_name, code._customize, isLambda=isLambda,
-                    returnNone=rn)
-    code._tokens = None; code._customize = None # save memory
+    make_function_body(self, code, ast, isLambda, self.indent)
+    if capture:
+        self.end_capture(capture, cache_key, code)
@@ -0,0 +1,75 @@
+#  Copyright (c) 2017 by Rocky Bernstein
+"""
+Output buffer for the source walkers.
+
+Source is generated bottom up: the text for a function body is built
+up, then handed to the enclosing class body, which in turn is handed
+to the module. Keeping text as a list of chunks means a nested result
+can be spliced into its parent by reference rather than being copied
+once per nesting level. The chunks are only joined when the text is
+really needed as a string.
+"""
+
+class OutputBuffer(object):
+    """A file-like object holding text as a list of chunks.
+
+    Besides write() and getvalue(), nested buffers can be added with
+    splice(), and the contents can be sent to a file with write_to().
+    """
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, s):
+        if isinstance(s, OutputBuffer):
+            self.splice(s)
+        elif s:
+            self.chunks.append(s)
+
+    def splice(self, other):
+        """Append the contents of buffer *other* without copying its text."""
+        self.chunks.extend(other.chunks)
+
+    def getvalue(self):
+        if len(self.chunks) > 1:
+            self.chunks = [''.join(self.chunks)]
+        return self.chunks[0] if self.chunks else ''
+
+    __str__ = getvalue
+
+    def __len__(self):
+        return sum(len(c) for c in self.chunks)
+
+    def write_to(self, out):
+        """Write the contents to file *out* chunk by chunk."""
+        if isinstance(out, OutputBuffer):
+            out.splice(self)
+        else:
+            for chunk in self.chunks:
+                out.write(chunk)
+
+    def strip_newlines(self):
+        """Returns a triple: the number of leading newlines, a buffer
+        with the text between the leading and trailing newlines, and
+        the number of trailing newlines. If the buffer holds only
+        newlines, they are all counted as leading."""
+        chunks = list(self.chunks)
+        lead = 0
+        while chunks:
+            stripped = chunks[0].lstrip('\n')
+            lead += len(chunks[0]) - len(stripped)
+            if stripped:
+                chunks[0] = stripped
+                break
+            chunks.pop(0)
+        trail = 0
+        while chunks:
+            stripped = chunks[-1].rstrip('\n')
+            trail += len(chunks[-1]) - len(stripped)
+            if stripped:
+                chunks[-1] = stripped
+                break
+            chunks.pop()
+        body = OutputBuffer()
+        body.chunks = chunks
+        return lead, body, trail
@@ -0,0 +1,170 @@
+#  Copyright (c) 2017 by Rocky Bernstein
+"""
+Decompile the functions of a module ahead of time in worker processes.
+
+In a big module, most of the time goes into ingesting, parsing and
+walking the functions and methods defined in it, one after another.
+A Prerenderer hands those to a pool of processes as soon as the
+module's top level has been parsed. Each worker loads the bytecode file
+itself, decompiles its function the way the walker would and sends back
+the text in the form the code cache stores it in.
+
+The walker then picks up the text when it gets to the function.
+Results are stored under the key of SourceWalker.code_cache_key(),
+which covers the indentation, enclosing class, known globals and so on,
+so if the walker's state turns out to be different from what the
+worker assumed, the key doesn't match and the walker decompiles the
+function itself. The output is the same either way.
+
+Only functions at the top level of a module and methods of classes at
+the top level are prerendered; functions nested deeper are decompiled
+by the worker that handles the function around them.
+"""
+
+import signal
+from multiprocessing import Pool
+
+from xdis.code import iscode
+from xdis.load import load_module
+
+from uncompyle6.codecache import CodeCache
+from uncompyle6.scanner import Code, get_scanner
+from uncompyle6.semantics.make_function import make_function_body
+from uncompyle6.semantics.output import OutputBuffer
+from uncompyle6.semantics.pysource import SourceWalker, TAB
+
+# Functions have it; class bodies and modules don't.
+CO_OPTIMIZED = 0x0001
+
+def is_function(co):
+    return (iscode(co) and not co.co_name.startswith('<')
+            and co.co_flags & CO_OPTIMIZED)
+
+# The module last loaded by this worker process:
+# (filename, (version, co, is_pypy, linestarts))
+_module = (None, None)
+
+def _load(filename):
+    global _module
+    if _module[0] != filename:
+        (version, timestamp, magic_int, co, is_pypy,
+         source_size) = load_module(filename, {})
+        scanner = get_scanner(version, is_pypy=is_pypy)
+        linestarts = dict(scanner.opc.findlinestarts(co))
+        _module = (filename, (version, co, is_pypy, linestarts))
+    return _module[1]
+
+def _init_worker():
+    # Let the parent process field Ctrl-C.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def render_function(args):
+    """Decompile the body of a function in a worker process.
+
+    *args* gives the bytecode file name, the path to the function as
+    indices into co_consts starting at the module, the walker state
+    assumed: indentation, enclosing class and module globals, and the
+    parse budget. Returns a pair of the code cache key and entry for
+    the body, or None if it couldn't be decompiled.
+    """
+    filename, path, indent, currentclass, mod_globs, parse_budget = args
+    try:
+        version, co, is_pypy, linestarts = _load(filename)
+        for i in path:
+            co = co.co_consts[i]
+        scanner = get_scanner(version, is_pypy=is_pypy)
+        walker = SourceWalker(version, OutputBuffer(), scanner,
+                              is_pypy=is_pypy, linestarts=linestarts,
+                              code_cache=CodeCache(),
+                              parse_budget=parse_budget)
+        # The state when n_mkfunc() has just written the function name
+        walker.indent = indent
+        walker.currentclass = currentclass
+        walker.mod_globs = set(mod_globs)
+        key = walker.code_cache_key(co)
+        if key is None:
+            return None
+        capture = walker.begin_capture()
+        # As left by println('):') after the parameter list
+        walker.pending_newlines = 1
+        code = Code(co, scanner, currentclass)
+        ast = walker.build_ast(code._tokens, code._customize,
+                               noneInNames=('None' in code.co_names))
+        make_function_body(walker, code, ast, False, indent)
+        walker.end_capture(capture, key, code)
+        entry = walker.code_cache.get(key)
+    except Exception:
+        # The walker will run into the problem again and report it.
+        return None
+    if entry is None:
+        return None
+    return key, entry
+
+class Prerenderer(object):
+    """Decompiles functions ahead of time in *numproc* processes.
+
+    Set attribute 'filename' to the bytecode file being decompiled
+    before decompiling its module; the workers load their functions
+    from there. If it is None nothing is prerendered. 'used' and
+    'missed' count the prerendered bodies that were and weren't
+    usable.
+    """
+
+    def __init__(self, numproc):
+        self.numproc = numproc
+        self.pool = None
+        self.filename = None
+        # Maps the id of a code object to (code object, AsyncResult)
+        self.jobs = {}
+        self.parse_budget = None
+        self.used = self.missed = 0
+
+    def submit(self, co, path, indent, currentclass, mod_globs):
+        if self.pool is None:
+            self.pool = Pool(self.numproc, _init_worker)
+        args = (self.filename, path, indent, currentclass, mod_globs,
+                self.parse_budget)
+        self.jobs[id(co)] = (co, self.pool.apply_async(render_function,
+                                                       (args,)))
+
+    def start(self, co, mod_globs, parse_budget=None):
+        """Hand the functions and class methods at the top level of
+        module *co* to the workers. *mod_globs* are the globals the
+        walker found in the module. *parse_budget* is the
+        uncompyle6.parser.ParseBudget the walker parses with, if any.
+        A function that goes over it is left to the walker."""
+        self.jobs = {}
+        self.parse_budget = parse_budget
+        if self.filename is None:
+            return
+        mod_globs = sorted(mod_globs)
+        for i, const in enumerate(co.co_consts):
+            if is_function(const):
+                self.submit(const, (i,), TAB, None, mod_globs)
+            elif iscode(const) and not const.co_name.startswith('<'):
+                # A class body
+                for j, method in enumerate(const.co_consts):
+                    if is_function(method):
+                        self.submit(method, (i, j), TAB * 2,
+                                    str(const.co_name), mod_globs)
+
+    def get(self, co, key):
+        """Returns the code cache entry for the body of code object
+        *co* if it was prerendered under *key*, waiting for it if need
+        be. Otherwise returns None."""
+        job = self.jobs.pop(id(co), None)
+        if job is None or job[0] is not co:
+            return None
+        result = job[1].get()
+        if result is None or result[0] != key:
+            self.missed += 1
+            return None
+        self.used += 1
+        return result[1]
+
+    def close(self):
+        self.jobs = {}
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
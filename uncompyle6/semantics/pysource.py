@@ -21,6 +21,9 @@ all of its children are called.
 
 Another other way to specify a semantic rule for a nonterminal is via
 rule given in one of the tables MAP_R0, MAP_R, or MAP_DIRECT.
+The module-level tables are a shared base that is never changed; each
+SourceWalker works on its own copy, to which version-specific and
+custom entries are added.
 
 These uses a printf-like syntax to direct substitution from attributes
 of the nonterminal and its children..
@@ -74,6 +77,8 @@ import sys, re
 from uncompyle6 import PYTHON3
 from xdis.code import iscode
 from uncompyle6.parser import get_python_parser
+from uncompyle6.codecache import cache_key, code_digest
+from uncompyle6.profiler import phase
 from uncompyle6.parsers.astnode import AST
 from spark_parser import GenericASTTraversal, DEFAULT_DEBUG as PARSER_DEFAULT_DEBUG
 from uncompyle6.scanner import Code, get_scanner
@@ -84,17 +89,16 @@ from uncompyle6.semantics.make_function import (
 from uncompyle6.semantics.parser_error import ParserError
 from uncompyle6.semantics.check_ast import checker
 from uncompyle6.semantics.helper import print_docstring
+from uncompyle6.semantics.output import OutputBuffer
 
 from uncompyle6.show import (
     maybe_show_ast,
 )
 
 if PYTHON3:
-    from io import StringIO
     minint = -sys.maxsize-1
     maxint = sys.maxsize
 else:
-    from StringIO import StringIO
     minint = -sys.maxint-1
     maxint = sys.maxint
 
@@ -434,6 +438,63 @@ escape = re.compile(r'''
                  ( [{] (?P<expr> [^}]* ) [}] ))
         ''', re.VERBOSE)
 
+identifier = re.compile(r'^[A-Za-z_][A-Za-z_0-9]*$')
+
+# Format templates compiled by compile_format(), keyed by template.
+compiled_formats = {}
+
+def compile_format(fmt):
+    """Compile format template *fmt* from a TABLE_DIRECT or TABLE_R
+    entry into a pair (ops, tail) that engine() can interpret without
+    running the escape regex. *ops* is a tuple of (prefix, type, child,
+    expr) for each escape: the literal text before the escape, the
+    escape type character, the child index from %[n] or None, and for
+    %{...} a (name, code) pair where name is set when the expression
+    is a plain attribute name. *tail* is the literal text after the
+    last escape. Results are cached.
+    """
+    try:
+        return compiled_formats[fmt]
+    except KeyError:
+        pass
+    ops = []
+    i = 0
+    m = escape.search(fmt)
+    while m:
+        i = m.end()
+        typ = m.group('type') or '{'
+        child = m.group('child')
+        if child:
+            child = int(child)
+        else:
+            child = None
+        expr = None
+        if typ == '{':
+            expr = m.group('expr')
+            name = expr if identifier.match(expr) else None
+            expr = (name, compile(expr, '<format %s>' % expr, 'eval'))
+        ops.append((m.group('prefix'), typ, child, expr))
+        m = escape.search(fmt, i)
+    compiled_formats[fmt] = compiled = (tuple(ops), fmt[i:])
+    return compiled
+
+def node_attrs(node):
+    """Returns the attributes of AST node or Token *node* as a
+    dictionary. Tokens have __slots__ rather than a __dict__."""
+    if hasattr(node, '__dict__'):
+        return node.__dict__
+    return dict((slot, getattr(node, slot)) for slot in node.__slots__
+                if hasattr(node, slot))
+
+def eval_format_expr(node, expr):
+    """Evaluate the %{...} expression *expr*, as compiled by
+    compile_format(), in the context of *node*."""
+    name, code = expr
+    if name is not None and hasattr(node, name):
+        return getattr(node, name)
+    d = node_attrs(node)
+    return eval(code, d, d)
+
 def is_docstring(node):
     try:
         return (node[0][0].type == 'assign' and
@@ -441,6 +502,15 @@ def is_docstring(node):
     except:
         return False
 
+def format_failure(failure):
+    """Returns a one-line description of an entry of
+    SourceWalker.failures."""
+    name = failure['code']
+    if failure['class']:
+        name = '%s.%s' % (failure['class'], name)
+    return '%s, line %s: %s: %s' % (name, failure['line'], failure['reason'],
+                                     failure['error'].split('\n')[0])
+
 class SourceWalkerError(Exception):
     def __init__(self, errmsg):
         self.errmsg = errmsg
@@ -454,7 +524,9 @@ class SourceWalker(GenericASTTraversal, object):
     def __init__(self, version, out, scanner, showast=False,
                  debug_parser=PARSER_DEFAULT_DEBUG,
                  compile_mode='exec', is_pypy=False,
-                 linestarts={}):
+                 linestarts={}, code_cache=None, profiler=None,
+                 prerender=None, parse_budget=None, bounded_memory=False,
+                 rule_profiler=None, chart_monitor=None, chunk_size=None):
         GenericASTTraversal.__init__(self, ast=None)
         self.scanner = scanner
         params = {
@@ -464,6 +536,10 @@ class SourceWalker(GenericASTTraversal, object):
         self.version = version
         self.p = get_python_parser(version, debug_parser=dict(debug_parser),
                                    compile_mode=compile_mode, is_pypy=is_pypy)
+        self.p.budget = parse_budget
+        if rule_profiler is not None:
+            rule_profiler.instrument_parser(self.p)
+        self.p.chart = chart_monitor
         self.debug_parser = dict(debug_parser)
         self.showast = showast
         self.params = params
@@ -478,6 +554,17 @@ class SourceWalker(GenericASTTraversal, object):
         self.linestarts = linestarts
         self.line_number = 0
         self.ast_errors = []
+        # Code objects that couldn't be decompiled; see print_unparsed()
+        self.failures = []
+        self.code_cache = code_cache
+        self.profiler = profiler
+        self.prerender = prerender
+        # Let go of what has been written out as soon as possible,
+        # rather than keeping it in self.text and self.ast
+        self.bounded_memory = bounded_memory
+        # Parse module tokens in runs of about this many; see
+        # parse_chunks()
+        self.chunk_size = chunk_size
 
         # hide_internal suppresses displaying the additional instructions that sometimes
         # exist in code but but were not written in the source code.
@@ -487,21 +574,51 @@ class SourceWalker(GenericASTTraversal, object):
         self.name = None
         self.version = version
         self.is_pypy = is_pypy
+        self.build_tables()
         self.customize_for_version(is_pypy, version)
 
         return
 
+    # The text from the last gen_source() is kept as an OutputBuffer
+    # and only turned into a string when someone asks for it.
+    @property
+    def text(self):
+        text = self._text
+        if isinstance(text, OutputBuffer):
+            return text.getvalue()
+        return text
+
+    @text.setter
+    def text(self, value):
+        self._text = value
+
     def indent_if_source_nl(self, line_number, indent):
         if (line_number != self.line_number):
             self.write("\n" + self.indent + INDENT_PER_LEVEL[:-1])
         return self.line_number
 
+    def build_tables(self):
+        """Give this walker its own copies of the semantic tables.
+        customize_for_version() and customize() add entries to these,
+        so walkers for different bytecode versions, possibly running
+        in different threads, don't see each other's changes."""
+        self.TABLE_DIRECT = dict(TABLE_DIRECT)
+        self.TABLE_R = dict(TABLE_R)
+        self.TABLE_R0 = dict(TABLE_R0)
+        self.MAP_DIRECT = (self.TABLE_DIRECT, )
+        self.MAP_R0 = (self.TABLE_R0, -1, 0)
+        self.MAP_R = (self.TABLE_R, -1)
+        mine = {id(MAP_DIRECT): self.MAP_DIRECT, id(MAP_R0): self.MAP_R0,
+                id(MAP_R): self.MAP_R}
+        self.MAP = dict((k, mine[id(v)]) for k, v in MAP.items())
+        self.name_module = NAME_MODULE
+
     def customize_for_version(self, is_pypy, version):
         if is_pypy:
             ########################
             # PyPy changes
             #######################
-            TABLE_DIRECT.update({
+            self.TABLE_DIRECT.update({
                 'assert_pypy':	( '%|assert %c\n' , 1 ),
                 'assert2_pypy':	( '%|assert %c, %c\n' , 1, 4 ),
                 'trystmt_pypy':	( '%|try:\n%+%c%-%c\n\n', 1, 2 ),
@@ -513,7 +630,7 @@ class SourceWalker(GenericASTTraversal, object):
             ########################
             # Without PyPy
             #######################
-            TABLE_DIRECT.update({
+            self.TABLE_DIRECT.update({
                 'assert':		( '%|assert %c\n' , 0 ),
                 'assert2':		( '%|assert %c, %c\n' , 0, 3 ),
                 'trystmt':		( '%|try:\n%+%c%-%c\n\n', 1, 3 ),
@@ -521,7 +638,7 @@ class SourceWalker(GenericASTTraversal, object):
                 'assign3':     ( '%|%c, %c, %c = %c, %c, %c\n', 5, 6, 7, 0, 1, 2 ),
                 })
         if version < 3.0:
-            TABLE_R.update({
+            self.TABLE_R.update({
                 'STORE_SLICE+0':	( '%c[:]', 0 ),
                 'STORE_SLICE+1':	( '%c[%p:]', 0, (1, 100) ),
                 'STORE_SLICE+2':	( '%c[:%p]', 0, (1, 100) ),
@@ -531,37 +648,36 @@ class SourceWalker(GenericASTTraversal, object):
                 'DELETE_SLICE+2':	( '%|del %c[:%c]\n', 0, 1 ),
                 'DELETE_SLICE+3':	( '%|del %c[%c:%c]\n', 0, 1, 2 ),
             })
-            TABLE_DIRECT.update({
+            self.TABLE_DIRECT.update({
                 'raise_stmt2':	( '%|raise %c, %c\n', 0, 1),
             })
         else:
             # Gotta love Python for its futzing around with syntax like this
-            TABLE_DIRECT.update({
+            self.TABLE_DIRECT.update({
                 'raise_stmt2':	( '%|raise %c from %c\n', 0, 1),
             })
 
         if version < 2.0:
-            TABLE_DIRECT.update({
+            self.TABLE_DIRECT.update({
                 'importlist':	( '%C', (0, maxint, ', ') ),
                 })
         else:
-            TABLE_DIRECT.update({
+            self.TABLE_DIRECT.update({
                 'importlist2':	( '%C', (0, maxint, ', ') ),
                 })
             if version <= 2.4:
-                global NAME_MODULE
-                NAME_MODULE = AST('stmt',
-                                  [ AST('assign',
-                                        [ AST('expr',
-                                              [Token('LOAD_GLOBAL', pattr='__name__',
-                                                     offset=0, has_arg=True)]),
-                                          AST('designator',
-                                              [ Token('STORE_NAME', pattr='__module__',
-                                                      offset=3, has_arg=True)])
-                                        ])])
+                self.name_module = AST('stmt',
+                                       [ AST('assign',
+                                             [ AST('expr',
+                                                   [Token('LOAD_GLOBAL', pattr='__name__',
+                                                          offset=0, has_arg=True)]),
+                                               AST('designator',
+                                                   [ Token('STORE_NAME', pattr='__module__',
+                                                           offset=3, has_arg=True)])
+                                             ])])
                 pass
             if version <= 2.3:
-                TABLE_DIRECT.update({
+                self.TABLE_DIRECT.update({
                     'tryfinallystmt': ( '%|try:\n%+%c%-%|finally:\n%+%c%-\n\n', 1, 4 )
                 })
 
@@ -569,7 +685,7 @@ class SourceWalker(GenericASTTraversal, object):
                 ########################
                 # Import style for 2.5+
                 ########################
-                TABLE_DIRECT.update({
+                self.TABLE_DIRECT.update({
                     'importmultiple': ( '%|import %c%c\n', 2, 3 ),
                     'import_cont'   : ( ', %c', 2 ),
                 })
@@ -584,24 +700,24 @@ class SourceWalker(GenericASTTraversal, object):
         # matches how we parse this in bytecode
         ########################################
         if version > 2.6:
-            TABLE_DIRECT.update({
+            self.TABLE_DIRECT.update({
                 'except_cond2':	( '%|except %c as %c:\n', 1, 5 ),
             })
         else:
-            TABLE_DIRECT.update({
+            self.TABLE_DIRECT.update({
                 'except_cond3':	( '%|except %c, %c:\n', 1, 6 ),
             })
         if 2.4 <= version <= 2.6:
-            TABLE_DIRECT.update({
+            self.TABLE_DIRECT.update({
                 'comp_for':	( ' for %c in %c', 3, 1 ),
             })
         else:
-            TABLE_DIRECT.update({
+            self.TABLE_DIRECT.update({
                 'comp_for':	( ' for %c in %c%c', 2, 0, 3 ),
             })
 
         if  version >= 3.0:
-            TABLE_DIRECT.update({
+            self.TABLE_DIRECT.update({
                 'funcdef_annotate': ( '\n\n%|def %c%c\n', -1, 0),
                 'store_locals': ( '%|# inspect.currentframe().f_locals = __locals__\n', ),
                 })
@@ -640,7 +756,7 @@ class SourceWalker(GenericASTTraversal, object):
                 ########################
                 # Python 3.4+ Additions
                 #######################
-                TABLE_DIRECT.update({
+                self.TABLE_DIRECT.update({
                     'LOAD_CLASSDEREF':	( '%{pattr}', ),
                     })
                 if version >= 3.5:
@@ -662,7 +778,7 @@ class SourceWalker(GenericASTTraversal, object):
                     ########################
                     # Python 3.6+ Additions
                     #######################
-                    TABLE_DIRECT.update({
+                    self.TABLE_DIRECT.update({
                         'fstring_expr':   ( "{%c%{conversion}}", 0),
                         'fstring_single': ( "f'{%c%{conversion}}'", 0),
                         'fstring_multi':  ( "f'%c'", 0),
@@ -721,54 +837,181 @@ class SourceWalker(GenericASTTraversal, object):
         self.indent = self.indent[:-len(indent)]
 
     def traverse(self, node, indent=None, isLambda=False):
+        return self.render(node, indent, isLambda).getvalue()
+
+    def render(self, node, indent=None, isLambda=False):
+        """Like traverse() but returns the text in an OutputBuffer, which
+        write() can splice into the enclosing output without copying."""
         self.param_stack.append(self.params)
         if indent is None: indent = self.indent
         p = self.pending_newlines
         self.pending_newlines = 0
         self.params = {
             '_globals': {},
-            'f': StringIO(),
+            'f': OutputBuffer(),
             'indent': indent,
             'isLambda': isLambda,
             }
         self.preorder(node)
         self.f.write('\n'*self.pending_newlines)
-        result = self.f.getvalue()
+        result = self.f
         self.params = self.param_stack.pop()
         self.pending_newlines = p
         return result
 
     def write(self, *data):
+        """Write *data* to the current output. Leading and trailing
+        newlines aren't written right away but are kept in
+        pending_newlines, so that runs of blank lines collapse.
+        """
         if (len(data) == 0) or (len(data) == 1 and data[0] == ''):
             return
-        out = ''.join((str(j) for j in data))
-        n = 0
-        for i in out:
-            if i == '\n':
-                n += 1
-                if n == len(out):
-                    self.pending_newlines = max(self.pending_newlines, n)
-                    return
-            elif n:
-                self.pending_newlines = max(self.pending_newlines, n)
-                out = out[n:]
-                break
-            else:
-                break
+        if len(data) == 1 and isinstance(data[0], OutputBuffer):
+            lead, out, trail = data[0].strip_newlines()
+            if not out.chunks:
+                self.pending_newlines = max(self.pending_newlines, lead)
+                return
+        else:
+            out = ''.join((str(j) for j in data))
+            stripped = out.lstrip('\n')
+            if out and not stripped:
+                self.pending_newlines = max(self.pending_newlines, len(out))
+                return
+            lead = len(out) - len(stripped)
+            out = stripped.rstrip('\n')
+            trail = len(stripped) - len(out)
 
+        if lead:
+            self.pending_newlines = max(self.pending_newlines, lead)
         if self.pending_newlines > 0:
             self.f.write('\n'*self.pending_newlines)
-            self.pending_newlines = 0
 
-        for i in out[::-1]:
-            if i == '\n':
-                self.pending_newlines += 1
+        if isinstance(out, OutputBuffer):
+            out.write_to(self.f)
+        else:
+            self.f.write(out)
+        self.pending_newlines = trail
+
+    def code_cache_key(self, code, isLambda=False, *context):
+        """Returns the key under which the source generated for the
+        body of code object *code* is cached, or None if the code cache
+        is not in use or can't be used for *code*. Besides the code
+        itself the key covers the walker state the output depends on.
+        """
+        if (self.code_cache is None and self.prerender is None) or isLambda:
+            return None
+        # Python 2 tuple parameters are named from the function's AST
+        argc = code.co_argcount
+        if [name for name in code.co_varnames[:argc] if name.startswith('.')]:
+            return None
+        digest, names = code_digest(code, self.version, self.is_pypy)
+        return cache_key(digest, self.__class__.__name__, self.indent,
+                         self.currentclass, self.prec, self.pending_newlines,
+                         self.hide_internal, sorted(self.mod_globs & names),
+                         context)
+
+    def cached_body(self, code, key):
+        """Returns the output stored under *key* for the body of code
+        object *code*, either rendered ahead of time by the prerenderer
+        or found in the code cache; None if there is none."""
+        if key is None:
+            return None
+        if self.prerender is not None:
+            entry = self.prerender.get(code, key)
+            if entry is not None:
+                if self.code_cache is not None:
+                    self.code_cache.put(key, entry)
+                return entry
+        if self.code_cache is None:
+            return None
+        return self.code_cache.get(key)
+
+    def begin_capture(self):
+        """Start collecting output so that it can be stored in the code
+        cache by end_capture()."""
+        state = (self.f, set(self.mod_globs), self.line_number,
+                 self.ERROR, len(self.ast_errors), len(self.failures))
+        self.f = OutputBuffer()
+        return state
+
+    def end_capture(self, state, key, code):
+        """Pass the output collected since begin_capture() on to the
+        real output stream and, if *key* is given and no errors were
+        found, store it in the code cache.
+        """
+        out, mod_globs, line_number, error, ast_errors, failures = state
+        text = self.f.getvalue()
+        self.f = out
+        out.write(text)
+        if (key and self.ERROR is None and error is None
+            and len(self.ast_errors) == ast_errors
+            and len(self.failures) == failures):
+            if self.line_number != line_number:
+                line_delta = self.line_number - code.co_firstlineno
             else:
-                break
-
-        if self.pending_newlines:
-            out = out[:-self.pending_newlines]
-        self.f.write(out)
+                line_delta = None
+            self.code_cache.put(key, (text, self.pending_newlines,
+                                      sorted(mod_globs - self.mod_globs),
+                                      line_delta))
+
+    def replay_cached(self, entry, code):
+        """Write output stored by end_capture() and make the same
+        changes to the walker state that generating it did."""
+        text, pending_newlines, removed_globs, line_delta = entry
+        self.f.write(text)
+        self.pending_newlines = pending_newlines
+        self.mod_globs.difference_update(removed_globs)
+        if line_delta is not None:
+            self.line_number = code.co_firstlineno + line_delta
+
+    def print_unparsed(self, error, code, isLambda=False):
+        """Write a body for code object *code*, which couldn't be
+        parsed, and add it to self.failures. *error* is the ParserError
+        raised by build_ast(). The body is a marker comment, then the
+        instructions commented out, then 'pass'.
+
+        A lambda, comprehension or generator expression, which is in
+        the middle of an expression, gets the name
+        __decompilation_failed__ instead. Its instructions are kept in
+        the failure's 'listing' and written out with the list of
+        failures at the end of the module.
+        """
+        parse_error = error.error
+        if isinstance(parse_error, python_parser.ParseBudgetExceeded):
+            marker = 'decompilation budget exceeded'
+        else:
+            marker = 'decompilation failed'
+        message = str(parse_error).strip() or repr(parse_error)
+        listing = [line for token in error.tokens
+                   for line in str(token).split('\n') if line]
+        failure = {
+            'code': code.co_name,
+            'line': getattr(code, 'co_firstlineno', None),
+            'class': self.currentclass,
+            'offset': getattr(parse_error, 'offset', None),
+            'reason': marker,
+            'error': message,
+            }
+        self.failures.append(failure)
+        if isLambda:
+            failure['listing'] = listing
+            self.write('__decompilation_failed__')
+            return
+        self.println(self.indent, '# ', marker)
+        self.println(self.indent, '# ', message)
+        for line in listing:
+            self.println(self.indent, '# ', line)
+        self.println(self.indent, 'pass')
+
+    def build_inline_ast(self, code):
+        """Returns the AST of the code object *code* of a comprehension
+        or generator expression, or None if it can't be parsed; then
+        print_unparsed() has written a name in its place."""
+        try:
+            return self.build_ast(code._tokens, code._customize)
+        except ParserError as p:
+            self.print_unparsed(p, code, isLambda=True)
+            return None
 
     def println(self, *data):
         if data and not(len(data) == 1 and data[0] ==''):
@@ -1267,7 +1510,10 @@ class SourceWalker(GenericASTTraversal, object):
         assert iscode(cn.attr)
 
         code = Code(cn.attr, self.scanner, self.currentclass)
-        ast = self.build_ast(code._tokens, code._customize)
+        ast = self.build_inline_ast(code)
+        if ast is None:
+            self.prec = p
+            return
         self.customize(code._customize)
         ast = ast[0][0][0]
 
@@ -1330,7 +1576,10 @@ class SourceWalker(GenericASTTraversal, object):
         assert iscode(code), node[code_index]
         code = Code(code, self.scanner, self.currentclass)
 
-        ast = self.build_ast(code._tokens, code._customize)
+        ast = self.build_inline_ast(code)
+        if ast is None:
+            self.prec = p
+            return
         self.customize(code._customize)
         # skip over stmts sstmt smt
         ast = ast[0][0][0]
@@ -1407,7 +1656,10 @@ class SourceWalker(GenericASTTraversal, object):
         self.prec = 27
 
         code = Code(node[1].attr, self.scanner, self.currentclass)
-        ast = self.build_ast(code._tokens, code._customize)
+        ast = self.build_inline_ast(code)
+        if ast is None:
+            self.prec = p
+            return
         self.customize(code._customize)
         if node == 'setcomp':
             ast = ast[0][0][0]
@@ -1466,7 +1718,10 @@ class SourceWalker(GenericASTTraversal, object):
         self.prec = 27
 
         code = Code(node[1].attr, self.scanner, self.currentclass)
-        ast = self.build_ast(code._tokens, code._customize)
+        ast = self.build_inline_ast(code)
+        if ast is None:
+            self.prec = p
+            return
         self.customize(code._customize)
         ast = ast[0][0][0]
         designator = ast[3]
@@ -1891,22 +2146,19 @@ class SourceWalker(GenericASTTraversal, object):
         """
 
         # self.println("----> ", startnode.type)
-        fmt = entry[0]
         arg = 1
-        i = 0
+        ops, tail = compile_format(entry[0])
 
-        m = escape.search(fmt)
-        while m:
-            i = m.end()
-            self.write(m.group('prefix'))
+        for prefix, typ, child, expr in ops:
+            if prefix:
+                self.write(prefix)
 
-            typ = m.group('type') or '{'
             node = startnode
             try:
-                if m.group('child'):
-                    node = node[int(m.group('child'))]
+                if child is not None:
+                    node = node[child]
             except:
-                print(node.__dict__)
+                print(node_attrs(node))
                 raise
 
             if   typ == '%':	self.write('%')
@@ -1975,15 +2227,12 @@ class SourceWalker(GenericASTTraversal, object):
                 self.prec = p
                 arg += 1
             elif typ == '{':
-                d = node.__dict__
-                expr = m.group('expr')
                 try:
-                    self.write(eval(expr, d, d))
+                    self.write(eval_format_expr(node, expr))
                 except:
                     print(node)
                     raise
-            m = escape.search(fmt, i)
-        self.write(fmt[i:])
+        self.write(tail)
 
     def default(self, node):
         mapping = self._get_mapping(node)
@@ -2003,6 +2252,7 @@ class SourceWalker(GenericASTTraversal, object):
         Special handling for opcodes, such as those that take a variable number
         of arguments -- we add a new entry for each in TABLE_R.
         """
+        TABLE_R = self.TABLE_R
         for k, v in list(customize.items()):
             if k in TABLE_R:
                 continue
@@ -2084,7 +2334,12 @@ class SourceWalker(GenericASTTraversal, object):
 
         indent = self.indent
         # self.println(indent, '#flags:\t', int(code.co_flags))
-        ast = self.build_ast(code._tokens, code._customize)
+        try:
+            ast = self.build_ast(code._tokens, code._customize)
+        except ParserError as p:
+            self.print_unparsed(p, code)
+            self.classes.pop(-1)
+            return
         code._tokens = None # save memory
         assert ast == 'stmts'
 
@@ -2099,7 +2354,7 @@ class SourceWalker(GenericASTTraversal, object):
                 pass
 
         try:
-            if first_stmt == NAME_MODULE:
+            if first_stmt == self.name_module:
                 if self.hide_internal:
                     del ast[0]
                     first_stmt = ast[0][0]
@@ -2179,23 +2434,39 @@ class SourceWalker(GenericASTTraversal, object):
             self.println(self.indent, 'pass')
         else:
             self.customize(customize)
-            if isLambda:
-                self.write(self.traverse(ast, isLambda=isLambda))
-            else:
-                self.text = self.traverse(ast, isLambda=isLambda)
-                self.println(self.text)
+            with phase(self.profiler, 'walk', customize=customize):
+                if isLambda:
+                    self.write(self.traverse(ast, isLambda=isLambda))
+                elif ast == 'stmts' and not isinstance(self.f, OutputBuffer):
+                    # Writing straight to the output file: send each
+                    # top-level statement as soon as it is done.
+                    self.text = OutputBuffer()
+                    for i in range(len(ast)):
+                        text = self.render(ast[i])
+                        if self.bounded_memory:
+                            # Neither the statement nor its text is
+                            # needed any more.
+                            ast[i] = None
+                        else:
+                            self._text.splice(text)
+                        self.write(text)
+                    self.println()
+                else:
+                    self.text = self.render(ast, isLambda=isLambda)
+                    self.println(self._text)
         self.name = old_name
         self.return_none = rn
 
     def build_ast(self, tokens, customize, isLambda=False,
-                  noneInNames=False, isTopLevel=False):
+                  noneInNames=False, isTopLevel=False, boundaries=None):
 
         # assert isinstance(tokens[0], Token)
 
         if isLambda:
             tokens.append(Token('LAMBDA_MARKER'))
             try:
-                ast = python_parser.parse(self.p, tokens, customize)
+                ast = python_parser.parse(self.p, tokens, customize,
+                                          self.profiler)
             except (python_parser.ParserError, AssertionError) as e:
                 raise ParserError(e, tokens)
             maybe_show_ast(self.showast, ast)
@@ -2222,47 +2493,176 @@ class SourceWalker(GenericASTTraversal, object):
 
         # Build AST from disassembly.
         try:
-            ast = python_parser.parse(self.p, tokens, customize)
+            if boundaries and self.chunk_size:
+                ast = self.parse_chunks(tokens, customize, boundaries)
+            else:
+                ast = python_parser.parse(self.p, tokens, customize,
+                                          self.profiler)
         except (python_parser.ParserError, AssertionError) as e:
             raise ParserError(e, tokens)
 
         maybe_show_ast(self.showast, ast)
 
-        checker(ast, False, self.ast_errors)
+        with phase(self.profiler, 'checker', customize=customize):
+            checker(ast, False, self.ast_errors)
 
         return ast
 
-    @classmethod
-    def _get_mapping(cls, node):
-        return MAP.get(node, MAP_DIRECT)
+    def parse_chunks(self, tokens, customize, boundaries):
+        """Parse *tokens* in runs of at least self.chunk_size tokens,
+        cut at the instruction offsets in *boundaries*, see
+        Scanner.statement_boundaries(), and join up the statement
+        lists. Earley parsing then takes time in proportion to the
+        number of runs rather than growing faster than the number of
+        tokens. If a run doesn't parse on its own, all of *tokens* is
+        parsed in one go after all."""
+        starts = [0]
+        for i in range(1, len(tokens)):
+            if (i - starts[-1] >= self.chunk_size and
+                tokens[i].offset in boundaries):
+                starts.append(i)
+        # Adding custom rules enters them in customize, which would
+        # then be taken for tokens by the next run; each run starts from
+        # the entries the scanner made.
+        scanned = dict(customize)
+        if len(starts) > 1:
+            ends = starts[1:] + [len(tokens)]
+            ast = None
+            added = {}
+            try:
+                for start, end in zip(starts, ends):
+                    customize.clear()
+                    customize.update(scanned)
+                    chunk = python_parser.parse(self.p, tokens[start:end],
+                                                customize, self.profiler)
+                    added.update(customize)
+                    if ast is None:
+                        ast = chunk
+                    else:
+                        ast.extend(chunk)
+                customize.update(added)
+                return ast
+            except python_parser.ParseBudgetExceeded:
+                raise
+            except (python_parser.ParserError, AssertionError):
+                customize.clear()
+                customize.update(scanned)
+        return python_parser.parse(self.p, tokens, customize, self.profiler)
+
+    def _get_mapping(self, node):
+        return self.MAP.get(node, self.MAP_DIRECT)
 
 
 def deparse_code(version, co, out=sys.stdout, showasm=None, showast=False,
-                 showgrammar=False, code_objects={}, compile_mode='exec', is_pypy=False):
+                 showgrammar=False, code_objects={}, compile_mode='exec',
+                 is_pypy=False, code_cache=None, profiler=None,
+                 prerender=None, parse_budget=None, bounded_memory=False,
+                 rule_profiler=None, chart_monitor=None, chunk_size=None):
     """
     ingests and deparses a given code block 'co'
+
+    If *code_cache* is a uncompyle6.codecache.CodeCache, source text
+    for 'co' and the functions in it is looked up there and stored there
+    for next time. The cache is not used when showing assembly, the AST
+    or grammar reductions.
+
+    If *profiler* is a uncompyle6.profiler.Profiler, the time spent in
+    each phase of decompiling 'co' and the code objects in it is
+    recorded there.
+
+    If *prerender* is a uncompyle6.semantics.prerender.Prerenderer,
+    the functions in 'co' are decompiled ahead of time in its worker
+    processes. Like the code cache, it is not used when showing
+    assembly, the AST or grammar reductions.
+
+    If *parse_budget* is a uncompyle6.parser.ParseBudget, code objects
+    that take more than it allows to parse are written out as commented
+    disassembly.
+
+    With *bounded_memory*, the syntax tree and text of each top-level
+    statement are dropped once the statement has been written to
+    *out*, so the result has neither 'ast' nor 'text'.
+
+    If *rule_profiler* is a uncompyle6.ruleprofile.RuleProfiler, the
+    use of each grammar rule in parsing 'co' is counted there. Since
+    only what is parsed in this process is counted, the code cache and
+    prerendering are not used then.
+
+    If *chart_monitor* is a uncompyle6.chartstats.ChartMonitor, it is
+    given the Earley chart statistics of each code object parsed.
+
+    With *chunk_size*, the statements of a module are parsed in runs
+    of about that many tokens rather than all at once.
     """
 
     assert iscode(co)
     # store final output stream for case of error
     scanner = get_scanner(version, is_pypy=is_pypy)
-
-    tokens, customize = scanner.ingest(co, code_objects=code_objects, show_asm=showasm)
+    if profiler:
+        profiler.instrument_scanner(scanner)
+    if chart_monitor:
+        chart_monitor.instrument_scanner(scanner)
 
     debug_parser = dict(PARSER_DEFAULT_DEBUG)
     if showgrammar:
         debug_parser['reduce'] = showgrammar
         debug_parser['errorstack'] = True
 
-    #  Build AST from disassembly.
+    if showasm or showast or showgrammar or rule_profiler:
+        code_cache = prerender = None
+
     linestarts = dict(scanner.opc.findlinestarts(co))
     deparsed = SourceWalker(version, out, scanner, showast=showast,
                             debug_parser=debug_parser, compile_mode=compile_mode,
                             is_pypy=is_pypy,
-                            linestarts=linestarts)
+                            linestarts=linestarts, code_cache=code_cache,
+                            profiler=profiler, prerender=prerender,
+                            parse_budget=parse_budget,
+                            bounded_memory=bounded_memory,
+                            rule_profiler=rule_profiler,
+                            chart_monitor=chart_monitor,
+                            chunk_size=chunk_size)
+
+    key = None
+    if code_cache is not None:
+        digest, _ = code_digest(co, version, is_pypy)
+        key = cache_key(digest, 'deparse_code', compile_mode)
+        cached = code_cache.get(key)
+        if cached is not None:
+            deparsed.ast = None
+            deparsed.replay_cached(cached, co)
+            return deparsed
+        capture = deparsed.begin_capture()
+
+    completed = False
+    try:
+        deparse_code_object(deparsed, co, scanner, showasm, code_objects)
+        completed = True
+    finally:
+        if key:
+            deparsed.end_capture(capture, key if completed else None, co)
+    return deparsed
+
+def deparse_code_object(deparsed, co, scanner, showasm, code_objects):
+    """Generate source for module or top-level code object 'co' using
+    SourceWalker 'deparsed'."""
+    tokens, customize = scanner.ingest(co, code_objects=code_objects, show_asm=showasm)
 
+    #  Build AST from disassembly.
     isTopLevel = co.co_name == '<module>'
-    deparsed.ast = deparsed.build_ast(tokens, customize, isTopLevel=isTopLevel)
+    boundaries = None
+    if isTopLevel and deparsed.chunk_size and len(tokens) > deparsed.chunk_size:
+        boundaries = scanner.statement_boundaries(co)
+    try:
+        deparsed.ast = deparsed.build_ast(tokens, customize,
+                                          isTopLevel=isTopLevel,
+                                          boundaries=boundaries)
+    except ParserError as p:
+        if not isinstance(p.error, python_parser.ParseBudgetExceeded):
+            raise
+        deparsed.ast = None
+        deparsed.print_unparsed(p, co)
+        return
 
     assert deparsed.ast == 'stmts', 'Should have parsed grammar start'
 
@@ -2270,6 +2670,9 @@ def deparse_code(version, co, out=sys.stdout, showasm=None, showast=False,
 
     deparsed.mod_globs = find_globals(deparsed.ast, set())
 
+    if deparsed.prerender is not None:
+        deparsed.prerender.start(co, deparsed.mod_globs, deparsed.p.budget)
+
     # convert leading '__doc__ = "..." into doc string
     try:
         if deparsed.ast[0][0] == ASSIGN_DOC_STRING(co.co_consts[0]):
@@ -2287,6 +2690,18 @@ def deparse_code(version, co, out=sys.stdout, showasm=None, showast=False,
     for g in deparsed.mod_globs:
         deparsed.write('# global %s ## Warning: Unused global' % g)
 
+    if deparsed.failures:
+        deparsed.println()
+        deparsed.println('# NOTE: %d code object(s) could not be decompiled:'
+                         % len(deparsed.failures))
+        for failure in deparsed.failures:
+            deparsed.println('#   ', format_failure(failure))
+        for failure in deparsed.failures:
+            if failure.get('listing'):
+                deparsed.println('# %s:' % format_failure(failure))
+                for line in failure['listing']:
+                    deparsed.println('#   ', line)
+
     if deparsed.ast_errors:
         deparsed.write("# NOTE: have internal decompilation grammar errors.\n")
         deparsed.write("# Use -t option to show full context.")
@@ -2296,7 +2711,9 @@ def deparse_code(version, co, out=sys.stdout, showasm=None, showast=False,
 
     if deparsed.ERROR:
         raise SourceWalkerError("Deparsing stopped due to parse error")
-    return deparsed
+
+    if deparsed.bounded_memory:
+        deparsed.ast = None
 
 if __name__ == '__main__':
     def deparse_test(co):
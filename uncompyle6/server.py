@@ -0,0 +1,315 @@
+#  Copyright (c) 2017 by Rocky Bernstein
+"""
+A long-running decompilation service.
+
+Starting uncompyle6 once per file means paying for the imports and for
+building the grammar of each bytecode version every time. A server
+keeps the scanners and grammars it has built, so after the first file
+of a version only the decompilation itself is left.
+
+Requests and responses are JSON-RPC 2.0 objects, one per line, read
+from stdin and written to stdout, or exchanged over a Unix socket.
+The methods are:
+
+  decompile  params: {"path": <bytecode file>} or
+                     {"data": <base64 contents of a bytecode file>,
+                      "name": <name to report>}
+             result: {"name", "source", "version", "magic_int",
+                      "is_pypy", "error", "failures", "timings"}
+             A decompilation failure is not an RPC error: "error"
+             gives the message and "source" what was generated before
+             it. See uncompyle6.main.decompile_file().
+  stats      counts of requests handled and failures, and the code
+             cache statistics if there is one
+  shutdown   stop the server once the response is sent
+
+With a pool of worker processes, requests are decompiled in parallel
+and each worker keeps its own warm grammars. A request whose worker
+process dies, say from a segfault, gets an internal error response.
+"""
+
+from __future__ import print_function
+
+import base64, json, os, signal, sys, threading
+from multiprocessing import Pool, active_children
+
+try:
+    from multiprocessing import SimpleQueue
+except ImportError:
+    from multiprocessing.queues import SimpleQueue
+
+try:
+    import SocketServer as socketserver
+except ImportError:
+    import socketserver
+
+from uncompyle6.main import decompile_bytes, decompile_file
+from uncompyle6.parser import get_python_parser
+from uncompyle6.scanner import get_scanner
+
+# JSON-RPC error codes
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+
+class RPCError(Exception):
+    def __init__(self, code, message):
+        Exception.__init__(self, message)
+        self.code = code
+
+def warm_up(versions, is_pypy=False):
+    """Build the scanners and grammars for bytecode *versions*."""
+    for version in versions:
+        version = float(version)
+        get_scanner(version, is_pypy)
+        get_python_parser(version, compile_mode='exec', is_pypy=is_pypy)
+
+def decompile_request(params, code_cache=None):
+    """Carry out the decompile method for request parameters *params*."""
+    if not isinstance(params, dict):
+        raise RPCError(INVALID_PARAMS, 'params must be an object')
+    if 'path' in params:
+        return decompile_file(params['path'], params.get('name'), code_cache)
+    if 'data' not in params:
+        raise RPCError(INVALID_PARAMS, 'either "path" or "data" is needed')
+    try:
+        data = base64.b64decode(params['data'].encode('ascii'))
+    except Exception as e:
+        raise RPCError(INVALID_PARAMS, 'bad base64 data: %s' % e)
+    return decompile_bytes(data, params.get('name', '<data>'), code_cache)
+
+# The code cache of a pool worker process, and where it reports which
+# request it starts on
+_worker_cache = None
+_worker_started = None
+
+def _init_worker(versions, is_pypy, code_cache, started=None):
+    global _worker_cache, _worker_started
+    # The server process fields Ctrl-C; it terminates the pool.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # The parser prints parse errors; keep them out of the responses
+    # when serving on stdout.
+    sys.stdout = sys.stderr
+    _worker_cache = code_cache
+    _worker_started = started
+    warm_up(versions, is_pypy)
+
+def _worker_decompile(seq, params):
+    if _worker_started is not None:
+        # A SimpleQueue is written to right away, so the server hears
+        # of the request even if this process dies on it.
+        _worker_started.put((os.getpid(), seq))
+    try:
+        return 'result', decompile_request(params, _worker_cache)
+    except RPCError as e:
+        return 'error', (e.code, str(e))
+
+class Server(object):
+    """Dispatches JSON-RPC requests to decompile bytecode.
+
+    *workers* is the number of worker processes to decompile in; with
+    0, requests are handled in the server process one at a time.
+    *versions* are the bytecode versions to build grammars for at
+    start-up, and *code_cache* an optional
+    uncompyle6.codecache.CodeCache.
+    """
+
+    methods = ('decompile', 'stats', 'shutdown')
+
+    def __init__(self, workers=0, versions=(), is_pypy=False,
+                 code_cache=None):
+        self.code_cache = code_cache
+        self.stop = threading.Event()
+        self.lock = threading.Lock()
+        self.counts = {'requests': 0, 'decompiled': 0, 'failed': 0}
+        self.socket_server = None
+        # The sequence number of the last request handed to the pool,
+        # and the one each worker process is on
+        self.seq = 0
+        self.running = {}
+        if workers > 0:
+            self.started = SimpleQueue()
+            self.pool = Pool(workers, _init_worker,
+                             (versions, is_pypy, code_cache, self.started))
+        else:
+            self.pool = None
+            warm_up(versions, is_pypy)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+    def count(self, key):
+        with self.lock:
+            self.counts[key] += 1
+
+    def decompile(self, params):
+        if self.pool is None:
+            result = decompile_request(params, self.code_cache)
+        else:
+            kind, value = self.pool_decompile(params)
+            if kind == 'error':
+                raise RPCError(*value)
+            result = value
+        self.count('failed' if result['error'] else 'decompiled')
+        return result
+
+    def pool_decompile(self, params):
+        """Decompile *params* in a pool worker. Raises an RPCError if the
+        worker process dies on it; the pool starts another."""
+        with self.lock:
+            self.seq += 1
+            seq = self.seq
+        result = self.pool.apply_async(_worker_decompile, (seq, params))
+        try:
+            while True:
+                result.wait(0.5)
+                if result.ready():
+                    return result.get()
+                pid = self.dead_worker(seq)
+                if pid is not None:
+                    raise RPCError(INTERNAL_ERROR,
+                                   'worker process %d died' % pid)
+        finally:
+            with self.lock:
+                for pid, i in list(self.running.items()):
+                    if i == seq:
+                        del self.running[pid]
+
+    def dead_worker(self, seq):
+        """Returns the process id of the worker that started on request
+        *seq* if it is no longer alive, else None."""
+        with self.lock:
+            while not self.started.empty():
+                pid, i = self.started.get()
+                self.running[pid] = i
+            alive = set(p.pid for p in active_children())
+            for pid, i in self.running.items():
+                if i == seq and pid not in alive:
+                    return pid
+        return None
+
+    def stats(self, params):
+        stats = dict(self.counts)
+        if self.code_cache is not None and self.pool is None:
+            stats['cache'] = self.code_cache.stats()
+        return stats
+
+    def shutdown(self, params):
+        self.stop.set()
+        if self.socket_server is not None:
+            # shutdown() waits for serve_forever() in the main thread
+            threading.Thread(target=self.socket_server.shutdown).start()
+        return None
+
+    def handle(self, request):
+        """Returns the JSON-RPC response object for *request*, or None
+        for a notification."""
+        self.count('requests')
+        if not isinstance(request, dict) or 'method' not in request:
+            return self.error(None, INVALID_REQUEST, 'Invalid Request')
+        req_id = request.get('id')
+        if request['method'] not in self.methods:
+            return self.error(req_id, METHOD_NOT_FOUND,
+                              'Method not found: %s' % request['method'])
+        try:
+            result = getattr(self, request['method'])(request.get('params'))
+        except RPCError as e:
+            return self.error(req_id, e.code, str(e))
+        except Exception as e:
+            return self.error(req_id, INTERNAL_ERROR,
+                              '%s: %s' % (e.__class__.__name__, e))
+        if 'id' not in request:
+            return None
+        return {'jsonrpc': '2.0', 'id': req_id, 'result': result}
+
+    def error(self, req_id, code, message):
+        return {'jsonrpc': '2.0', 'id': req_id,
+                'error': {'code': code, 'message': message}}
+
+    def parse_line(self, line):
+        """Returns a pair: the request decoded from *line*, and None;
+        or None and the response for a line that isn't JSON."""
+        try:
+            return json.loads(line), None
+        except ValueError as e:
+            return None, self.error(None, PARSE_ERROR, 'Parse error: %s' % e)
+
+    def handle_line(self, line):
+        """Returns the response line for request line *line*, or None."""
+        request, response = self.parse_line(line)
+        if response is None:
+            response = self.handle(request)
+        if response is None:
+            return None
+        return json.dumps(response) + '\n'
+
+    def serve_stdio(self, infile=None, outfile=None):
+        """Serve requests read from *infile*, by default stdin, writing
+        responses to *outfile*, by default stdout. With a worker pool,
+        several requests are in progress at once and responses may come
+        back out of order."""
+        infile = infile or sys.stdin
+        outfile = outfile or sys.stdout
+        write_lock = threading.Lock()
+
+        def send(response):
+            if response is not None:
+                with write_lock:
+                    outfile.write(json.dumps(response) + '\n')
+                    outfile.flush()
+
+        def respond(request):
+            send(self.handle(request))
+
+        threads = []
+        for line in iter(infile.readline, ''):
+            if not line.strip():
+                continue
+            request, response = self.parse_line(line)
+            if response is not None:
+                send(response)
+            elif (self.pool is not None and isinstance(request, dict) and
+                  request.get('method') == 'decompile'):
+                thread = threading.Thread(target=respond, args=(request,))
+                thread.start()
+                threads = [t for t in threads if t.is_alive()] + [thread]
+            else:
+                respond(request)
+            if self.stop.is_set():
+                break
+        for thread in threads:
+            thread.join()
+
+    def serve_socket(self, path):
+        """Serve requests on Unix socket *path*, one thread per
+        connection, until a shutdown request comes in."""
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in iter(self.rfile.readline, b''):
+                    if not line.strip():
+                        continue
+                    response = server.handle_line(line.decode('utf-8'))
+                    if response is not None:
+                        self.wfile.write(response.encode('utf-8'))
+                        self.wfile.flush()
+                    if server.stop.is_set():
+                        break
+
+        if os.path.exists(path):
+            os.remove(path)
+        self.socket_server = socketserver.ThreadingUnixStreamServer(path,
+                                                                    Handler)
+        self.socket_server.daemon_threads = True
+        try:
+            self.socket_server.serve_forever()
+        finally:
+            self.socket_server.server_close()
+            self.socket_server = None
+            os.remove(path)